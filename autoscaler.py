@@ -0,0 +1,476 @@
+import os
+import sys
+import json
+import math
+import time
+import shlex
+import base64
+import argparse
+import subprocess
+import urllib.request
+import pika
+import broker_config
+import metrics
+from result_store import ResultStore, RESULT_DB
+
+"""
+usage: python3 autoscaler.py [--inventory inventory.ini] [--local] [--stats api|broker]
+                             [--min N] [--max N] [--drain-target SECONDS] [--poll SECONDS]
+                             [--metrics-port 9300] [--dry-run] [--once]
+
+Runs on the host and sizes the number of consumer.py processes to the
+backlog, instead of one consumer per worker started by hand.
+
+Every POLL_SECONDS it reads the depth of task_queue (ready + unacked), the
+number of consumers and the throughput, either from the RabbitMQ management
+API (--stats api, the default) or, without the plugin, from a passive queue
+declare plus the growth of results.db (--stats broker). Each worker in the
+inventory is probed over ssh for its cores, MemAvailable and running
+consumers.
+
+The fleet is sized to empty the backlog in TARGET_DRAIN_SECONDS at the
+throughput per consumer seen so far, between --min and the capacity of the
+nodes: CPUS_PER_CONSUMER cores and MEMORY_PER_CONSUMER of MemAvailable per
+consumer, and at most max_consumers=N if set on the host's inventory line.
+Scaling up starts at most MAX_STEP consumers per poll, on the nodes with the
+most free capacity. Scaling down waits until fewer consumers have been
+wanted for SCALE_DOWN_DELAY, then sends SIGTERM to the newest consumers on
+the busiest nodes: they stop taking tasks, finish and ack the running ones
+and exit. A consumer still draining after DRAIN_TIMEOUT is killed (its
+unacked tasks are redelivered).
+
+Each decision is printed and appended to DECISION_LOG (JSON lines); the
+queue, the fleet and the decisions are served as Prometheus metrics on
+--metrics-port. --local manages consumers on this machine instead of the
+workers (e.g. with BROKER_HOST=localhost); --dry-run only logs.
+"""
+
+# ==========================================
+# Configuration
+# ==========================================
+INVENTORY = 'inventory.ini'
+WORKER_DIR = '/home/almalinux'          # Where consumer.py is deployed on the workers
+MANAGEMENT_API = os.environ.get('RABBITMQ_API', 'http://localhost:15672/api')
+API_USER = os.environ.get('RABBITMQ_API_USER', 'guest')            # guest may log in from localhost
+API_PASSWORD = os.environ.get('RABBITMQ_API_PASSWORD', 'guest')
+POLL_SECONDS = 30.0
+TARGET_DRAIN_SECONDS = 1800     # Size the fleet to empty the backlog in this long
+MIN_CONSUMERS = 1               # Cluster-wide, also while the queue is empty
+MAX_STEP = 4                    # Consumers started per poll at most
+SCALE_DOWN_DELAY = 300          # Fewer consumers must be wanted this long before any is stopped
+DRAIN_TIMEOUT = 3600            # SIGKILL a consumer still draining after this long
+CONSUMER_SLOTS = 1              # consumer.py --slots of each consumer started
+CPUS_PER_CONSUMER = 1           # Cores one consumer keeps busy (slots x threads)
+MEMORY_PER_CONSUMER = 3 * 2**30 # Peak RSS of one consumer (S4Pred + hhsearch over pdb70)
+MEMORY_FRACTION = 0.8           # Share of a node's MemAvailable new consumers may take
+FALLBACK_TASK_SECONDS = 200     # Seconds per task until a throughput has been measured
+RATE_SMOOTHING = 0.3            # Weight of the newest throughput sample (EWMA)
+DECISION_LOG = 'autoscaler_decisions.jsonl'
+METRICS_PORT = 9300
+# ==========================================
+
+REGISTRY = metrics.Registry()
+QUEUE_MESSAGES = REGISTRY.gauge(
+    'autoscaler_queue_messages', 'Messages in task_queue at the last poll', ['state'])
+THROUGHPUT = REGISTRY.gauge(
+    'autoscaler_throughput_per_second', 'Smoothed tasks finished per second, all consumers')
+CONSUMERS = REGISTRY.gauge(
+    'autoscaler_consumers', 'Consumer processes per node', ['node', 'state'])
+CAPACITY = REGISTRY.gauge(
+    'autoscaler_capacity', 'Consumers a node can run within its CPU and memory limits', ['node'])
+DESIRED = REGISTRY.gauge(
+    'autoscaler_desired_consumers', 'Consumers the last decision aimed for')
+DECISIONS = REGISTRY.counter(
+    'autoscaler_decisions_total', 'Scaling decisions, by outcome', ['decision'])
+ACTIONS = REGISTRY.counter(
+    'autoscaler_actions_total', 'Consumers started, drained and killed', ['node', 'action'])
+ERRORS = REGISTRY.counter(
+    'autoscaler_errors_total', 'Failed polls of the queue or a node', ['source'])
+
+# ---------- Queue statistics ----------
+
+class ManagementAPI:
+    """
+    Queue statistics from the RabbitMQ management plugin.
+    """
+    def __init__(self, url=MANAGEMENT_API, user=API_USER, password=API_PASSWORD):
+        self.url = f"{url.rstrip('/')}/queues/%2F/{broker_config.TASK_QUEUE}"
+        self.auth = 'Basic ' + base64.b64encode(f"{user}:{password}".encode()).decode()
+
+    def poll(self):
+        """
+        {'ready', 'unacked', 'consumers', 'throughput'}; throughput is the
+        broker's ack rate (tasks per second, None if nothing was acked yet).
+        """
+        request = urllib.request.Request(self.url, headers={'Authorization': self.auth})
+        with urllib.request.urlopen(request, timeout=10) as response:
+            data = json.load(response)
+        ack = data.get('message_stats', {}).get('ack_details')
+        return {'ready': data.get('messages_ready', 0), 'unacked': data.get('messages_unacknowledged', 0),
+                'consumers': data.get('consumers', 0), 'throughput': ack['rate'] if ack else None}
+
+class BrokerStats:
+    """
+    Stand-in without the management plugin: a passive declare gives the
+    ready messages and the consumers (not the unacked ones), and the
+    throughput is the growth of the result store between polls.
+    """
+    def __init__(self, db_path=RESULT_DB):
+        self.db_path = db_path
+        self.connection = None
+        self.channel = None
+        self.last = None        # (time, rows)
+
+    def rows(self):
+        if not os.path.exists(self.db_path):
+            return 0
+        store = ResultStore(self.db_path, readonly=True)
+        try:
+            return sum(store.counts().values())
+        finally:
+            store.close()
+
+    def poll(self):
+        if self.connection is None or not self.connection.is_open:
+            self.connection = pika.BlockingConnection(pika.ConnectionParameters('localhost'))
+            self.channel = None
+        # Only heartbeats are due between polls
+        self.connection.process_data_events(time_limit=0)
+        # One channel for every poll; a failed passive declare closes it
+        if self.channel is None or not self.channel.is_open:
+            self.channel = self.connection.channel()
+        queue = self.channel.queue_declare(queue=broker_config.TASK_QUEUE, passive=True).method
+        now, rows = time.monotonic(), self.rows()
+        throughput = None
+        if self.last is not None and now > self.last[0]:
+            throughput = max(0, rows - self.last[1]) / (now - self.last[0])
+        self.last = (now, rows)
+        return {'ready': queue.message_count, 'unacked': 0,
+                'consumers': queue.consumer_count, 'throughput': throughput}
+
+# ---------- Nodes ----------
+
+class Node:
+    """
+    A worker whose consumer processes are managed over ssh (or this machine
+    if address is None). Instances are named c1, c2, ... per node.
+    """
+    def __init__(self, name, address=None, user=None, directory=WORKER_DIR, limit=None):
+        self.name = name
+        self.address = address
+        self.user = user
+        self.directory = directory
+        self.limit = limit
+
+    def shell(self, command, timeout=30):
+        if self.address is None:
+            argv = ['bash', '-c', command]
+        else:
+            target = f"{self.user}@{self.address}" if self.user else self.address
+            argv = ['ssh', '-o', 'StrictHostKeyChecking=no', '-o', 'BatchMode=yes',
+                    '-o', 'ConnectTimeout=10', target, command]
+        return subprocess.run(argv, capture_output=True, text=True, timeout=timeout, check=True).stdout
+
+    def probe(self):
+        """
+        {'cpus', 'memory' (MemAvailable bytes), 'consumers': {pid: instance}};
+        instance is None for a consumer started without --instance.
+        """
+        # [c] keeps grep from matching itself and the shell that runs it
+        lines = self.shell("nproc; grep MemAvailable /proc/meminfo; "
+                           "ps -eo pid=,ppid=,args= | grep '[c]onsumer\\.py' || true").splitlines()
+        processes = {}
+        for line in lines[2:]:
+            pid, ppid, *argv = line.split()
+            if argv and 'python' in os.path.basename(argv[0]):
+                processes[int(pid)] = (int(ppid), argv)
+        consumers = {}
+        for pid, (ppid, argv) in processes.items():
+            # Pool workers are forked with the consumer's command line: skip them
+            if ppid in processes:
+                continue
+            consumers[pid] = argv[argv.index('--instance') + 1] if '--instance' in argv[:-1] else None
+        return {'cpus': int(lines[0]), 'memory': int(lines[1].split()[1]) * 1024, 'consumers': consumers}
+
+    def start(self, instance, slots=CONSUMER_SLOTS):
+        log = f"consumer-{instance}.log"
+        self.shell(f"cd {shlex.quote(self.directory)} && nohup python3 -u consumer.py --instance {instance} "
+                   f"--slots {slots} > {log} 2>&1 < /dev/null &")
+
+    def signal(self, pid, name):
+        self.shell(f"kill -{name} {pid}")
+
+def load_nodes(path):
+    """
+    The [workers] group of an Ansible inventory. max_consumers=N on a host
+    line caps that node.
+    """
+    nodes = []
+    user = None
+    section = None
+    with open(path) as f:
+        for line in f:
+            line = line.split('#', 1)[0].strip()
+            if not line:
+                continue
+            if line.startswith('['):
+                section = line.strip('[]')
+                continue
+            if section == 'workers':
+                name, *pairs = shlex.split(line)
+                options = dict(pair.split('=', 1) for pair in pairs if '=' in pair)
+                limit = options.get('max_consumers')
+                nodes.append(Node(name, options.get('ansible_host', name), options.get('ansible_user'),
+                                  limit=int(limit) if limit else None))
+            elif section == 'workers:vars' and line.startswith('ansible_user='):
+                user = line.split('=', 1)[1].strip()
+    for node in nodes:
+        node.user = node.user or user
+    return nodes
+
+def instance_number(instance):
+    return int(instance[1:]) if instance and instance[1:].isdigit() else 0
+
+# ---------- Policy ----------
+
+def node_capacity(state, draining, limit=None):
+    """
+    Consumers a node can run: draining ones still hold their cores, and
+    MemAvailable already excludes the memory of the running ones.
+    """
+    active = len(state['consumers']) - draining
+    by_cpu = state['cpus'] // CPUS_PER_CONSUMER - draining
+    by_memory = active + int(state['memory'] * MEMORY_FRACTION // MEMORY_PER_CONSUMER)
+    capacity = max(0, min(by_cpu, by_memory))
+    return capacity if limit is None else min(capacity, limit)
+
+class Policy:
+    """
+    Desired number of consumers: up at once (by at most step), down only
+    after the lower demand has lasted down_delay seconds.
+    """
+    def __init__(self, minimum=MIN_CONSUMERS, maximum=None, drain_seconds=TARGET_DRAIN_SECONDS,
+                 step=MAX_STEP, down_delay=SCALE_DOWN_DELAY):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.drain_seconds = drain_seconds
+        self.step = step
+        self.down_delay = down_delay
+        self.low_since = None
+        self.low_peak = 0
+
+    def needed(self, backlog, per_consumer, capacity):
+        need = math.ceil(backlog / (per_consumer * self.drain_seconds)) if backlog > 0 else 0
+        need = max(self.minimum, need)
+        if self.maximum is not None:
+            need = min(need, self.maximum)
+        return min(need, capacity)
+
+    def decide(self, backlog, per_consumer, current, capacity, now):
+        """
+        (target, decision): decision is 'up', 'down', 'hold' or 'cooldown'.
+        """
+        need = self.needed(backlog, per_consumer, capacity)
+        if need >= current:
+            self.low_since = None
+            if need == current:
+                return current, 'hold'
+            return min(need, current + self.step), 'up'
+        # Scale down to the most that was wanted during the whole delay
+        if self.low_since is None:
+            self.low_since, self.low_peak = now, need
+        self.low_peak = max(self.low_peak, need)
+        if now - self.low_since < self.down_delay:
+            return current, 'cooldown'
+        self.low_since = None
+        return self.low_peak, 'down'
+
+def place(states, capacities, target):
+    """
+    (starts, stops) to move from the active consumers to target: starts is
+    [(node name, instance)], spread over the nodes with the most free
+    capacity; stops is [(node name, pid)], the newest consumers of the nodes
+    running the most. states holds only active consumers.
+    """
+    active = {name: len(state['consumers']) for name, state in states.items()}
+    current = sum(active.values())
+    starts, stops = [], []
+    taken = {name: set(state['used']) for name, state in states.items()}
+    for _ in range(max(0, target - current)):
+        free = {name: capacities[name] - active[name] for name in states}
+        name = max(sorted(free), key=lambda n: (free[n], -active[n]))
+        if free[name] <= 0:
+            break
+        n = 1
+        while f"c{n}" in taken[name]:
+            n += 1
+        taken[name].add(f"c{n}")
+        active[name] += 1
+        starts.append((name, f"c{n}"))
+    victims = {name: sorted(state['consumers'].items(), key=lambda item: instance_number(item[1]))
+               for name, state in states.items()}
+    for _ in range(max(0, current - target)):
+        name = max(sorted(victims), key=lambda n: len(victims[n]))
+        pid, _ = victims[name].pop()
+        stops.append((name, pid))
+    return starts, stops
+
+# ---------- Controller ----------
+
+class Autoscaler:
+    def __init__(self, nodes, stats, policy, dry_run=False, decision_log=DECISION_LOG):
+        self.nodes = {node.name: node for node in nodes}
+        self.stats = stats
+        self.policy = policy
+        self.dry_run = dry_run
+        self.decision_log = decision_log
+        self.rate = None            # Smoothed throughput, tasks per second
+        self.draining = {}          # (node name, pid) -> time SIGTERM was sent
+
+    def probe_nodes(self):
+        states = {}
+        for name, node in self.nodes.items():
+            try:
+                states[name] = node.probe()
+            except (OSError, ValueError, IndexError, subprocess.SubprocessError) as e:
+                ERRORS.inc(source=name)
+                print(f" [Warning] Could not probe {name}, leaving it alone this round: {e}")
+        return states
+
+    def reap(self, states, now):
+        """
+        Forget drained consumers that have exited; kill those draining too long.
+        """
+        for (name, pid), since in list(self.draining.items()):
+            if name in states and pid not in states[name]['consumers']:
+                del self.draining[(name, pid)]
+            elif name in states and now - since > DRAIN_TIMEOUT and not self.dry_run:
+                print(f" [!] {name} pid {pid} still draining after {now - since:.0f}s, killing it")
+                self.act(name, 'kill', lambda: self.nodes[name].signal(pid, 'KILL'))
+                del self.draining[(name, pid)]
+
+    def act(self, name, action, command):
+        try:
+            command()
+            ACTIONS.inc(node=name, action=action)
+        except (OSError, subprocess.SubprocessError) as e:
+            ERRORS.inc(source=name)
+            print(f" [Error] Could not {action} a consumer on {name}: {e}")
+
+    def tick(self):
+        now = time.time()
+        try:
+            queue = self.stats.poll()
+        except Exception as e:
+            ERRORS.inc(source='queue')
+            print(f" [Warning] Could not read queue statistics: {e}")
+            return
+        states = self.probe_nodes()
+        self.reap(states, now)
+
+        # Draining consumers no longer take tasks: only active ones count
+        active_states, capacities = {}, {}
+        for name, state in states.items():
+            draining = {pid for (node, pid) in self.draining if node == name}
+            active = {pid: inst for pid, inst in state['consumers'].items() if pid not in draining}
+            active_states[name] = {'consumers': active, 'used': set(state['consumers'].values())}
+            capacities[name] = node_capacity(state, len(draining), self.nodes[name].limit)
+            CONSUMERS.set(len(active), node=name, state='active')
+            CONSUMERS.set(len(draining), node=name, state='draining')
+            CAPACITY.set(capacities[name], node=name)
+        current = sum(len(s['consumers']) for s in active_states.values())
+        capacity = sum(capacities.values())
+
+        if queue['throughput'] is not None:
+            self.rate = queue['throughput'] if self.rate is None else \
+                RATE_SMOOTHING * queue['throughput'] + (1 - RATE_SMOOTHING) * self.rate
+        # Until work has been finished, assume the fallback task time
+        measured = self.rate / current if self.rate and current else 0.0
+        per_consumer = measured or CONSUMER_SLOTS / FALLBACK_TASK_SECONDS
+        backlog = queue['ready'] + queue['unacked']
+        target, decision = self.policy.decide(backlog, per_consumer, current, capacity, now)
+        starts, stops = place(active_states, capacities, target) if decision in ('up', 'down') else ([], [])
+
+        QUEUE_MESSAGES.set(queue['ready'], state='ready')
+        QUEUE_MESSAGES.set(queue['unacked'], state='unacked')
+        THROUGHPUT.set(self.rate or 0.0)
+        DESIRED.set(target)
+        DECISIONS.inc(decision=decision)
+        print(f" [{decision}] backlog {backlog} ({queue['ready']} ready, {queue['unacked']} unacked), "
+              f"{(self.rate or 0.0) * 60:.1f} tasks/min, {current} consumers "
+              f"({queue['consumers']} on the broker), capacity {capacity} -> {target}"
+              + "".join(f" | start {inst} on {name}" for name, inst in starts)
+              + "".join(f" | drain pid {pid} on {name}" for name, pid in stops)
+              + (" (dry run)" if self.dry_run and (starts or stops) else ""))
+        if decision in ('up', 'down'):
+            self.log_decision(now, decision, queue, backlog, current, capacity, target, starts, stops)
+
+        if self.dry_run:
+            return
+        for name, instance in starts:
+            self.act(name, 'start', lambda: self.nodes[name].start(instance))
+        for name, pid in stops:
+            self.act(name, 'drain', lambda: self.nodes[name].signal(pid, 'TERM'))
+            self.draining[(name, pid)] = now
+
+    def log_decision(self, now, decision, queue, backlog, current, capacity, target, starts, stops):
+        entry = {'at': now, 'decision': decision, 'backlog': backlog, 'ready': queue['ready'],
+                 'unacked': queue['unacked'], 'throughput': self.rate, 'consumers': current,
+                 'capacity': capacity, 'target': target, 'dry_run': self.dry_run,
+                 'start': [list(s) for s in starts], 'drain': [list(s) for s in stops]}
+        try:
+            with open(self.decision_log, 'a') as f:
+                f.write(json.dumps(entry) + "\n")
+        except OSError as e:
+            print(f" [Warning] Could not write {self.decision_log}: {e}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Scale consumer processes to the task queue backlog")
+    parser.add_argument('--inventory', default=INVENTORY, help=f"Ansible inventory (default: {INVENTORY})")
+    parser.add_argument('--local', action='store_true', help="Manage consumers on this machine instead")
+    parser.add_argument('--stats', choices=('api', 'broker'), default='api',
+                        help="Management API, or passive declare + results.db growth (default: api)")
+    parser.add_argument('--db', default=RESULT_DB, help=f"Result store for --stats broker (default: {RESULT_DB})")
+    parser.add_argument('--min', type=int, default=MIN_CONSUMERS, help=f"Fewest consumers (default: {MIN_CONSUMERS})")
+    parser.add_argument('--max', type=int, help="Most consumers (default: node capacity)")
+    parser.add_argument('--drain-target', type=float, default=TARGET_DRAIN_SECONDS,
+                        help=f"Seconds to empty the backlog in (default: {TARGET_DRAIN_SECONDS})")
+    parser.add_argument('--poll', type=float, default=POLL_SECONDS, help=f"Seconds between polls (default: {POLL_SECONDS:g})")
+    parser.add_argument('--metrics-port', type=int, default=METRICS_PORT,
+                        help=f"Serve metrics on this port, 0 for none (default: {METRICS_PORT})")
+    parser.add_argument('--dry-run', action='store_true', help="Log decisions without starting or stopping anything")
+    parser.add_argument('--once', action='store_true', help="Poll and decide once, then exit")
+    args = parser.parse_args()
+
+    if args.local:
+        nodes = [Node('localhost', directory=os.getcwd())]
+    else:
+        if not os.path.exists(args.inventory):
+            print(f"❌ Error: File not found {args.inventory}")
+            sys.exit(1)
+        nodes = load_nodes(args.inventory)
+    stats = ManagementAPI() if args.stats == 'api' else BrokerStats(args.db)
+    policy = Policy(args.min, args.max, args.drain_target)
+    scaler = Autoscaler(nodes, stats, policy, args.dry_run)
+    if args.metrics_port:
+        REGISTRY.serve(args.metrics_port)
+        print(f" [*] Metrics on http://0.0.0.0:{args.metrics_port}/metrics")
+    print(f"🚀 Autoscaling consumers on {len(nodes)} nodes ({', '.join(n.name for n in nodes)}): "
+          f"backlog drained in {args.drain_target:g}s, poll every {args.poll:g}s"
+          + (" (dry run)" if args.dry_run else ""))
+
+    try:
+        while True:
+            scaler.tick()
+            if args.once:
+                break
+            time.sleep(args.poll)
+    except KeyboardInterrupt:
+        pass
+    draining = len(scaler.draining)
+    print(f"✅ Stopped; running consumers are left as they are"
+          + (f" ({draining} still draining)" if draining else ""))
+    sys.exit(0)
+
+if __name__ == '__main__':
+    main()
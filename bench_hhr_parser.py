@@ -0,0 +1,182 @@
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import warnings
+import results_parser
+
+"""
+usage: python3 bench_hhr_parser.py [HHR_FILE ...] [--generate N] [--hits H] [--repeat R]
+
+Checks and times the streaming results_parser against the original
+Bio.SearchIO + numpy/scipy implementation.
+
+Every file is parsed by both; the hhr_parse.out rows must be byte-identical
+(and a file that made the old parser fail must make the new one fail too).
+Without HHR_FILE arguments, synthetic .hhr files are generated: large hit
+lists with full alignments, plus the edge cases seen in final_results.csv
+(no hit below 1e-5 -> nan statistics, repeated templates, zero/negative scores).
+Exit status is 1 if any row differs.
+"""
+
+def biopython_row(hhr_file):
+    """
+    The original results_parser.py logic, kept here as the reference.
+    """
+    from Bio import SearchIO
+    import numpy as np
+    from scipy.stats import gmean
+
+    best_hit = []
+    best_score = 0
+    good_hit_scores  = []
+    id = ''
+    for result in SearchIO.parse(hhr_file, 'hhsuite3-text'):
+        id=result.id
+        for hit in result.hits:
+            if hit.score >= best_score:
+                best_score = hit.score
+                best_hit = [hit.id, hit.evalue, hit.score]
+            if hit.evalue < 1.e-5:
+                good_hit_scores.append(hit.score)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        mean=format(np.mean(good_hit_scores), ".2f")
+        std=format(np.std(good_hit_scores), ".2f")
+        g_mean=format(gmean(good_hit_scores), ".2f")
+    return f"{id},{best_hit[0]},{best_hit[1]},{best_hit[2]},{mean},{std},{g_mean}"
+
+def stream_row(hhr_file):
+    return results_parser.format_record(results_parser.parse_hhr(hhr_file))
+
+# ==========================================
+# Synthetic .hhr generation
+# ==========================================
+AMINO = 'ACDEFGHIKLMNPQRSTVWY'
+
+def format_evalue(evalue):
+    # hhsearch style: 2.2e-34, 0.0017, 11, 1.3e+02
+    return f"{evalue:.2g}"
+
+def write_hhr(path, query_id, hits, query_len=300, aln_len=200, width=80, rng=None):
+    """
+    hits: [(hit_id, evalue, score), ...] in output order.
+    """
+    rng = rng or random.Random(0)
+    with open(path, 'w') as f:
+        f.write(f"Query         {query_id}\n")
+        f.write(f"Match_columns {query_len}\n")
+        f.write("No_of_seqs    1 out of 1\nNeff          1\nSearched_HMMs 86289\n")
+        f.write("Date          Mon Jan  1 00:00:00 2024\n")
+        f.write("Command       hhsearch -i tmp.a3m -cpu 1 -d /data/pdb70/pdb70\n\n")
+        f.write(" No Hit                             Prob E-value P-value  Score    SS Cols Query HMM  Template HMM\n")
+        for no, (hit_id, evalue, score) in enumerate(hits, 1):
+            desc = f"{hit_id} Protein {hit_id}"[:30]
+            f.write(f"{no:3d} {desc:30s} {99.9:5.1f} {evalue:7.2g} {evalue / 1e5:7.2g} {score:6.1f} "
+                    f"{0.0:5.1f} {aln_len:4d} 1-{aln_len:<4d} 1-{aln_len:<4d} ({aln_len + 20})\n")
+        f.write("\n")
+        for no, (hit_id, evalue, score) in enumerate(hits, 1):
+            f.write(f"No {no}\n")
+            f.write(f">{hit_id} Protein {hit_id}; chain A; synthetic\n")
+            f.write(f"Probab=99.90  E-value={format_evalue(evalue)}  Score={score:.2f}  Aligned_cols={aln_len}  "
+                    f"Identities=30%  Similarity=0.512  Sum_probs=180.0  Template_Neff=7.1\n")
+            for start in range(0, aln_len, width):
+                chunk = min(width, aln_len - start)
+                q = ''.join(rng.choice(AMINO) for _ in range(chunk))
+                t = ''.join(rng.choice(AMINO) for _ in range(chunk))
+                end = start + chunk
+                f.write("\n")
+                f.write(f"Q ss_pred             {'C' * chunk}\n")
+                f.write(f"Q {query_id[:14]:14s} {start + 1:4d} {q} {end:4d} ({query_len})\n")
+                f.write(f"Q Consensus      {start + 1:4d} {q.lower()} {end:4d} ({query_len})\n")
+                f.write(f"                      {'|' * chunk}\n")
+                f.write(f"T Consensus      {start + 1:4d} {t.lower()} {end:4d} ({aln_len + 20})\n")
+                f.write(f"T {hit_id[:14]:14s} {start + 1:4d} {t} {end:4d} ({aln_len + 20})\n")
+                f.write(f"T ss_dssp             {'C' * chunk}\n")
+                f.write(f"T ss_pred             {'C' * chunk}\n")
+            f.write("\n")
+        f.write("Done!\n")
+
+def generate_cases(out_dir, count, n_hits, seed=0):
+    rng = random.Random(seed)
+    paths = []
+
+    def random_id():
+        return f"{rng.randint(1, 9)}{''.join(rng.choice('ABCDEFGHIJKLMNOPQRSTUVWXYZ') for _ in range(3))}_{rng.choice('ABCDx12')}"
+
+    for i in range(count):
+        kind = i % 4
+        hits = []
+        for _ in range(n_hits):
+            if kind == 1:
+                evalue = 10 ** rng.uniform(-4, 3)          # nothing below 1e-5 -> nan stats
+            else:
+                evalue = 10 ** rng.uniform(-60, 3)
+            score = round(rng.uniform(5, 400), 2)
+            hits.append((random_id(), evalue, score))
+        if kind == 2 and len(hits) > 3:
+            hits.insert(2, (hits[0][0], 1e-50, 999.99))     # repeated template: first block wins
+        if kind == 3:
+            if i % 8 == 7:
+                hits.append((random_id(), 1e-20, -1.5))      # negative score -> gmean nan
+            else:
+                hits.append((random_id(), 1e-20, 0.0))       # zero score -> gmean 0.00
+        if i == count - 1 and count > 4:
+            hits = []                                        # no hits at all: both parsers fail
+        hits.sort(key=lambda h: h[1])
+        path = os.path.join(out_dir, f"case_{i:04d}.hhr")
+        write_hhr(path, f"sp|Q{i:05d}|SYN{i}_MOUSE", hits, rng=rng)
+        paths.append(path)
+    return paths
+
+# ==========================================
+# Check + benchmark
+# ==========================================
+def run_one(parse, path):
+    try:
+        return parse(path)
+    except Exception as e:
+        return f"<error {type(e).__name__}>"
+
+def time_parser(parse, paths, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for path in paths:
+            run_one(parse, path)
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description="Check and benchmark the streaming HHR parser")
+    parser.add_argument('files', nargs='*', help=".hhr files (default: generate synthetic ones)")
+    parser.add_argument('--generate', type=int, default=40, help="Synthetic files to generate")
+    parser.add_argument('--hits', type=int, default=500, help="Hits per synthetic file")
+    parser.add_argument('--repeat', type=int, default=3, help="Timing repetitions")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = args.files or generate_cases(tmp, args.generate, args.hits)
+        size_mb = sum(os.path.getsize(p) for p in paths) / 1024 ** 2
+        print(f"📂 {len(paths)} .hhr files ({size_mb:.1f} MB)")
+
+        mismatches = 0
+        for path in paths:
+            old, new = run_one(biopython_row, path), run_one(stream_row, path)
+            failed_both = old.startswith('<error') and new.startswith('<error')
+            if old != new and not failed_both:
+                mismatches += 1
+                print(f"❌ {path}\n   biopython: {old}\n   stream:    {new}")
+        print(f"✅ {len(paths) - mismatches}/{len(paths)} rows byte-identical")
+
+        t_old = time_parser(biopython_row, paths, args.repeat)
+        t_new = time_parser(stream_row, paths, args.repeat)
+        n = len(paths) * args.repeat
+        print(f"⏱️  Bio.SearchIO + numpy/scipy: {t_old / n * 1000:8.2f} ms/file")
+        print(f"⏱️  streaming parser:          {t_new / n * 1000:8.2f} ms/file  ({t_old / t_new:.1f}x faster)")
+
+    sys.exit(1 if mismatches else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+import os
+import sys
+import time
+import argparse
+import pipeline_script
+import results_parser
+from s4pred_server import read_fasta_text
+
+"""
+usage: python3 bench_hhsearch_profile.py [FASTA] [--profile summary] [--limit N] [--repeat R] [--threads T]
+
+Checks that an HHsearch output profile (pipeline_script.HHSEARCH_PROFILES)
+gives the same results as hhsearch's full output, and measures what it saves.
+
+Every sequence of FASTA (default: test.fa) goes through S4Pred once; its
+query is then searched with the 'full' profile and with --profile, and both
+.hhr files are parsed. The rows must be byte-identical (and a search that
+made the parser fail with one profile must make it fail with the other).
+Per profile the .hhr size, the hhsearch time and the parse time (repeated R
+times) are printed. Run it on a worker, with the real pdb70: the result
+cache is not used. Exit status is 1 if any row differs.
+"""
+
+def row(hhr_file):
+    try:
+        return results_parser.format_record(results_parser.parse_hhr(hhr_file))
+    except Exception as e:
+        return f"<error {type(e).__name__}>"
+
+def search(a3m_file, hhr_file, profile):
+    start = time.perf_counter()
+    if not pipeline_script.run_hhsearch(a3m_file, hhr_file, profile=profile):
+        raise RuntimeError(f"hhsearch failed with the {profile} profile")
+    return time.perf_counter() - start
+
+def time_parse(hhr_file, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        row(hhr_file)
+    return (time.perf_counter() - start) / repeat
+
+def main():
+    parser = argparse.ArgumentParser(description="Verify and benchmark an HHsearch output profile")
+    parser.add_argument('fasta', nargs='?', default='test.fa', help="Sample sequences (default: test.fa)")
+    parser.add_argument('--profile', default='summary', choices=sorted(pipeline_script.HHSEARCH_PROFILES),
+                        help="Profile to compare with 'full' (default: summary)")
+    parser.add_argument('--limit', type=int, help="Use only the first N sequences")
+    parser.add_argument('--repeat', type=int, default=5, help="Parse repetitions per file (default: 5)")
+    parser.add_argument('--threads', type=int, default=1, help="hhsearch -cpu (default: 1)")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.fasta):
+        print(f"❌ Error: File not found {args.fasta}")
+        sys.exit(1)
+    records = read_fasta_text(args.fasta)[:args.limit]
+    profiles = ('full', args.profile)
+    # Timings must not be answered from the result cache
+    pipeline_script.THREADS = args.threads
+    pipeline_script.disable_cache()
+    print(f"📄 {len(records)} sequences from {args.fasta}: {' vs '.join(profiles)} profile")
+
+    totals = {profile: {'bytes': 0, 'search': 0.0, 'parse': 0.0} for profile in profiles}
+    mismatches = failed = 0
+    for protein_id, sequence in records:
+        try:
+            with pipeline_script.scratch_dir(prefix="profile_") as work_dir:
+                a3m_file = pipeline_script.build_a3m(protein_id, sequence, work_dir, None)
+                rows = {}
+                for profile in profiles:
+                    hhr_file = os.path.join(work_dir, f"{profile}.hhr")
+                    totals[profile]['search'] += search(a3m_file, hhr_file, profile)
+                    totals[profile]['bytes'] += os.path.getsize(hhr_file)
+                    totals[profile]['parse'] += time_parse(hhr_file, args.repeat)
+                    rows[profile] = row(hhr_file)
+        except Exception as e:
+            failed += 1
+            print(f" [Error] {protein_id}: {e}")
+            continue
+        if rows['full'] != rows[args.profile]:
+            mismatches += 1
+            print(f"❌ {protein_id}\n   full:    {rows['full']}\n   {args.profile + ':':8s} {rows[args.profile]}")
+
+    compared = len(records) - failed
+    print(f"{'✅' if not mismatches else '❌'} {compared - mismatches}/{compared} rows byte-identical"
+          + (f" ({failed} sequences could not be searched)" if failed else ""))
+    if compared:
+        full = totals['full']
+        print(f"  {'profile':10s} {'.hhr KB/seq':>12s} {'hhsearch s/seq':>15s} {'parse ms/seq':>13s}")
+        for profile in profiles:
+            t = totals[profile]
+            print(f"  {profile:10s} {t['bytes'] / compared / 1024:12.1f} {t['search'] / compared:15.2f} "
+                  f"{t['parse'] / compared * 1000:13.2f}")
+        lean = totals[args.profile]
+        if full['bytes'] and full['parse']:
+            print(f"📉 {args.profile}: {1 - lean['bytes'] / full['bytes']:.0%} less .hhr output, "
+                  f"parse {full['parse'] / max(lean['parse'], 1e-9):.1f}x faster")
+
+    sys.exit(1 if mismatches or not compared else 0)
+
+if __name__ == '__main__':
+    main()
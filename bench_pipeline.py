@@ -0,0 +1,400 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import contextlib
+import collections
+from types import SimpleNamespace
+
+"""
+usage: python3 bench_pipeline.py [--sizes 20,100,500] [--slots N] [--s4pred-seconds S]
+                                 [--hhsearch-seconds S] [--hhsearch-startup S] [--bundle K]
+                                 [--hits H] [--fail-rate F]
+                                 [--output bench.json] [--keep] [--verbose]
+
+Hermetic end-to-end throughput benchmark: measures the pipeline's own
+overhead on one Linux box, without S4Pred weights, pdb70 or a cluster.
+
+For every size it creates a scratch directory containing
+  * a synthetic UniProt-style FASTA (2x size records) and an ID list (size targets),
+  * fake run_model.py / hhsearch / hhsearch_omp executables that sleep for a configurable
+    time and write realistic horiz / .hhr output (bench_hhr_parser.write_hhr),
+and then runs the real code paths:
+  dispatch  - FastaIndex build + producer.build_tasks into a local queue
+  run       - consumer.callback / on_job_done with a process pool, driven by
+              an in-memory stand-in for the pika channel and connection
+  aggregate - result messages bulk-inserted into a ResultStore
+  report    - create_final_report.py over the result log segments, cold and re-run.
+Per-stage overhead is the measured stage time minus the fake tool latency.
+The results are printed (and optionally written) as JSON.
+"""
+
+# ==========================================
+# Configuration
+# ==========================================
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+AMINO = 'ACDEFGHIKLMNPQRSTVWY'
+
+FAKE_RUN_MODEL = '''#!{python}
+# Fake S4Pred run_model.py: sleeps, then prints horiz output for each record
+import os, sys, time
+sys.path.insert(0, {repo!r})
+from s4pred_server import read_fasta_text
+time.sleep(float(os.environ.get('FAKE_S4PRED_SECONDS', '0')))
+for name, seq in read_fasta_text(sys.argv[-1]):
+    print("# PSIPRED HFORMAT (S4PRED fake)\\n")
+    for start in range(0, len(seq), 60):
+        chunk = seq[start:start + 60]
+        print("Conf: " + "9" * len(chunk))
+        print("Pred: " + "".join("HEC"[(ord(c) + i) % 3] for i, c in enumerate(chunk)))
+        print("  AA: " + chunk + "\\n")
+'''
+
+FAKE_SEARCH = '''#!{python}
+# Fake hhsearch / hhsearch_omp: sleeps, then writes a deterministic .hhr per query
+import os, sys, math, time, random, hashlib
+sys.path.insert(0, {repo!r})
+from bench_hhr_parser import write_hhr
+import ffindex
+
+def search(a3m_text, hhr):
+    name, seq = None, []
+    for line in a3m_text.splitlines():
+        if line.startswith('>'):
+            if name is not None:
+                break
+            if not line.startswith(('>ss_pred', '>ss_conf')):
+                name = line[1:].split()[0]
+        elif name is not None:
+            seq.append(line.strip())
+    seq = ''.join(seq)
+    rng = random.Random(int(hashlib.sha1(seq.encode()).hexdigest()[:12], 16))
+    time.sleep(float(os.environ.get('FAKE_HHSEARCH_SECONDS', '0')))
+    if rng.random() < float(os.environ.get('FAKE_HHSEARCH_FAIL_RATE', '0')):
+        sys.stderr.write("fake hhsearch: injected failure for %s\\n" % name)
+        return False
+    hits = []
+    for i in range(int(os.environ.get('FAKE_HHSEARCH_HITS', '100'))):
+        evalue = 10 ** rng.uniform(-60, 3)
+        hit_id = "%d%s_%d" % (rng.randint(1, 9), ''.join(rng.choice('ABCDEFGHIJKLMNOPQRSTUVWXYZ') for _ in range(3)), i)
+        hits.append((hit_id, evalue, round(max(1.0, 20 - 6 * math.log10(evalue)), 2)))
+    hits.sort(key=lambda h: h[1])
+    write_hhr(hhr, name, hits, query_len=len(seq), aln_len=min(len(seq), 120), rng=rng)
+    return True
+
+args = sys.argv[1:]
+query = args[args.index('-i') + 1]
+output = args[args.index('-o') + 1]
+# Binary start-up and opening the database, paid once per invocation
+time.sleep(float(os.environ.get('FAKE_HHSEARCH_STARTUP', '0')))
+if os.path.basename(sys.argv[0]) == 'hhsearch_omp':
+    # Queries and results are ffindex databases; failed queries are left out
+    entries = []
+    for name, a3m_text in sorted(ffindex.read_db(query).items()):
+        hhr = output + '.' + name + '.hhr'
+        if search(a3m_text, hhr):
+            with open(hhr) as f:
+                entries.append((name, f.read()))
+            os.remove(hhr)
+    ffindex.write_db(output, entries)
+else:
+    with open(query) as f:
+        sys.exit(0 if search(f.read(), output) else 1)
+'''
+# ==========================================
+
+def write_executable(path, text):
+    with open(path, 'w') as f:
+        f.write(text.format(python=sys.executable, repo=REPO_DIR))
+    os.chmod(path, 0o755)
+
+def make_dataset(run_dir, size, seed=0):
+    """
+    Synthetic FASTA with 2*size records and an ID list with size of them.
+    Returns (fasta_file, id_file).
+    """
+    rng = random.Random(seed + size)
+    fasta_file = os.path.join(run_dir, 'synthetic.fasta')
+    id_file = os.path.join(run_dir, 'experiment_ids.txt')
+    accessions = []
+    with open(fasta_file, 'w') as f:
+        for i in range(2 * size):
+            accession = f"Q{i:05d}"
+            accessions.append(accession)
+            length = int(min(2000, max(50, rng.lognormvariate(5.8, 0.6))))
+            seq = ''.join(rng.choice(AMINO) for _ in range(length))
+            f.write(f">sp|{accession}|SYN{i}_MOUSE Synthetic protein {i} OS=Mus musculus\n")
+            for start in range(0, length, 60):
+                f.write(seq[start:start + 60] + "\n")
+    with open(id_file, 'w') as f:
+        for accession in rng.sample(accessions, size):
+            f.write(accession + "\n")
+    return fasta_file, id_file
+
+# ==========================================
+# In-memory stand-in for the pika channel / connection
+# ==========================================
+class LocalChannel:
+    """
+    The subset of a pika BlockingChannel that consumer.py uses.
+    """
+    def __init__(self):
+        self.queues = collections.defaultdict(collections.deque)
+        self.unacked = set()
+        self.acked = 0
+        self.next_tag = 0
+        self.prefetch = 1
+
+    def queue_declare(self, queue, durable=False, arguments=None):
+        self.queues[queue]
+
+    def basic_qos(self, prefetch_count):
+        self.prefetch = prefetch_count
+
+    def confirm_delivery(self):
+        pass
+
+    def basic_publish(self, exchange, routing_key, body, properties=None):
+        self.queues[routing_key].append(body)
+
+    def deliver(self, queue):
+        self.next_tag += 1
+        self.unacked.add(self.next_tag)
+        return SimpleNamespace(delivery_tag=self.next_tag), self.queues[queue].popleft()
+
+    def basic_ack(self, delivery_tag, multiple=False):
+        self.unacked.discard(delivery_tag)
+        self.acked += 1
+
+    def basic_nack(self, delivery_tag, requeue=True):
+        self.unacked.discard(delivery_tag)
+
+    def expire_retries(self, task_queue):
+        """
+        Move waiting retries back into the task queue at once (their TTL,
+        i.e. the backoff, is not part of what the benchmark measures).
+        """
+        moved = 0
+        for name, queue in self.queues.items():
+            if name.startswith(task_queue + '.retry.'):
+                moved += len(queue)
+                self.queues[task_queue].extend(queue)
+                queue.clear()
+        return moved
+
+class LocalConnection:
+    def __init__(self):
+        import queue
+        self.callbacks = queue.Queue()
+
+    def add_callback_threadsafe(self, callback):
+        self.callbacks.put(callback)
+
+@contextlib.contextmanager
+def quiet(enabled=True):
+    """
+    Silence stdout at the file-descriptor level (covers pool processes too).
+    """
+    if not enabled:
+        yield
+        return
+    sys.stdout.flush()
+    saved = os.dup(1)
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 1)
+    try:
+        yield
+    finally:
+        sys.stdout.flush()
+        os.dup2(saved, 1)
+        os.close(saved)
+        os.close(devnull)
+
+def summarize(values):
+    if not values:
+        return None
+    values = sorted(values)
+    pick = lambda q: values[min(len(values) - 1, int(q * len(values)))]
+    return {'n': len(values), 'mean': sum(values) / len(values), 'p50': pick(0.5), 'p95': pick(0.95),
+            'max': values[-1]}
+
+# ==========================================
+# One benchmark run
+# ==========================================
+def run_size(size, args, base_dir):
+    import consumer
+    import broker_config
+    import pipeline_script
+    import producer
+    import create_final_report
+    import result_log
+    from fasta_index import FastaIndex
+    from concurrent.futures import ProcessPoolExecutor
+    from result_store import ResultStore, record_from_message
+
+    run_dir = os.path.join(base_dir, f"size_{size}")
+    os.makedirs(run_dir)
+    fasta_file, id_file = make_dataset(run_dir, size, args.seed)
+    pipeline_script.CACHE_DB = os.path.join(run_dir, 'cache.db')
+    result = {'size': size}
+    old_cwd = os.getcwd()
+    os.chdir(run_dir)
+    try:
+        # 1. Dispatch: index + lookup + message construction
+        channel = LocalChannel()
+        start = time.perf_counter()
+        with quiet(not args.verbose):
+            index = FastaIndex.open(fasta_file)
+        with index:
+            result['index_seconds'] = time.perf_counter() - start
+            target_ids = create_final_report.load_target_ids(id_file)
+            record_nos, not_found = producer.find_records(index, target_ids)
+            tasks = producer.build_tasks(index, record_nos)
+            if args.bundle > 1:
+                tasks = producer.bundle_tasks(tasks, args.bundle)
+            for record_id, body in tasks:
+                channel.basic_publish('', consumer.QUEUE_NAME, body)
+        dispatch_seconds = time.perf_counter() - start
+        n_messages = len(channel.queues[consumer.QUEUE_NAME])
+        n_tasks = len(record_nos)
+        result['dispatch'] = {'tasks': n_tasks, 'messages': n_messages, 'not_found': not_found,
+                              'seconds': dispatch_seconds,
+                              'tasks_per_sec': n_tasks / dispatch_seconds if dispatch_seconds else None}
+
+        # 2. Run: the consumer's own callbacks, a process pool and the stand-in broker
+        connection = LocalConnection()
+        consumer.SLOTS = args.slots         # Reported in task events and trace spans
+        consumer.RESULT_LOG = result_log.ResultLog(create_final_report.RESULTS_DIR)
+        channel.basic_qos(prefetch_count=args.slots)
+        tasks = channel.queues[consumer.QUEUE_NAME]
+        start = time.perf_counter()
+        with quiet(not args.verbose), ProcessPoolExecutor(max_workers=args.slots) as pool:
+            while tasks or channel.unacked or channel.expire_retries(consumer.QUEUE_NAME):
+                while tasks and len(channel.unacked) < channel.prefetch:
+                    method, body = channel.deliver(consumer.QUEUE_NAME)
+                    consumer.callback(channel, method, None, body, connection=connection, pool=pool)
+                connection.callbacks.get()()
+        consumer.RESULT_LOG.close()
+        run_seconds = time.perf_counter() - start
+
+        messages = [json.loads(body) for body in channel.queues[consumer.RESULT_QUEUE]]
+        statuses = collections.Counter(m['status'] for m in messages)
+        result['run'] = {'seconds': run_seconds, 'slots': args.slots, 'statuses': dict(statuses),
+                         'dead_lettered': len(channel.queues[broker_config.DEAD_LETTER_QUEUE]),
+                         'tasks_per_sec': n_tasks / run_seconds if run_seconds else None}
+
+        # 3. Per-stage time and overhead (stage time minus fake tool latency)
+        # A bundle pays the hhsearch start-up once for all its proteins
+        fake = {'s4pred': args.s4pred_seconds, 'parse': 0.0,
+                'hhsearch': args.hhsearch_seconds + args.hhsearch_startup / max(1, args.bundle)}
+        stages = {}
+        for stage in ('s4pred', 'hhsearch', 'parse', 'total'):
+            values = [m['timings'][stage] for m in messages if stage in (m.get('timings') or {})]
+            stages[stage] = summarize(values)
+            if stage in fake and values:
+                stages[stage]['overhead_mean'] = stages[stage]['mean'] - fake[stage]
+        # Everything outside the three stages: scratch dir, cache, result write + publish
+        other = [m['timings']['total'] - sum(m['timings'].get(s, 0.0) for s in fake)
+                 for m in messages if m['status'] == 'done' and 'total' in m['timings']]
+        stages['framework'] = summarize(other)
+        result['stages'] = stages
+
+        # 4. Aggregate: result messages into the store (what result_aggregator.py does)
+        store = ResultStore(os.path.join(run_dir, 'aggregated.db'))
+        start = time.perf_counter()
+        store.add_results(record_from_message(m) for m in messages)
+        result['aggregate_seconds'] = time.perf_counter() - start
+        store.close()
+
+        # 5. Report: create_final_report.py over the result log segments, cold then incremental
+        timings = []
+        saved_argv = sys.argv
+        for _ in range(2):
+            sys.argv = ['create_final_report.py', '--workers', str(args.slots)]
+            start = time.perf_counter()
+            with quiet(not args.verbose):
+                create_final_report.main()
+            timings.append(time.perf_counter() - start)
+        sys.argv = saved_argv
+        result['report'] = {'cold_seconds': timings[0], 'rerun_seconds': timings[1]}
+    finally:
+        os.chdir(old_cwd)
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description="Hermetic end-to-end pipeline benchmark")
+    parser.add_argument('--sizes', default='20,100', help="Comma-separated numbers of target IDs")
+    parser.add_argument('--slots', type=int, default=os.cpu_count() or 1, help="Consumer pool size")
+    parser.add_argument('--s4pred-seconds', type=float, default=0.0, help="Fake run_model.py latency")
+    parser.add_argument('--hhsearch-seconds', type=float, default=0.0, help="Fake hhsearch latency")
+    parser.add_argument('--hhsearch-startup', type=float, default=0.0,
+                        help="Fake start-up / database-open time per hhsearch invocation")
+    parser.add_argument('--bundle', type=int, default=1, metavar='K',
+                        help="Sequences per message (batched hhsearch_omp when > 1)")
+    parser.add_argument('--hits', type=int, default=100, help="Hits per fake .hhr")
+    parser.add_argument('--fail-rate', type=float, default=0.0, help="Fraction of fake hhsearch runs that fail")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="Also write the JSON report here")
+    parser.add_argument('--keep', action='store_true', help="Keep the scratch directory")
+    parser.add_argument('--verbose', action='store_true', help="Show consumer/report output")
+    args = parser.parse_args()
+    sizes = [int(s) for s in args.sizes.split(',') if s.strip()]
+
+    base_dir = tempfile.mkdtemp(prefix='bench_pipeline_')
+    tools_dir = os.path.join(base_dir, 'tools')
+    os.makedirs(tools_dir)
+    write_executable(os.path.join(tools_dir, 'run_model.py'), FAKE_RUN_MODEL)
+    write_executable(os.path.join(tools_dir, 'hhsearch'), FAKE_SEARCH)
+    write_executable(os.path.join(tools_dir, 'hhsearch_omp'), FAKE_SEARCH)
+
+    # Must be set before the pipeline modules are imported (they read them once)
+    os.environ.update({
+        'S4PRED_SCRIPT': os.path.join(tools_dir, 'run_model.py'),
+        'HHSEARCH_BIN': os.path.join(tools_dir, 'hhsearch'),
+        'HHSEARCH_OMP_BIN': os.path.join(tools_dir, 'hhsearch_omp'),
+        'HHDB_PATH': os.path.join(tools_dir, 'pdb70'),
+        'S4PRED_SOCKET': os.path.join(base_dir, 'no-s4pred-server.sock'),   # Force the run_model.py path
+        'PIPELINE_SCRATCH': os.path.join(base_dir, 'scratch'),
+        'METRICS_DIR': os.path.join(base_dir, 'metrics'),
+        'TRACE_DIR': os.path.join(base_dir, 'traces'),
+        'RESULT_CACHE_DB': os.path.join(base_dir, 'cache.db'),
+        'FAKE_S4PRED_SECONDS': str(args.s4pred_seconds),
+        'FAKE_HHSEARCH_SECONDS': str(args.hhsearch_seconds),
+        'FAKE_HHSEARCH_STARTUP': str(args.hhsearch_startup),
+        'FAKE_HHSEARCH_HITS': str(args.hits),
+        'FAKE_HHSEARCH_FAIL_RATE': str(args.fail_rate),
+    })
+    os.makedirs(os.environ['PIPELINE_SCRATCH'])
+    os.makedirs(os.environ['METRICS_DIR'])
+    sys.path.insert(0, REPO_DIR)
+
+    report = {
+        'config': {'sizes': sizes, 'slots': args.slots, 's4pred_seconds': args.s4pred_seconds,
+                   'hhsearch_seconds': args.hhsearch_seconds, 'hhsearch_startup': args.hhsearch_startup,
+                   'bundle': args.bundle, 'hits': args.hits,
+                   'fail_rate': args.fail_rate, 'seed': args.seed, 'python': sys.version.split()[0],
+                   'cpus': os.cpu_count()},
+        'runs': [],
+    }
+    try:
+        for size in sizes:
+            print(f"⏱️  size {size}...", file=sys.stderr)
+            report['runs'].append(run_size(size, args, base_dir))
+    finally:
+        if args.keep:
+            print(f"📂 Kept {base_dir}", file=sys.stderr)
+        else:
+            import shutil
+            shutil.rmtree(base_dir, ignore_errors=True)
+
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + "\n")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import threading
+import http.client
+from urllib.parse import urlsplit
+
+"""
+usage: python3 bench_result_server.py [--url http://HOST:5000] [--concurrency C] [--seconds S]
+                                      [--rows N] [--gzip] [--path PATH ...]
+
+Local load test for result_server.py. Each of C threads keeps one HTTP
+connection open and requests the paths round-robin for S seconds; the
+requests/sec and p50/p99 latency are reported per path and overall.
+
+Without --url a temporary result store with N synthetic rows (and the two
+CSV exports) is created and the server is started in-process on a free
+port (werkzeug's threaded server, like app.run).
+"""
+
+# ==========================================
+# Configuration
+# ==========================================
+DEFAULT_PATHS = [
+    '/download/final_hits_output.csv',
+    '/download/final_profile_output.csv',
+    '/api/rows?limit=100',
+    '/api/rows?limit=1000&format=csv',
+    '/api/rows?prefix=sp|Q001&limit=100',
+    '/api/rows?max_evalue=1e-40&limit=100',
+    '/api/hits/7RRO_2',
+]
+# ==========================================
+
+def populate(base_dir, n_rows, seed=0):
+    """
+    Synthetic results.db + CSV exports in base_dir.
+    """
+    import result_store
+    rng = random.Random(seed)
+    store = result_store.ResultStore(os.path.join(base_dir, result_store.RESULT_DB))
+    hits = ['7RRO_2'] + [f"{rng.randint(1, 9)}{rng.choice('ABCDEFGH')}{rng.randint(10, 99)}_A" for _ in range(500)]
+    batch = []
+    for i in range(n_rows):
+        nan = i % 40 == 0
+        batch.append({
+            'query_id': f"sp|Q{i:05d}|SYN{i}_MOUSE", 'target_id': f"Q{i:05d}",
+            'best_hit': rng.choice(hits), 'best_evalue': 10 ** rng.uniform(-60, 1),
+            'best_score': rng.uniform(20, 400), 'score_mean': rng.uniform(20, 200),
+            'score_std': float('nan') if nan else rng.uniform(1, 50),
+            'score_gmean': float('nan') if nan else rng.uniform(1, 50),
+            'timings': {'s4pred': rng.uniform(5, 20), 'hhsearch': rng.uniform(30, 300)},
+        })
+        if len(batch) == 10000:
+            store.add_results(batch)
+            batch = []
+    store.add_results(batch)
+    store.export_hits(os.path.join(base_dir, 'final_hits_output.csv'))
+    store.export_profile(os.path.join(base_dir, 'final_profile_output.csv'))
+    store.close()
+
+def start_local_server(base_dir):
+    os.environ['RESULT_SERVER_DIR'] = base_dir
+    import logging
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)     # No per-request log lines
+    from werkzeug.serving import make_server
+    import result_server
+    server = make_server('127.0.0.1', 0, result_server.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+def worker(base_url, paths, deadline, headers, results, errors, offset):
+    parts = urlsplit(base_url)
+    conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=30)
+    i = offset
+    while time.perf_counter() < deadline:
+        path = paths[i % len(paths)]
+        i += 1
+        start = time.perf_counter()
+        try:
+            conn.request('GET', path, headers=headers)
+            response = conn.getresponse()
+            body = response.read()
+            if response.status >= 400:
+                errors[path] = errors.get(path, 0) + 1
+            results.append((path, time.perf_counter() - start, len(body)))
+        except (OSError, http.client.HTTPException):
+            errors[path] = errors.get(path, 0) + 1
+            conn.close()
+            conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=30)
+    conn.close()
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return float('nan')
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+def report(label, latencies, n_bytes, seconds, n_errors):
+    latencies.sort()
+    print(f"{label:45s} {len(latencies) / seconds:8.1f} req/s  p50 {percentile(latencies, 0.50) * 1000:7.2f} ms  "
+          f"p99 {percentile(latencies, 0.99) * 1000:7.2f} ms  {n_bytes / max(len(latencies), 1) / 1024:8.1f} KB/req"
+          f"{f'  errors {n_errors}' if n_errors else ''}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test result_server.py")
+    parser.add_argument('--url', help="Server to test (default: start one in-process on synthetic data)")
+    parser.add_argument('--concurrency', type=int, default=8, help="Client threads")
+    parser.add_argument('--seconds', type=float, default=10.0, help="Test duration")
+    parser.add_argument('--rows', type=int, default=100000, help="Synthetic results for the in-process server")
+    parser.add_argument('--gzip', action='store_true', help="Send Accept-Encoding: gzip")
+    parser.add_argument('--path', action='append', dest='paths', help="Path to request (repeatable)")
+    args = parser.parse_args()
+
+    paths = args.paths or DEFAULT_PATHS
+    headers = {'Accept-Encoding': 'gzip'} if args.gzip else {'Accept-Encoding': 'identity'}
+
+    tmp = None
+    server = None
+    base_url = args.url
+    if base_url is None:
+        tmp = tempfile.TemporaryDirectory()
+        print(f"📦 Generating {args.rows} synthetic results...")
+        populate(tmp.name, args.rows)
+        server, base_url = start_local_server(tmp.name)
+
+    print(f"🚀 {args.concurrency} clients x {args.seconds:.0f}s against {base_url} "
+          f"({'gzip' if args.gzip else 'identity'})")
+    results, errors = [], {}
+    deadline = time.perf_counter() + args.seconds
+    threads = [threading.Thread(target=worker, args=(base_url, paths, deadline, headers, results, errors, i))
+               for i in range(args.concurrency)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    for path in paths:
+        mine = [r for r in results if r[0] == path]
+        report(path, [r[1] for r in mine], sum(r[2] for r in mine), elapsed, errors.get(path, 0))
+    report("TOTAL", [r[1] for r in results], sum(r[2] for r in results), elapsed, sum(errors.values()))
+
+    if server is not None:
+        server.shutdown()
+    if tmp is not None:
+        tmp.cleanup()
+    sys.exit(1 if errors else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+import os
+import pika
+
+"""
+Shared RabbitMQ settings for the host (producer, aggregator) and the workers
+(consumer). Queues must be declared with identical arguments by every client,
+so the declarations live here.
+"""
+
+# ==========================================
+# Configuration
+# ==========================================
+# Overridable with BROKER_HOST / BROKER_PORT / BROKER_USER / BROKER_PASSWORD
+# (e.g. BROKER_HOST=localhost for a single-machine run)
+HOST_IP = os.environ.get('BROKER_HOST', '10.134.12.209')
+PORT = int(os.environ.get('BROKER_PORT', 5672))
+USERNAME = os.environ.get('BROKER_USER', 'admin')
+PASSWORD = os.environ.get('BROKER_PASSWORD', 'admin123')
+
+TASK_QUEUE = 'task_queue'       # producer -> workers: {'id', 'sequence'}
+# task_queue is a priority queue: longer (costlier) tasks are delivered first.
+# Changing its arguments requires deleting the queue once (reset_demo.sh does).
+MAX_PRIORITY = 10
+TASK_QUEUE_ARGUMENTS = {'x-max-priority': MAX_PRIORITY}
+RESULT_QUEUE = 'result_queue'   # workers -> host aggregator: one parsed row per task
+
+# Failed tasks are retried with exponential backoff: attempt n waits in
+# task_queue.retry.<n> (TTL = RETRY_BASE_SECONDS * 2^(n-1)) and is then
+# dead-lettered back into task_queue. After MAX_ATTEMPTS the task goes to
+# DEAD_LETTER_QUEUE with its error, attempt count and timings (see replay.py).
+MAX_ATTEMPTS = 3
+RETRY_BASE_SECONDS = 30
+DEAD_LETTER_QUEUE = 'task_queue.dead'
+
+# Workers -> straggler_coordinator.py: task start/finish events. Bounded and
+# expiring, so nothing piles up while no coordinator is running.
+EVENT_QUEUE = 'task_events'
+EVENT_TTL_SECONDS = 3600
+EVENT_MAX_LENGTH = 100000
+EVENT_ALIVE_SECONDS = 60        # Consumers also send an 'alive' event this often, busy or idle
+# ==========================================
+
+def connection_parameters(host=HOST_IP, heartbeat=None):
+    """
+    Authenticated connection parameters for the cluster broker.
+    """
+    credentials = pika.PlainCredentials(USERNAME, PASSWORD)
+    kwargs = {} if heartbeat is None else {'heartbeat': heartbeat}
+    return pika.ConnectionParameters(host, PORT, '/', credentials, **kwargs)
+
+def declare_task_queue(channel):
+    # Durable means the queue survives reboots
+    channel.queue_declare(queue=TASK_QUEUE, durable=True, arguments=TASK_QUEUE_ARGUMENTS)
+
+def declare_result_queue(channel):
+    channel.queue_declare(queue=RESULT_QUEUE, durable=True)
+
+def retry_queue(attempt):
+    return f"{TASK_QUEUE}.retry.{attempt}"
+
+def retry_delay(attempt):
+    """
+    Seconds a task waits before its attempt+1-th run.
+    """
+    return RETRY_BASE_SECONDS * 2 ** (attempt - 1)
+
+def declare_retry_queues(channel):
+    # One queue per delay: RabbitMQ only expires messages at the head of a queue,
+    # so mixing TTLs in one queue would hold short delays behind long ones
+    for attempt in range(1, MAX_ATTEMPTS):
+        channel.queue_declare(queue=retry_queue(attempt), durable=True, arguments={
+            'x-message-ttl': int(retry_delay(attempt) * 1000),
+            'x-dead-letter-exchange': '',
+            'x-dead-letter-routing-key': TASK_QUEUE,
+        })
+
+def declare_dead_letter_queue(channel):
+    channel.queue_declare(queue=DEAD_LETTER_QUEUE, durable=True)
+
+
+def declare_event_queue(channel):
+    channel.queue_declare(queue=EVENT_QUEUE, durable=False, arguments={
+        'x-message-ttl': EVENT_TTL_SECONDS * 1000,
+        'x-max-length': EVENT_MAX_LENGTH,
+    })
@@ -0,0 +1,200 @@
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import resource
+from concurrent.futures import ProcessPoolExecutor
+import pipeline_script
+
+"""
+usage: python3 calibrate.py [--fasta test.fa] [--sequences N] [--grid] [--profile PATH]
+       python3 calibrate.py --show
+
+Per-host tuning of the worker: how many pipelines to run side by side
+(consumer slots / prefetch) and how many threads each one gets (hhsearch
+-cpu, run_model.py -T).
+
+A short benchmark runs the same sample sequences under several
+jobs x threads combinations (by default the ones that use every core;
+--grid tries all with jobs * threads <= cores), with the result cache
+disabled and S4Pred run as run_model.py rather than through the node's
+S4Pred server, so both tools get the threads being measured and their
+memory is counted. The combination with the best throughput whose
+estimated peak memory (jobs x the largest job's peak RSS) fits in
+MEMORY_FRACTION of the available memory is saved as this host's profile. consumer.py loads the
+profile on startup (or recalibrates with --calibrate), and s4pred_server.py
+runs jobs predictors of threads torch threads each.
+"""
+
+# ==========================================
+# Configuration
+# ==========================================
+PROFILE_FILE = os.environ.get('WORKER_PROFILE', os.path.expanduser('~/worker_profile.json'))
+SAMPLE_FASTA = 'test.fa'        # Deployed next to the consumer by playbook.yml
+MEMORY_FRACTION = 0.8           # Share of MemAvailable the jobs may use together
+# ==========================================
+
+def available_memory():
+    """
+    Bytes of memory available for new work (MemAvailable), or total RAM.
+    """
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+
+def candidates(cpus, grid=False):
+    """
+    (jobs, threads) pairs to try: jobs in powers of two (and cpus itself),
+    each with cpus // jobs threads so every core is busy; with grid, every
+    such jobs/threads pair whose product is <= cpus.
+    """
+    steps = sorted(set([1 << i for i in range(cpus.bit_length())] + [cpus]))
+    if grid:
+        return [(jobs, threads) for jobs in steps for threads in steps if jobs * threads <= cpus]
+    return [(jobs, cpus // jobs) for jobs in steps]
+
+def read_sample(fasta_file, n):
+    from s4pred_server import read_fasta_text
+    records = read_fasta_text(fasta_file)
+    if not records:
+        raise ValueError(f"No sequences in {fasta_file}")
+    # Repeat the sample if it is shorter than requested
+    return [records[i % len(records)] for i in range(n)]
+
+def init_job(threads):
+    pipeline_script.THREADS = threads
+    # Timings must not be answered from the result cache
+    pipeline_script.disable_cache()
+    # S4Pred as run_model.py -T threads in this job: the node's server has
+    # threads of its own, and its memory would not be counted in ru_maxrss
+    pipeline_script.S4PRED_SOCKET = None
+
+def run_job(protein_id, sequence):
+    """
+    One pipeline run; returns (ok, peak RSS in bytes of this process plus its largest tool).
+    """
+    ok = True
+    try:
+        with pipeline_script.scratch_dir(prefix="calibrate_") as work_dir:
+            pipeline_script.analyse(protein_id, sequence, work_dir)
+    except Exception as e:
+        print(f" [!] Calibration run failed for {protein_id}: {e}")
+        ok = False
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    tool = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return ok, (own + tool) * 1024
+
+def measure(sample, jobs, threads):
+    """
+    Run the sample with jobs parallel pipelines of threads threads each.
+    """
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=jobs, initializer=init_job, initargs=(threads,)) as pool:
+        outcomes = list(pool.map(run_job, *zip(*sample)))
+    seconds = time.perf_counter() - start
+    peak = max(rss for _, rss in outcomes)
+    return {
+        'jobs': jobs,
+        'threads': threads,
+        'seconds': seconds,
+        'throughput': len(sample) / seconds,        # Sequences per second
+        'failed': sum(1 for ok, _ in outcomes if not ok),
+        'memory': jobs * peak,                      # Estimated peak with all slots busy
+    }
+
+def calibrate(sample, cpus=None, grid=False, memory=None):
+    """
+    Measure every candidate and pick the fastest that fits in memory and ran
+    without failures (1 x 1 if none does). Returns the profile.
+    """
+    cpus = cpus or os.cpu_count() or 1
+    budget = (memory or available_memory()) * MEMORY_FRACTION
+    results = []
+    for jobs, threads in candidates(cpus, grid):
+        result = measure(sample, jobs, threads)
+        result['fits'] = result['memory'] <= budget
+        notes = [] if result['fits'] else ['over memory budget']
+        if result['failed']:
+            notes.append(f"{result['failed']} failed")
+        print(f" [*] {jobs:3d} jobs x {threads:2d} threads: {result['throughput'] * 3600:8.1f} seq/h, "
+              f"~{result['memory'] / 2**30:.2f} GiB{' (' + ', '.join(notes) + ')' if notes else ''}")
+        results.append(result)
+
+    usable = [r for r in results if r['fits'] and not r['failed']]
+    best = max(usable, key=lambda r: r['throughput']) if usable else {'jobs': 1, 'threads': 1}
+    profile = {
+        'host': socket.gethostname(),
+        'cpus': cpus,
+        'memory': memory or available_memory(),
+        'jobs': best['jobs'],
+        'threads': best['threads'],
+        'throughput': best.get('throughput'),
+        'calibrated_at': time.time(),
+        'sample_size': len(sample),
+        'measurements': results,
+    }
+    return profile
+
+def save_profile(profile, path=PROFILE_FILE):
+    with open(path + '.tmp', 'w') as f:
+        json.dump(profile, f, indent=2)
+    os.replace(path + '.tmp', path)
+
+def load_profile(path=PROFILE_FILE):
+    """
+    This host's saved profile, or None if there is none (or it was made on
+    another host or a different number of cores).
+    """
+    try:
+        with open(path) as f:
+            profile = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if profile.get('host') != socket.gethostname() or profile.get('cpus') != (os.cpu_count() or 1):
+        print(f" [!] Ignoring {path}: calibrated for {profile.get('host')} with {profile.get('cpus')} CPUs")
+        return None
+    return profile
+
+def run(fasta_file=SAMPLE_FASTA, n_sequences=None, grid=False, path=PROFILE_FILE):
+    """
+    Calibrate on a sample from fasta_file and save the profile.
+    """
+    cpus = os.cpu_count() or 1
+    sample = read_sample(fasta_file, n_sequences or 2 * cpus)
+    print(f" [*] Calibrating {socket.gethostname()} ({cpus} CPUs) on {len(sample)} sequences...")
+    profile = calibrate(sample, cpus, grid)
+    save_profile(profile, path)
+    print(f" [*] Profile: {profile['jobs']} jobs x {profile['threads']} threads -> {path}")
+    return profile
+
+def main():
+    parser = argparse.ArgumentParser(description="Tune jobs x threads for this worker")
+    parser.add_argument('--fasta', default=SAMPLE_FASTA, help=f"Sample sequences (default: {SAMPLE_FASTA})")
+    parser.add_argument('--sequences', type=int, help="Sequences per measurement (default: 2 x CPUs)")
+    parser.add_argument('--grid', action='store_true', help="Try every jobs x threads <= CPUs")
+    parser.add_argument('--profile', default=PROFILE_FILE, help=f"Profile file (default: {PROFILE_FILE})")
+    parser.add_argument('--show', action='store_true', help="Print the saved profile and exit")
+    args = parser.parse_args()
+
+    if args.show:
+        profile = load_profile(args.profile)
+        if profile is None:
+            print(f"No profile for this host in {args.profile}")
+            sys.exit(1)
+        print(json.dumps({k: v for k, v in profile.items() if k != 'measurements'}, indent=2))
+        return
+
+    if not os.path.exists(args.fasta):
+        print(f"❌ Error: File not found {args.fasta}")
+        sys.exit(1)
+    run(args.fasta, args.sequences, args.grid, args.profile)
+
+if __name__ == '__main__':
+    main()
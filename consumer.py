@@ -1,132 +1,575 @@
 import pika
 import json
-import subprocess
 import os
 import time
+import signal
+import socket
+import argparse
+import functools
+import traceback
+from concurrent.futures import ProcessPoolExecutor, Future
+import pipeline_script
+import results_parser
+import broker_config
+import metrics
+import tracing
+import result_log
+import calibrate
+import db_residency
+from scheduling import CostModel
 
 # ==========================================
 # Configuration
 # ==========================================
-HOST_IP = '10.134.12.209'
-QUEUE_NAME = 'task_queue'
-PIPELINE_SCRIPT = '/home/almalinux/pipeline_script.py'
+HOST_IP = broker_config.HOST_IP
+QUEUE_NAME = broker_config.TASK_QUEUE
+RESULT_QUEUE = broker_config.RESULT_QUEUE   # Parsed rows stream back to the host aggregator
+WORKER_NAME = socket.gethostname()
+
+# Concurrency: number of pipelines run side by side and threads per pipeline.
+# Taken from the host's calibration profile (calibrate.py) if there is one,
+# otherwise one single-threaded pipeline per core.
+# Jobs run in a process pool off the connection thread, so heartbeats stay on.
+DEFAULT_SLOTS = os.cpu_count() or 1
+HEARTBEAT = 60
+
+# Per-task timeout: TIMEOUT_FACTOR x the expected time for the sequence length
+# (stamped by the producer, else the default cost model), at least MIN_TASK_TIMEOUT.
+# A hung tool is killed and the task goes through the normal retry path.
+TIMEOUT_FACTOR = 5.0
+MIN_TASK_TIMEOUT = 600
+
+# SIGTERM (autoscaler.py scaling down) drains the consumer: no new tasks are
+# taken, the running ones finish and are acked, then it exits. Checked this often.
+DRAIN_CHECK_SECONDS = 1.0
 
 # Metric file path for Monitoring
 # Node Exporter will read this file to display graphs in Grafana
-METRICS_DIR = '/home/almalinux/node_exporter_metrics'
+METRICS_DIR = os.environ.get('METRICS_DIR', '/home/almalinux/node_exporter_metrics')
 METRICS_FILE = os.path.join(METRICS_DIR, 'bio_tasks.prom')
 # ==========================================
 
+# In-memory metrics, updated on the connection thread after every task and
+# written atomically to METRICS_FILE (or served with --metrics-port)
+REGISTRY = metrics.Registry()
+TASKS_PROCESSED = REGISTRY.gauge(
+    'bio_tasks_processed_total', 'Total number of protein sequences processed')
+TASKS = REGISTRY.counter(
+    'bio_tasks_total', 'Tasks finished by this consumer, by outcome', ['status'])
+STAGE_SECONDS = REGISTRY.histogram(
+    'bio_stage_seconds', 'Time spent per pipeline stage', ['stage'], metrics.SECONDS_BUCKETS)
+QUEUE_WAIT = REGISTRY.histogram(
+    'bio_queue_wait_seconds', 'Time from enqueue (producer) to job start', buckets=metrics.WAIT_BUCKETS)
+SEQUENCE_LENGTH = REGISTRY.histogram(
+    'bio_sequence_length', 'Length of the sequences processed (residues)', buckets=metrics.LENGTH_BUCKETS)
+
+COST_MODEL = CostModel.load(None)
+SLOTS = DEFAULT_SLOTS     # Set in main(), reported to the straggler coordinator
+
+# Finished results are appended to this worker's segmented result log
+# (result_log.py) instead of one .out file per protein; its ID index is the
+# idempotency check. Opened in main(); written only on the connection thread.
+RESULT_LOG = None
+
+INFLIGHT = 0        # Messages delivered and not yet acked or nacked
+DRAINING = False    # Set by SIGTERM
+
+def expected_seconds(task):
+    return task.get('expected_seconds') or COST_MODEL.cost(len(task['sequence']))
+
+def task_timeout(tasks):
+    return max(MIN_TASK_TIMEOUT, TIMEOUT_FACTOR * sum(expected_seconds(t) for t in tasks))
+
+def count_existing_results():
+    """
+    Results this consumer has in the log when it starts (so the progress
+    gauge continues from previous runs).
+    """
+    return RESULT_LOG.count_own() if RESULT_LOG is not None else 0
+
+def record_metrics(status, timings, sequence_length, enqueued_at):
+    """
+    Update the in-memory metrics for one finished task and publish them.
+    O(1) per task: nothing is counted on disk.
+    """
+    TASKS.inc(status=status)
+    if status == 'done':
+        TASKS_PROCESSED.inc()
+    for stage in ('s4pred', 'hhsearch', 'parse', 'total'):
+        if stage in timings:
+            STAGE_SECONDS.observe(timings[stage], stage=stage)
+    if status != 'skipped':
+        SEQUENCE_LENGTH.observe(sequence_length)
+        if enqueued_at is not None and 'started_at' in timings:
+            QUEUE_WAIT.observe(max(0.0, timings['started_at'] - enqueued_at))
+    update_metrics()
+
 def update_metrics():
     """
     Custom Metric Function
-    Counts the number of .out files and writes to a .prom file for Prometheus.
+    Writes the in-memory metrics to the .prom file for Prometheus.
+    The file is replaced atomically, so node_exporter never sees a partial file.
     """
     try:
-        # Ensure the directory exists
-        os.makedirs(METRICS_DIR, exist_ok=True)
-        
-        # Count how many output files exist in the current directory
-        # This represents the "Task Completed" count
-        count = len([name for name in os.listdir('.') if name.endswith('.out')])
-        
-        # Write to the .prom file following Prometheus syntax
-        with open(METRICS_FILE, "w") as f:
-            f.write("# HELP bio_tasks_processed_total Total number of protein sequences processed\n")
-            f.write("# TYPE bio_tasks_processed_total gauge\n")
-            f.write(f"bio_tasks_processed_total {count}\n")
-            
+        REGISTRY.write_textfile(METRICS_FILE)
     except Exception as e:
         print(f" [Warning] Failed to update metrics: {e}")
 
-def run_pipeline(protein_id, sequence):
+def trace_waits(trace):
     """
-    Write a single protein to a temp file, call the pipeline, and save the results.
+    queue_wait (enqueue -> delivery) and pool_wait (delivery -> now) spans
+    for the current task.
     """
-    # Create output filename
-    safe_id = protein_id.replace('|', '_')
-    output_filename = f"{safe_id}.out"
-
-    # ==========================================
-    # Fault Tolerance / Idempotency Check
-    # ==========================================
-    # If the result file already exists, we assume the task was finished previously.
-    # We skip execution to save resources and allow "Resume" functionality.
-    if os.path.exists(output_filename):
-        print(f" [Skipped] Result already exists for: {protein_id}")
-        # Even if we skip, we must return normally so RabbitMQ can Ack the message.
+    delivered_at = trace.get('delivered_at')
+    if delivered_at is None:
         return
+    if trace.get('enqueued_at') is not None:
+        tracing.emit('queue_wait', trace['enqueued_at'], max(0.0, delivered_at - trace['enqueued_at']))
+    tracing.emit('pool_wait', delivered_at, max(0.0, time.time() - delivered_at))
 
-    # 1. Create temporary file
-    temp_filename = f"job_{safe_id}.fa"
-    with open(temp_filename, "w") as f:
-        f.write(f">{protein_id}\n{sequence}\n")
-    
+def run_pipeline(protein_id, sequence, timeout=None, trace=None):
+    """
+    Run the pipeline for a single protein (in a pool process).
+    Returns (status, row, timings, error): status is 'done' or 'failed';
+    row is the CSV result line (None if failed); timings holds the
+    seconds per stage plus 'total'; error describes a failure (else None).
+    trace ({'trace_id', 'enqueued_at', 'delivered_at', 'attempt', 'slots'})
+    ties the spans of this run to the task's trace.
+    """
+    trace = trace or {}
+    with tracing.task(trace.get('trace_id'), protein_id, attempt=trace.get('attempt', 1), slots=trace.get('slots')):
+        trace_waits(trace)
+        with tracing.span('task') as span:
+            outcome = execute_pipeline(protein_id, sequence, timeout)
+            span['status'] = outcome[0]
+    return outcome
+
+def execute_pipeline(protein_id, sequence, timeout=None):
+    safe_id = protein_id.replace('|', '_')
     print(f" [Running] Processing protein: {protein_id}")
 
-    # 2. Call external command
-    cmd = ["python3", PIPELINE_SCRIPT, temp_filename] # Fixed typo: passed temp_filename instead of safe_filename
-    
+    # 1. Each task gets its own scratch directory (tmpfs by default), so
+    # concurrent jobs never share the pipeline's fixed intermediate names.
+    # 2. The pipeline runs in this process: the sequence is passed in memory
+    # and the parsed result comes back as a record (only hhsearch/S4Pred
+    # binaries are still separate processes).
+    # 3. The result row goes back to the connection thread, which appends it
+    # to the result log; the scratch directory is removed on success or failure.
+    timings = {'started_at': time.time()}
+    start = time.perf_counter()
+    deadline = None if timeout is None else time.monotonic() + timeout
     try:
-        # Execute and capture output
-        result = subprocess.run(cmd, check=True, capture_output=True, text=True)
-        
-        # If the pipeline prints to screen (stdout), save stdout
-        if result.stdout:
-            with open(output_filename, "w") as f:
-                f.write(result.stdout)
-                
-        # If the pipeline produces a fixed filename (e.g., hhr_parse.out), rename it
-        elif os.path.exists("hhr_parse.out"):
-             os.rename("hhr_parse.out", output_filename)
-
-        print(f" [Done] Successfully generated: {output_filename}")
-        
-        # Update Monitoring Metrics after success
-        update_metrics()
-        
-        # 3. Clean up temporary file
-        if os.path.exists(temp_filename):
-            os.remove(temp_filename)
-            
-    except subprocess.CalledProcessError as e:
+        with pipeline_script.scratch_dir(prefix=f"job_{safe_id}_") as work_dir:
+            record = pipeline_script.analyse(protein_id, sequence, work_dir, timings, deadline)
+
+        timings['total'] = time.perf_counter() - start
+        print(f" [Done] Successfully analysed: {protein_id}")
+        return 'done', results_parser.format_record(record), timings, None
+
+    except Exception as e:
         print(f" [Error] Failed: {protein_id}")
-        print(f"Error message: {e.stderr}")
+        print(f"Error message: {e}")
+        traceback.print_exc()
+        timings['total'] = time.perf_counter() - start
+        return 'failed', None, timings, error_info(e)
 
-def callback(ch, method, properties, body):
+def error_info(e):
+    return {'class': type(e).__name__, 'message': str(e)[:2000]}
+
+def run_bundle(items, timeout=None, trace=None, known=None):
     """
-    RabbitMQ callback function, executed when a message is received.
+    Run the pipeline for a bundle of {'id', 'sequence', 'trace_id'} tasks with one
+    batched HHsearch. Returns [(protein_id, status, row, timings, error)],
+    one entry per protein; a failure is reported for that protein only.
+    known maps the IDs already in the result log to their rows (skipped).
     """
-    data = json.loads(body)
-    run_pipeline(data['id'], data['sequence'])
-    
+    known = known or {}
+    trace = trace or {}
+    trace_ids = {item['id']: item.get('trace_id') for item in items}
+    for item in items:
+        with tracing.task(item.get('trace_id'), item['id']):
+            trace_waits(trace)
+    outcomes = {}
+    pending = []
+    for item in items:
+        if item['id'] in known:
+            print(f" [Skipped] Result already exists for: {item['id']}")
+            outcomes[item['id']] = ('skipped', known[item['id']], {}, None)
+        else:
+            pending.append((item['id'], item['sequence']))
+
+    if pending:
+        print(f" [Running] Processing bundle of {len(pending)} proteins")
+        bundle_error = None
+        started_at = time.time()
+        start = time.perf_counter()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        try:
+            with pipeline_script.scratch_dir(prefix="bundle_") as work_dir:
+                results = pipeline_script.analyse_bundle(pending, work_dir, deadline=deadline,
+                                                         trace_ids=[trace_ids[p] for p, _ in pending])
+                for protein_id, record, timings, error in results:
+                    timings['started_at'] = started_at
+                    if error is not None:
+                        print(f" [Error] Failed: {protein_id}")
+                        print(f"Error message: {error}")
+                        outcomes[protein_id] = ('failed', None, timings, error_info(error))
+                        continue
+                    print(f" [Done] Successfully analysed: {protein_id}")
+                    outcomes[protein_id] = ('done', results_parser.format_record(record), timings, None)
+        except Exception as e:
+            # Only reached if the bundle itself could not run (e.g. scratch space)
+            print(f" [Error] Bundle failed: {e}")
+            traceback.print_exc()
+            bundle_error = error_info(e)
+        elapsed = time.perf_counter() - start
+        for protein_id, _ in pending:
+            status, row, timings, error = outcomes.setdefault(
+                protein_id, ('failed', None, {'started_at': started_at}, bundle_error))
+            # Wall time of the whole bundle, split evenly
+            timings['total'] = elapsed / len(pending)
+            tracing.emit('task', started_at, elapsed, trace=trace_ids[protein_id], task=protein_id,
+                         status=status, attempt=trace.get('attempt', 1), slots=trace.get('slots'),
+                         share=1 / len(pending))
+
+    return [(item['id'],) + outcomes[item['id']] for item in items]
+
+def publish_result(ch, protein_id, status, row, timings, sequence=None):
+    """
+    Send the parsed row to the durable result queue (publisher-confirmed,
+    so it is safely queued before the task message is acked).
+    """
+    message = {'id': protein_id, 'status': status, 'row': row, 'worker': WORKER_NAME, 'timings': timings}
+    if row is not None and sequence is not None:
+        # The host store answers this sequence under any ID from now on (producer.py --reuse)
+        message['key'] = pipeline_script.cache_keys(sequence)[1]
+        message['versions'] = pipeline_script.versions()
+    ch.basic_publish(
+        exchange='',
+        routing_key=RESULT_QUEUE,
+        body=json.dumps(message),
+        properties=pika.BasicProperties(delivery_mode=2))
+
+def publish_event(ch, event):
+    """
+    Best-effort task event for straggler_coordinator.py. A draining
+    consumer's slots are not free capacity.
+    """
+    event.update(worker=WORKER_NAME, slots=SLOTS, draining=DRAINING, at=time.time())
+    try:
+        ch.basic_publish(exchange='', routing_key=broker_config.EVENT_QUEUE, body=json.dumps(event))
+    except Exception as e:
+        print(f" [Warning] Could not publish task event: {e}")
+
+def handle_failure(ch, task, timings, error, priority=None):
+    """
+    Route a failed task: back to task_queue through the retry queue for its
+    attempt (exponential backoff), or to the dead-letter queue once
+    MAX_ATTEMPTS is reached. Returns 'retried' or 'failed' ('abandoned' for a
+    speculative copy: the original is still running, so nothing is retried).
+    Raises if the broker did not confirm the publication.
+    """
+    if task.get('speculative'):
+        print(f" [Speculative] Duplicate of {task['id']} failed; the original run continues")
+        return 'abandoned'
+    attempt = task.get('attempt', 1)
+    properties = pika.BasicProperties(delivery_mode=2, priority=priority)
+    if attempt < broker_config.MAX_ATTEMPTS:
+        # Back in task_queue once the retry queue's TTL expires
+        retry = {'id': task['id'], 'sequence': task['sequence'], 'attempt': attempt + 1,
+                 'enqueued_at': time.time() + broker_config.retry_delay(attempt),
+                 'trace_id': task.get('trace_id')}
+        ch.basic_publish(exchange='', routing_key=broker_config.retry_queue(attempt),
+                         body=json.dumps(retry), properties=properties)
+        print(f" [Retry] {task['id']} failed on attempt {attempt}, "
+              f"retrying in {broker_config.retry_delay(attempt)}s")
+        return 'retried'
+
+    dead = {'id': task['id'], 'sequence': task['sequence'], 'attempt': attempt,
+            'error': error or {'class': 'Unknown', 'message': ''}, 'timings': timings,
+            'worker': WORKER_NAME, 'failed_at': time.time(), 'trace_id': task.get('trace_id')}
+    ch.basic_publish(exchange='', routing_key=broker_config.DEAD_LETTER_QUEUE,
+                     body=json.dumps(dead), properties=properties)
+    print(f" [Dead] {task['id']} failed {attempt} times ({dead['error']['class']}), "
+          f"moved to {broker_config.DEAD_LETTER_QUEUE}")
+    return 'failed'
+
+def finish_task(ch, task, status, row, timings, error, priority=None):
+    """
+    Result log, metrics, retry / dead-lettering and the result message for one protein.
+    """
+    if status == 'failed':
+        status = handle_failure(ch, task, timings, error, priority)
+    elif status == 'done' and RESULT_LOG is not None:
+        # Before the ack: a redelivered task finds its result here and is skipped
+        with tracing.task(task.get('trace_id'), task['id']), tracing.span('write_result'):
+            RESULT_LOG.append(task['id'], row, WORKER_NAME, timings)
+
+    # Update Monitoring Metrics
+    record_metrics(status, timings, len(task['sequence']), task.get('enqueued_at'))
+
+    # A task waiting for its retry has no result yet
+    if status not in ('retried', 'abandoned'):
+        try:
+            with tracing.task(task.get('trace_id'), task['id']), tracing.span('result_publish'):
+                publish_result(ch, task['id'], status, row, timings, task['sequence'])
+        except Exception as e:
+            print(f" [Warning] Could not publish result for {task['id']}: {e}")
+
+def on_job_done(ch, delivery_tag, task, priority, future):
+    """
+    Runs on the connection thread once a pooled job has finished.
+    """
+    try:
+        status, row, timings, error = future.result()
+    except Exception as e:
+        print(f" [Error] Worker crashed on {task['id']}: {e}")
+        status, row, timings, error = 'failed', None, {}, error_info(e)
+    publish_event(ch, {'event': 'finish', 'id': task['id'], 'status': status})
+
+    try:
+        finish_task(ch, task, status, row, timings, error, priority)
+    except Exception as e:
+        # Retry / dead-letter not confirmed: let RabbitMQ redeliver the task
+        print(f" [Error] Could not requeue failed task {task['id']}: {e}")
+        ch.basic_nack(delivery_tag=delivery_tag, requeue=True)
+        return
+
     # Key: Tell RabbitMQ "I'm done, you can delete this message now"
     # Even if we skipped the task (because file exists), we MUST Ack it.
-    ch.basic_ack(delivery_tag=method.delivery_tag)
+    # Failed tasks are acked too: they now live in a retry or dead-letter queue.
+    ch.basic_ack(delivery_tag=delivery_tag)
+
+def on_bundle_done(ch, delivery_tag, bundle, priority, future):
+    """
+    Bundle counterpart of on_job_done: one result message (and metrics
+    update) per protein, then a single ack for the bundle message. Failed
+    proteins are retried as single tasks.
+    """
+    items = bundle['bundle']
+    try:
+        outcomes = future.result()
+    except Exception as e:
+        print(f" [Error] Worker crashed on a bundle of {len(items)}: {e}")
+        outcomes = [(item['id'], 'failed', None, {}, error_info(e)) for item in items]
+    publish_event(ch, {'event': 'finish', 'ids': [item['id'] for item in items], 'status': 'bundle'})
+
+    tasks = {item['id']: dict(item, attempt=bundle.get('attempt', 1), enqueued_at=bundle.get('enqueued_at'))
+             for item in items}
+    try:
+        for protein_id, status, row, timings, error in outcomes:
+            finish_task(ch, tasks[protein_id], status, row, timings, error, priority)
+    except Exception as e:
+        print(f" [Error] Could not requeue failed tasks of a bundle: {e}")
+        ch.basic_nack(delivery_tag=delivery_tag, requeue=True)
+        return
+
+    ch.basic_ack(delivery_tag=delivery_tag)
+
+def callback(ch, method, properties, body, connection, pool):
+    """
+    RabbitMQ callback function, executed when a message is received.
+    Hands the job to the process pool and returns immediately; the ack is
+    scheduled back onto the connection thread when the job completes.
+    Bundle messages ({'bundle': [{'id', 'sequence'}, ...]}) run as one job.
+    """
+    data = json.loads(body)
+    priority = getattr(properties, 'priority', None)
+    trace = {'trace_id': data.get('trace_id'), 'enqueued_at': data.get('enqueued_at'),
+             'delivered_at': time.time(), 'attempt': data.get('attempt', 1), 'slots': SLOTS}
+    # ==========================================
+    # Fault Tolerance / Idempotency Check
+    # ==========================================
+    # A protein already in the result log was finished previously: it is not
+    # run again, but its stored row is re-sent (the aggregator ignores IDs it
+    # already has) and the message is acked as usual.
+    if 'bundle' in data:
+        timeout = task_timeout(data['bundle'])
+        known = {item['id']: RESULT_LOG.lookup(item['id']) for item in data['bundle']
+                 if RESULT_LOG is not None and item['id'] in RESULT_LOG}
+        future = pool.submit(run_bundle, data['bundle'], timeout, trace, known)
+        done = on_bundle_done
+        publish_event(ch, {'event': 'start', 'ids': [item['id'] for item in data['bundle']],
+                           'expected': sum(expected_seconds(item) for item in data['bundle'])})
+    else:
+        timeout = task_timeout([data])
+        if RESULT_LOG is not None and data['id'] in RESULT_LOG:
+            print(f" [Skipped] Result already exists for: {data['id']}")
+            future = Future()
+            future.set_result(('skipped', RESULT_LOG.lookup(data['id']), {}, None))
+        else:
+            future = pool.submit(run_pipeline, data['id'], data['sequence'], timeout, trace)
+        done = on_job_done
+        # The coordinator needs the sequence to launch a speculative copy
+        publish_event(ch, {'event': 'start', 'id': data['id'], 'sequence': data['sequence'],
+                           'trace_id': data.get('trace_id'), 'expected': expected_seconds(data),
+                           'speculative': bool(data.get('speculative'))})
+    global INFLIGHT
+    INFLIGHT += 1
+    future.add_done_callback(
+        lambda f: connection.add_callback_threadsafe(
+            functools.partial(settle, done, ch, method.delivery_tag, data, priority, f)))
+
+def settle(done, *args):
+    """
+    Run a job's completion handler (on the connection thread) and count it off.
+    """
+    global INFLIGHT
+    try:
+        done(*args)
+    finally:
+        INFLIGHT -= 1
+
+def request_drain(signum, frame):
+    # Only sets a flag: pika calls are not safe from a signal handler
+    global DRAINING
+    DRAINING = True
+
+def watch_drain(connection, channel, consumer_tag):
+    """
+    Cancel the consumer once SIGTERM was received. RabbitMQ sends nothing
+    more and pika requeues the prefetched messages no job has started on,
+    so start_consuming() returns; main() then waits for the running jobs.
+    """
+    if not DRAINING:
+        connection.call_later(DRAIN_CHECK_SECONDS, functools.partial(
+            watch_drain, connection, channel, consumer_tag))
+        return
+    print(f" [*] Draining: no new tasks, waiting for {INFLIGHT} in flight...")
+    channel.basic_cancel(consumer_tag)
+    publish_event(channel, {'event': 'stop'})
+
+def finish_inflight(connection):
+    # Completion handlers are scheduled onto this thread, so keep processing events
+    while INFLIGHT:
+        connection.process_data_events(time_limit=1)
+
+def init_worker(threads, node):
+    # Runs in every pool process (also correct under the spawn start method)
+    pipeline_script.THREADS = threads
+    # A forked worker inherits request_drain; only the consumer itself drains
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    tracing.NODE = node
+
+def load_settings(args):
+    """
+    (slots, threads): --slots wins, then the calibration profile, then the defaults.
+    """
+    profile = None
+    if args.calibrate:
+        try:
+            profile = calibrate.run(args.calibration_fasta, path=args.profile)
+        except (OSError, ValueError) as e:
+            print(f" [Warning] Calibration failed ({e}), using defaults.")
+    else:
+        profile = calibrate.load_profile(args.profile)
+    if profile is not None:
+        print(f" [*] Using profile {args.profile}: {profile['jobs']} jobs x {profile['threads']} threads")
+    slots = args.slots or (profile['jobs'] if profile else DEFAULT_SLOTS)
+    threads = profile['threads'] if profile else 1
+    return max(1, slots), max(1, threads)
 
 def main():
-    print(f" [*] Connecting to Host ({HOST_IP})...")
+    parser = argparse.ArgumentParser(description="RabbitMQ worker for the protein pipeline")
+    parser.add_argument('--slots', type=int,
+                        help=f"Pipelines to run concurrently (default: from the profile, else CPU count = {DEFAULT_SLOTS})")
+    parser.add_argument('--metrics-port', type=int,
+                        help="Also serve the metrics on http://0.0.0.0:PORT/metrics")
+    parser.add_argument('--profile', default=calibrate.PROFILE_FILE,
+                        help=f"Host calibration profile (default: {calibrate.PROFILE_FILE})")
+    parser.add_argument('--calibrate', action='store_true',
+                        help="Benchmark jobs x threads combinations first and save the profile")
+    parser.add_argument('--calibration-fasta', default=calibrate.SAMPLE_FASTA,
+                        help=f"Sample sequences for --calibrate (default: {calibrate.SAMPLE_FASTA})")
+    parser.add_argument('--instance',
+                        help="Name of this consumer when several run on one node (set by autoscaler.py)")
+    parser.add_argument('--no-warm', action='store_true',
+                        help="Take tasks right away instead of first warming pdb70 into the page cache")
+    args = parser.parse_args()
+    global SLOTS, RESULT_LOG, WORKER_NAME, METRICS_FILE
+    slots, threads = load_settings(args)
+    SLOTS = slots
+    if args.instance:
+        # Own result log segments, metrics file and name in events and traces
+        WORKER_NAME = f"{socket.gethostname()}.{args.instance}"
+        METRICS_FILE = os.path.join(METRICS_DIR, f'bio_tasks_{args.instance}.prom')
+        REGISTRY.const_labels['consumer'] = args.instance
+        tracing.NODE = WORKER_NAME
+    RESULT_LOG = result_log.ResultLog(node=WORKER_NAME)
+    print(f" [*] Result log {RESULT_LOG.log_dir}: {len(RESULT_LOG)} results")
+    # Hashed once, before the pool forks: the workers inherit the versions
+    versions = pipeline_script.versions()
+    print(f" [*] Tool versions: S4Pred {versions['s4pred']}, HHsearch {versions['hhsearch'].split(';')[0]}")
+
+    print(f" [*] Connecting to Host ({HOST_IP}) with {slots} slot(s) x {threads} thread(s)...")
     
     # Ensure metric directory exists on startup
     os.makedirs(METRICS_DIR, exist_ok=True)
+    TASKS_PROCESSED.set(count_existing_results())
+    update_metrics()
+    if args.metrics_port:
+        REGISTRY.serve(args.metrics_port)
+        print(f" [*] Metrics on http://0.0.0.0:{args.metrics_port}/metrics")
+
+    # Tasks started on a cold page cache wait for disk on every pdb70 read:
+    # warm the hot set before subscribing (bounded by WARM_TIMEOUT)
+    if not args.no_warm:
+        db_residency.wait_until_warm(pipeline_script.HHDB_PATH)
 
     try:
         # Add username/password authentication
-        credentials = pika.PlainCredentials('admin', 'admin123')
-        # Add heartbeat=0 to tell Server not to kick me out for taking too long
-        parameters = pika.ConnectionParameters(HOST_IP, 5672, '/', credentials, heartbeat=0)
+        # Jobs run in the pool, so the connection thread is free to answer heartbeats
+        parameters = broker_config.connection_parameters(HOST_IP, heartbeat=HEARTBEAT)
         connection = pika.BlockingConnection(parameters)
         channel = connection.channel()
-        channel.queue_declare(queue=QUEUE_NAME, durable=True)
+        broker_config.declare_task_queue(channel)
+        broker_config.declare_result_queue(channel)
+        broker_config.declare_retry_queues(channel)
+        broker_config.declare_dead_letter_queue(channel)
+        broker_config.declare_event_queue(channel)
+        # Result publications are confirmed before the task is acked
+        channel.confirm_delivery()
+
+        # Key optimization: Load balancing, one unacked message per free slot
+        channel.basic_qos(prefetch_count=slots)
 
-        # Key optimization: Load balancing
-        channel.basic_qos(prefetch_count=1)
+        pool = ProcessPoolExecutor(max_workers=slots, initializer=init_worker, initargs=(threads, tracing.NODE))
+        consumer_tag = channel.basic_consume(queue=QUEUE_NAME, on_message_callback=functools.partial(
+            callback, connection=connection, pool=pool))
+        signal.signal(signal.SIGTERM, request_drain)
+        watch_drain(connection, channel, consumer_tag)
 
-        channel.basic_consume(queue=QUEUE_NAME, on_message_callback=callback)
+        # fsync the result log at least every SYNC_SECONDS, also when idle
+        def sync_log():
+            RESULT_LOG.sync()
+            connection.call_later(result_log.SYNC_SECONDS, sync_log)
+
+        # Keeps this consumer's slots known to straggler_coordinator.py while
+        # its tasks run; a consumer that stops sending is forgotten there
+        def send_alive():
+            publish_event(channel, {'event': 'alive'})
+            connection.call_later(broker_config.EVENT_ALIVE_SECONDS, send_alive)
+        send_alive()
+        connection.call_later(result_log.SYNC_SECONDS, sync_log)
+
+        # Keeps this consumer's slots known to straggler_coordinator.py while
+        # its tasks run; a consumer that stops sending is forgotten there
+        def send_alive():
+            publish_event(channel, {'event': 'alive'})
+            connection.call_later(broker_config.EVENT_ALIVE_SECONDS, send_alive)
+        send_alive()
 
         print(' [*] Waiting for tasks... Press CTRL+C to exit')
-        channel.start_consuming()
-        
+        try:
+            channel.start_consuming()
+            # Only returns after a SIGTERM: finish and ack the running tasks
+            finish_inflight(connection)
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+            RESULT_LOG.close()
+        connection.close()
+        print(" [*] Drained, exiting.")
+
     except Exception as e:
         print(f"Connection failed: {e}")
         print("Please check if Host firewall port 5672 is open, and if the IP is correct.")
@@ -1,15 +1,39 @@
 import os
+import re
 import sys
-import math
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import results_parser
+import result_log
+from result_store import ResultStore
+
+"""
+usage: python3 create_final_report.py [--workers N] [--rebuild]
+
+Incremental report builder on top of the result store (results.db, see
+result_store.py). The store's file manifest records every ingested .out
+file by name, size and mtime; a re-run only parses new or changed files,
+in a process pool, bulk-inserts their rows and drops the rows of files that
+disappeared. Workers' result log segments (<node>-<n>.seg, see
+result_log.py) are read directly, like .out files; a segment that has
+grown since the last run is re-read as a whole. Result IDs are matched to
+experiment IDs through a precomputed accession/header index instead of a
+substring scan over every target. The CSVs are exported from the store's
+views, streaming, so memory stays flat at millions of results.
+"""
 
 # ================= Settings =================
-RESULTS_DIR = "final_data"            
-ID_FILE = "experiment_ids.txt"        
-OUTPUT_HITS = "final_hits_output.csv"       
-OUTPUT_PROFILE = "final_profile_output.csv" 
-MISSING_FILE = "missing_ids.txt"      
+RESULTS_DIR = "final_data"
+ID_FILE = "experiment_ids.txt"
+OUTPUT_HITS = "final_hits_output.csv"
+OUTPUT_PROFILE = "final_profile_output.csv"
+MISSING_FILE = "missing_ids.txt"
+DEFAULT_WORKERS = os.cpu_count() or 1
+INSERT_BATCH = 5000                   # Parsed files per store transaction
 # =========================================
 
+_RE_ID_TOKENS = re.compile(r"[|\s]+")
+
 def get_clean_id(header_string):
     try:
         if "|" in header_string:
@@ -18,121 +42,186 @@ def get_clean_id(header_string):
     except:
         return header_string
 
+def load_target_ids(id_file=ID_FILE):
+    with open(id_file, 'r') as f:
+        return set(line.strip() for line in f if line.strip())
+
+def parse_result_line(line):
+    """
+    (raw_id, best_hit, std, gmean) for a CSV result row, None for headers,
+    log lines and malformed rows. std/gmean may be NaN.
+    """
+    if "query_id" in line or "," not in line:
+        return None
+    parts = line.strip().split(',')
+    # index 0: query_id, 1: hit, 5: std, 6: gmean
+    if len(parts) < 7:
+        return None
+    try:
+        return parts[0], parts[1], float(parts[5]), float(parts[6])
+    except ValueError:
+        return None
+
+class TargetIndex:
+    """
+    Maps a result's query ID (full FASTA header ID, e.g. sp|Q9D0L4|ADCK1_MOUSE)
+    to its experiment ID with dictionary lookups: the accession from
+    get_clean_id, then every '|'/whitespace-separated part, with and without
+    an isoform ('-2') or version ('.1') suffix.
+    """
+    def __init__(self, target_ids):
+        self.target_ids = target_ids
+
+    def resolve(self, raw_id):
+        clean_id = get_clean_id(raw_id)
+        if clean_id in self.target_ids:
+            return clean_id
+        if raw_id in self.target_ids:
+            return raw_id
+        for token in _RE_ID_TOKENS.split(raw_id):
+            for key in (token, token.split('-')[0], token.split('.')[0]):
+                if key in self.target_ids:
+                    return key
+        return None
+
+def resolve_target_id(raw_id, target_index):
+    """
+    The experiment ID a result row belongs to (None if it matches none).
+    """
+    return target_index.resolve(raw_id)
+
+def parse_result_file(filepath):
+    """
+    Pool worker: the result records (results_parser.record_from_row) of one
+    .out file or result log segment, NaN rows included. None if the file is
+    unreadable.
+    """
+    try:
+        if filepath.endswith(result_log.SEGMENT_SUFFIX):
+            return result_log.read_segment(filepath)
+        with open(filepath, 'r') as f:
+            records = []
+            for line in f:
+                if "Traceback" in line:
+                    # A crash log, not a result
+                    return []
+                if parse_result_line(line) is None:
+                    continue
+                try:
+                    records.append(results_parser.record_from_row(line))
+                except ValueError:
+                    continue
+            return records
+    except Exception:
+        return None
+
+def scan_results(store, results_dir=RESULTS_DIR):
+    """
+    Compare final_data/ with the manifest: returns (changed, removed), where
+    changed is [(name, size, mtime_ns)] of new or modified .out files and segments.
+    """
+    known = store.known_files()
+    changed = []
+    with os.scandir(results_dir) as entries:
+        for entry in entries:
+            if not entry.name.endswith((".out", result_log.SEGMENT_SUFFIX)) or not entry.is_file():
+                continue
+            st = entry.stat()
+            if known.pop(entry.name, None) != (st.st_size, st.st_mtime_ns):
+                changed.append((entry.name, st.st_size, st.st_mtime_ns))
+    return changed, list(known)
+
+def ingest(store, changed, target_index, workers, results_dir=RESULTS_DIR):
+    """
+    Parse changed files in a process pool and replace their rows in the store.
+    Returns the number of files ingested.
+    """
+    paths = [os.path.join(results_dir, name) for name, _, _ in changed]
+    ingested = 0
+    batch = []
+
+    def commit(batch):
+        store.forget_sources([meta[0] for meta, _ in batch])
+        records = []
+        for (name, _, _), file_records in batch:
+            for record in file_records:
+                record['target_id'] = resolve_target_id(record['query_id'], target_index)
+                record['source'] = name
+                records.append(record)
+        store.add_results(records)
+        store.record_files([meta for meta, _ in batch])
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        chunksize = max(1, min(256, len(paths) // (workers * 4) or 1))
+        for meta, result in zip(changed, pool.map(parse_result_file, paths, chunksize=chunksize)):
+            if result is None:
+                continue    # Unreadable now (e.g. being written): retried next run
+            batch.append((meta, result))
+            if len(batch) >= INSERT_BATCH:
+                commit(batch)
+                ingested += len(batch)
+                batch = []
+    if batch:
+        commit(batch)
+        ingested += len(batch)
+    return ingested
+
 def main():
+    parser = argparse.ArgumentParser(description="Build the final report from final_data/")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                        help=f"Parser processes (default: {DEFAULT_WORKERS})")
+    parser.add_argument('--rebuild', action='store_true', help="Forget the file manifest and re-read every file")
+    args = parser.parse_args()
+
     print(f"🚀 Starting report compilation (NaN exclusion mode)...")
-    
+
     if not os.path.exists(ID_FILE):
         print(f"❌ Error: File not found {ID_FILE}")
         sys.exit(1)
 
-    with open(ID_FILE, 'r') as f:
-        target_ids = set(line.strip() for line in f if line.strip())
-    
-    # Prepare containers
-    hits_data = []      
-    all_stds = []       
-    all_gmeans = []     
-    found_ids = set()   
-    
-    # Count invalid data (NaN)
-    nan_count = 0 
-    
-    files = os.listdir(RESULTS_DIR)
-    print(f"📂 Scanning {len(files)} files...")
-
-    for filename in files:
-        if not filename.endswith(".out"):
-            continue
-
-        filepath = os.path.join(RESULTS_DIR, filename)
-        
-        try:
-            with open(filepath, 'r') as f:
-                content = f.read().strip()
-                
-                if not content or "Traceback" in content:
-                    continue
+    target_ids = load_target_ids()
+    target_index = TargetIndex(target_ids)
+
+    store = ResultStore()
+    if args.rebuild:
+        # Only rows read from files; streamed results are not in final_data/
+        store.forget_sources(list(store.known_files()))
+
+    # 1. Find new / changed / removed files
+    changed, removed = scan_results(store)
+    print(f"📂 {len(changed)} new or changed files, {len(removed)} removed...")
+    if removed:
+        store.forget_sources(removed)
 
-                lines = content.split('\n')
-                for line in lines:
-                    if "query_id" in line or "," not in line:
-                        continue
-                        
-                    parts = line.split(',')
-                    # index 0: query_id, 1: hit, 5: std, 6: gmean
-                    if len(parts) >= 7:
-                        raw_id = parts[0]
-                        best_hit = parts[1]
-                        
-                        try:
-                            # --- Key Fix: Check for NaN ---
-                            val_std = float(parts[5])
-                            val_gmean = float(parts[6])
-
-                            # If nan (invalid value), skip it; do not add to list
-                            if math.isnan(val_std) or math.isnan(val_gmean):
-                                nan_count += 1
-                                # Even if values are bad, the ID ran. Should it count as a hit?
-                                # NaN usually means calculation failure. Suggest excluding from stats.
-                                continue 
-                            
-                            # Add only valid values
-                            all_stds.append(val_std)
-                            all_gmeans.append(val_gmean)
-                            
-                            # Add to Hits list
-                            hits_data.append(f"{raw_id},{best_hit}")
-
-                            # Record ID
-                            clean_id = get_clean_id(raw_id)
-                            if clean_id in target_ids:
-                                found_ids.add(clean_id)
-                            else:
-                                for tid in target_ids:
-                                    if tid in raw_id:
-                                        found_ids.add(tid)
-                                        break
-
-                        except ValueError:
-                            continue 
-
-        except Exception:
-            pass 
-
-    # 3. Output Hits CSV
-    print(f"💾 Writing {OUTPUT_HITS} ({len(hits_data)} records)...")
-    with open(OUTPUT_HITS, 'w') as f:
-        f.write("fasta_id,best_hit_id\n") 
-        for line in hits_data:
-            f.write(line + "\n")
-
-    # 4. Output Profile CSV
+    # 2. Parse only those, in parallel
+    if changed:
+        ingested = ingest(store, changed, target_index, max(1, args.workers))
+        print(f"   ℹ️  Parsed {ingested} files with {args.workers} workers")
+
+    # 3. Output Hits CSV (exported from hits_view)
+    n_hits = store.export_hits(OUTPUT_HITS)
+    print(f"💾 Wrote {OUTPUT_HITS} ({n_hits} records)")
+
+    # 4. Output Profile CSV (exported from profile_view)
     print(f"💾 Calculating {OUTPUT_PROFILE} ...")
-    print(f"   ℹ️  Excluded NaN data count: {nan_count}")
-    print(f"   ℹ️  Valid data used for calculation: {len(all_stds)}")
-
-    if len(all_stds) > 0:
-        avg_std = sum(all_stds) / len(all_stds)
-        avg_gmean = sum(all_gmeans) / len(all_gmeans)
-        
-        with open(OUTPUT_PROFILE, 'w') as f:
-            f.write("ave_std,ave_gmean\n")
-            f.write(f"{avg_std:.2f},{avg_gmean:.2f}\n")
-            
+    print(f"   ℹ️  Excluded NaN data count: {store.counts().get('nan', 0)}")
+    print(f"   ℹ️  Valid data used for calculation: {n_hits}")
+
+    profile = store.export_profile(OUTPUT_PROFILE)
+    if profile is not None:
+        avg_std, avg_gmean, _ = profile
         print(f"   ✅ Success! Ave STD = {avg_std:.2f}, Ave GMean = {avg_gmean:.2f}")
     else:
         print("❌ Error: All data is NaN or missing. Cannot calculate averages!")
 
     # 5. Missing Check
-    missing_ids = target_ids - found_ids
+    missing_ids = store.export_missing(MISSING_FILE, target_ids)
+    store.close()
     print("-" * 30)
     if missing_ids:
         print(f"⚠️ There are {len(missing_ids)} tasks incomplete or NaN")
-        with open(MISSING_FILE, 'w') as f:
-            for mid in sorted(missing_ids):
-                f.write(mid + "\n")
     else:
         print(" Perfect! All tasks completed!")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,345 @@
+import os
+import sys
+import time
+import ctypes
+import ctypes.util
+import resource
+import argparse
+import metrics
+
+"""
+usage: python3 db_residency.py status  [--db /data/pdb70/pdb70]
+       python3 db_residency.py warm    [--db PATH] [--all] [--min-resident F] [--timeout S]
+       python3 db_residency.py serve   [--db PATH] [--all] [--lock] [--interval S]
+       python3 db_residency.py monitor [--db PATH] [--interval S]
+
+Page-cache residency of the pdb70 database on a worker.
+
+Every hhsearch run reads the whole cs219 prefilter database and the three
+ffindex files (the hot set), then the hhm/a3m records of the prefilter hits
+from the multi-GB ffdata files (the cold set). After a reboot, or once
+memory pressure has evicted them, the first tasks on a worker wait for disk.
+
+Residency is measured with mincore(2) over a read-only mapping of each file.
+`warm` reads the hot set into the page cache, skipping chunks that are
+already resident, and exits 0 once at least F of it is resident; --all also
+warms the cold set, as far as it fits in MEMORY_FRACTION of the RAM.
+consumer.py calls wait_until_warm() before it takes its first task.
+
+`serve` (the pdb70_residency systemd service) warms, optionally mlock(2)s
+the hot set (--lock; needs LimitMEMLOCK), and then every interval re-warms
+the hot set if it was evicted and writes residency plus the node's major
+page fault and disk read rates (/proc/vmstat) to METRICS_DIR/pdb70.prom.
+`monitor` prints the same figures; `status` prints residency once.
+"""
+
+# ==========================================
+# Configuration
+# ==========================================
+HHDB_PATH = os.environ.get('HHDB_PATH', '/data/pdb70/pdb70')
+HOT_SUFFIXES = ('_cs219.ffdata', '_cs219.ffindex', '_hhm.ffindex', '_a3m.ffindex')
+COLD_SUFFIXES = ('_hhm.ffdata', '_a3m.ffdata')
+MIN_RESIDENT = 0.95             # Share of the hot set that counts as warm
+WARM_TIMEOUT = 900              # Give up waiting (and start anyway) after this long
+CHUNK_BYTES = 8 * 1024 * 1024   # Read (and residency-checked) in chunks of this size
+MEMORY_FRACTION = 0.5           # --all: share of RAM the cold set may fill in the page cache
+INTERVAL = 30.0
+METRICS_DIR = os.environ.get('METRICS_DIR', '/home/almalinux/node_exporter_metrics')
+METRICS_FILE = os.path.join(METRICS_DIR, 'pdb70.prom')
+# ==========================================
+
+REGISTRY = metrics.Registry()
+FILE_BYTES = REGISTRY.gauge('pdb70_file_bytes', 'Size of each pdb70 file', ['file', 'set'])
+RESIDENT_BYTES = REGISTRY.gauge('pdb70_resident_bytes', 'Bytes of each pdb70 file in the page cache', ['file', 'set'])
+LOCKED_BYTES = REGISTRY.gauge('pdb70_locked_bytes', 'Bytes of each pdb70 file locked in memory', ['file'])
+HOT_RATIO = REGISTRY.gauge('pdb70_hot_resident_ratio', 'Share of the hot set (cs219 + ffindex files) in the page cache')
+WARM_READ = REGISTRY.counter('pdb70_warm_read_bytes_total', 'Bytes read from disk to warm the page cache')
+MAJOR_FAULTS = REGISTRY.gauge('pdb70_node_major_faults_per_second', 'Major page faults per second on this node')
+DISK_READ = REGISTRY.gauge('pdb70_node_read_bytes_per_second', 'Bytes paged in from disk per second on this node')
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+PROT_READ = 0x1
+MAP_SHARED = 0x01
+
+_libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+_libc.mmap.restype = ctypes.c_void_p
+_libc.mmap.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int, ctypes.c_int, ctypes.c_int, ctypes.c_long]
+_libc.munmap.argtypes = [ctypes.c_void_p, ctypes.c_size_t]
+_libc.mincore.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_char_p]
+_libc.mlock.argtypes = [ctypes.c_void_p, ctypes.c_size_t]
+MAP_FAILED = ctypes.c_void_p(-1).value
+
+def db_files(db_path=HHDB_PATH, cold=True):
+    """
+    [(path, 'hot' or 'cold')] of the database files that exist.
+    """
+    files = [(db_path + suffix, 'hot') for suffix in HOT_SUFFIXES]
+    if cold:
+        files += [(db_path + suffix, 'cold') for suffix in COLD_SUFFIXES]
+    return [(path, kind) for path, kind in files if os.path.exists(path)]
+
+class Mapping:
+    """
+    Read-only shared mapping of a whole file (nothing is read by mapping it).
+    """
+    def __init__(self, path):
+        self.path = path
+        self.size = os.path.getsize(path)
+        self.address = None
+        self.locked = False
+        if self.size == 0:
+            return
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            address = _libc.mmap(None, self.size, PROT_READ, MAP_SHARED, fd, 0)
+        finally:
+            os.close(fd)
+        if address in (None, MAP_FAILED):
+            raise OSError(ctypes.get_errno(), f"mmap failed for {path}")
+        self.address = address
+
+    def residency(self):
+        """
+        One byte per page, bit 0 set if the page is in the page cache.
+        """
+        if self.address is None:
+            return b''
+        vec = ctypes.create_string_buffer((self.size + PAGE_SIZE - 1) // PAGE_SIZE)
+        if _libc.mincore(self.address, self.size, vec) != 0:
+            raise OSError(ctypes.get_errno(), f"mincore failed for {self.path}")
+        return vec.raw
+
+    def resident_bytes(self):
+        vec = self.residency()
+        return min(self.size, (len(vec) - vec.count(0)) * PAGE_SIZE)
+
+    def lock(self):
+        """
+        mlock the whole mapping (reads it in); False if the limit does not allow it.
+        """
+        if self.address is None or self.locked:
+            return self.locked
+        if _libc.mlock(self.address, self.size) != 0:
+            errno = ctypes.get_errno()
+            print(f" [Warning] Could not lock {self.path} ({os.strerror(errno)}); "
+                  f"RLIMIT_MEMLOCK is {resource.getrlimit(resource.RLIMIT_MEMLOCK)[0]} bytes")
+            return False
+        self.locked = True
+        return True
+
+    def close(self):
+        if self.address is not None:
+            _libc.munmap(self.address, self.size)     # Also drops the lock
+            self.address = None
+            self.locked = False
+
+def resident_bytes(path):
+    mapping = Mapping(path)
+    try:
+        return mapping.resident_bytes()
+    finally:
+        mapping.close()
+
+def warm_file(path, budget=None):
+    """
+    Read the chunks of a file that are not fully resident, up to budget bytes.
+    Returns the bytes read.
+    """
+    mapping = Mapping(path)
+    try:
+        vec = mapping.residency()
+    finally:
+        mapping.close()
+    pages = CHUNK_BYTES // PAGE_SIZE
+    read = 0
+    with open(path, 'rb', buffering=0) as f:
+        os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        buffer = bytearray(CHUNK_BYTES)
+        for n, first in enumerate(range(0, len(vec), pages)):
+            if vec.count(0, first, first + pages) == 0:
+                continue
+            if budget is not None and read >= budget:
+                break
+            f.seek(n * CHUNK_BYTES)
+            read += f.readinto(buffer)
+    WARM_READ.inc(read)
+    return read
+
+def warm(db_path=HHDB_PATH, cold=False):
+    """
+    Warm the hot set, then (cold=True) the cold set within the memory budget.
+    Returns (bytes read, seconds).
+    """
+    start = time.perf_counter()
+    read = 0
+    for path, kind in db_files(db_path, cold=False):
+        read += warm_file(path)
+    if cold:
+        # Not MemAvailable: the page cache we fill counts as available
+        cold_files = [path for path, kind in db_files(db_path) if kind == 'cold']
+        budget = int(os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') * MEMORY_FRACTION)
+        budget -= sum(resident_bytes(path) for path in cold_files)
+        for path in cold_files:
+            if budget > 0:
+                n = warm_file(path, budget)
+                budget -= n
+                read += n
+    return read, time.perf_counter() - start
+
+def measure(db_path=HHDB_PATH, locked=()):
+    """
+    {path: (kind, size, resident bytes)} and the hot resident ratio; also
+    updates the residency metrics.
+    """
+    report = {}
+    hot_size = hot_resident = 0
+    for path, kind in db_files(db_path):
+        size, resident = os.path.getsize(path), resident_bytes(path)
+        report[path] = (kind, size, resident)
+        name = os.path.basename(path)
+        FILE_BYTES.set(size, file=name, set=kind)
+        RESIDENT_BYTES.set(resident, file=name, set=kind)
+        LOCKED_BYTES.set(size if path in locked else 0, file=name)
+        if kind == 'hot':
+            hot_size += size
+            hot_resident += resident
+    ratio = hot_resident / hot_size if hot_size else 0.0
+    HOT_RATIO.set(ratio)
+    return report, ratio
+
+def wait_until_warm(db_path=HHDB_PATH, min_resident=MIN_RESIDENT, timeout=WARM_TIMEOUT):
+    """
+    Warm the hot set until at least min_resident of it is in the page cache
+    (several processes may do this at once: resident chunks are skipped).
+    Returns True when warm, False on timeout or if there is no database.
+    """
+    if not db_files(db_path, cold=False):
+        print(f" [Skipped] No pdb70 database at {db_path}, not waiting for it")
+        return False
+    deadline = time.monotonic() + timeout
+    while True:
+        read, seconds = warm(db_path)
+        _, ratio = measure(db_path)
+        if read:
+            print(f" [*] Warmed pdb70: read {read / 2**20:.0f} MiB in {seconds:.1f}s, {ratio:.0%} of the hot set resident")
+        if ratio >= min_resident:
+            return True
+        if time.monotonic() >= deadline:
+            print(f" [Warning] pdb70 hot set only {ratio:.0%} resident after {timeout}s, starting anyway")
+            return False
+        time.sleep(5)
+
+def vmstat():
+    counters = {}
+    with open('/proc/vmstat') as f:
+        for line in f:
+            key, _, value = line.partition(' ')
+            if key in ('pgmajfault', 'pgpgin'):
+                counters[key] = int(value)
+    return counters
+
+class Rates:
+    """
+    Node-wide major faults and disk reads per second between two samples.
+    """
+    def __init__(self):
+        self.last = (time.monotonic(), vmstat())
+
+    def sample(self):
+        now, counters = time.monotonic(), vmstat()
+        then, previous = self.last
+        self.last = (now, counters)
+        seconds = max(now - then, 1e-9)
+        faults = (counters['pgmajfault'] - previous['pgmajfault']) / seconds
+        read = (counters['pgpgin'] - previous['pgpgin']) * 1024 / seconds    # pgpgin is in KiB
+        MAJOR_FAULTS.set(faults)
+        DISK_READ.set(read)
+        return faults, read
+
+def print_status(report, ratio):
+    print(f"  {'file':28s} {'set':4s} {'size MiB':>10s} {'resident':>9s}")
+    for path, (kind, size, resident) in report.items():
+        print(f"  {os.path.basename(path):28s} {kind:4s} {size / 2**20:10.1f} {resident / size if size else 0:9.1%}")
+    print(f"  hot set resident: {ratio:.1%}")
+
+def write_metrics():
+    try:
+        REGISTRY.write_textfile(METRICS_FILE)
+    except Exception as e:
+        print(f" [Warning] Failed to update metrics: {e}")
+
+def serve(db_path, cold, lock, interval, min_resident):
+    """
+    Keep the hot set warm (and locked with lock) and publish the metrics.
+    Runs until interrupted; waits for the database to appear.
+    """
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    locked = {}
+    rates = Rates()
+    print(f"🚀 Keeping {db_path} warm (hot set >= {min_resident:.0%}{', locked' if lock else ''}), "
+          f"metrics in {METRICS_FILE} every {interval:g}s")
+    while True:
+        if db_files(db_path, cold=False):
+            _, ratio = measure(db_path, locked)
+            if ratio < min_resident or cold:
+                read, seconds = warm(db_path, cold)
+                if read:
+                    print(f" [*] Warmed {read / 2**20:.0f} MiB in {seconds:.1f}s (hot set was {ratio:.0%} resident)")
+            if lock:
+                for path, _ in db_files(db_path, cold=False):
+                    if path not in locked:
+                        mapping = Mapping(path)
+                        if mapping.lock():
+                            locked[path] = mapping
+                        else:
+                            mapping.close()
+            _, ratio = measure(db_path, locked)
+            faults, read = rates.sample()
+            print(f" [*] hot set {ratio:.1%} resident, {len(locked)} files locked | "
+                  f"{faults:.0f} major faults/s, {read / 2**20:.1f} MiB/s read")
+        else:
+            print(f" [Warning] No pdb70 database at {db_path} yet")
+        write_metrics()
+        time.sleep(interval)
+
+def main():
+    parser = argparse.ArgumentParser(description="Page-cache residency of the pdb70 database")
+    parser.add_argument('command', choices=('status', 'warm', 'serve', 'monitor'))
+    parser.add_argument('--db', default=HHDB_PATH, help=f"Database prefix (default: {HHDB_PATH})")
+    parser.add_argument('--all', action='store_true', help="Also warm the hhm/a3m ffdata files, within the memory budget")
+    parser.add_argument('--lock', action='store_true', help="serve: mlock the hot set")
+    parser.add_argument('--min-resident', type=float, default=MIN_RESIDENT,
+                        help=f"Share of the hot set that counts as warm (default: {MIN_RESIDENT})")
+    parser.add_argument('--timeout', type=float, default=WARM_TIMEOUT,
+                        help=f"warm: give up after this many seconds (default: {WARM_TIMEOUT})")
+    parser.add_argument('--interval', type=float, default=INTERVAL, help=f"Seconds between samples (default: {INTERVAL:g})")
+    args = parser.parse_args()
+
+    if args.command in ('status', 'warm') and not db_files(args.db):
+        print(f"❌ Error: File not found {args.db}{HOT_SUFFIXES[0]}")
+        sys.exit(1)
+    try:
+        if args.command == 'status':
+            print_status(*measure(args.db))
+        elif args.command == 'warm':
+            warm_enough = wait_until_warm(args.db, args.min_resident, args.timeout)
+            if args.all:
+                read, seconds = warm(args.db, cold=True)
+                print(f" [*] Warmed {read / 2**20:.0f} MiB of the cold set in {seconds:.1f}s")
+            print_status(*measure(args.db))
+            sys.exit(0 if warm_enough else 1)
+        elif args.command == 'serve':
+            serve(args.db, args.all, args.lock, args.interval, args.min_resident)
+        else:
+            rates = Rates()
+            while True:
+                time.sleep(args.interval)
+                _, ratio = measure(args.db)
+                faults, read = rates.sample()
+                print(f"{time.strftime('%H:%M:%S')} hot set {ratio:6.1%} resident | "
+                      f"{faults:8.0f} major faults/s | {read / 2**20:8.1f} MiB/s read")
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
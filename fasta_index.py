@@ -0,0 +1,149 @@
+import os
+import sys
+import json
+import mmap
+
+"""
+usage: python3 fasta_index.py INPUT.fasta [ID ...]
+
+Persisted byte-offset index for a FASTA file.
+Every record is reachable by its full header, its ID (first word of the
+header) and, for UniProt-style IDs (sp|Q9CRT8|XPOT_MOUSE), by accession and
+entry name. The index is stored next to the FASTA and rebuilt only when the
+FASTA's size or mtime changes. Records are read back through mmap, so a
+lookup touches only the bytes of the requested records.
+"""
+
+INDEX_SUFFIX = '.idx.json'
+INDEX_VERSION = 1
+
+
+def index_keys(header):
+    """
+    All lookup keys for one header line (without the leading '>').
+    """
+    record_id = header.split()[0] if header.split() else ''
+    keys = [header, record_id]
+    parts = record_id.split('|')
+    if len(parts) > 1:
+        # sp|Q9CRT8|XPOT_MOUSE -> Q9CRT8, XPOT_MOUSE
+        keys.extend(part for part in parts[1:] if part)
+    return keys
+
+def build_index(fasta_file):
+    """
+    Single binary pass over the FASTA recording (offset, length) per record.
+    """
+    records = []
+    keys = {}
+    offset = 0
+    start = None
+    with open(fasta_file, 'rb') as fh:
+        for line in fh:
+            if line.startswith(b'>'):
+                if start is not None:
+                    records.append([start, offset - start])
+                start = offset
+                header = line[1:].decode('utf-8', errors='replace').strip()
+                for key in index_keys(header):
+                    # First occurrence wins, same as a front-to-back scan
+                    keys.setdefault(key, len(records))
+            offset += len(line)
+    if start is not None:
+        records.append([start, offset - start])
+    return records, keys
+
+class FastaIndex:
+    """
+    Random-access view of a FASTA file backed by a persisted offset index.
+    """
+    def __init__(self, fasta_file, records, keys):
+        self.fasta_file = fasta_file
+        self.records = records
+        self.keys = keys
+        self._fh = open(fasta_file, 'rb')
+        self._mm = mmap.mmap(self._fh.fileno(), 0, access=mmap.ACCESS_READ) if records else None
+
+    @classmethod
+    def open(cls, fasta_file, index_file=None):
+        """
+        Load the index if it still matches the FASTA, otherwise (re)build it.
+        """
+        index_file = index_file or fasta_file + INDEX_SUFFIX
+        stat = os.stat(fasta_file)
+
+        if os.path.exists(index_file):
+            try:
+                with open(index_file) as f:
+                    data = json.load(f)
+                if (data.get('version') == INDEX_VERSION
+                        and data.get('fasta_size') == stat.st_size
+                        and data.get('fasta_mtime') == stat.st_mtime_ns):
+                    return cls(fasta_file, data['records'], data['keys'])
+            except (OSError, ValueError, KeyError):
+                pass  # Corrupt or partial index: rebuild below
+
+        print(f"Building FASTA index for {fasta_file}...")
+        records, keys = build_index(fasta_file)
+        data = {
+            'version': INDEX_VERSION,
+            'fasta_size': stat.st_size,
+            'fasta_mtime': stat.st_mtime_ns,
+            'records': records,
+            'keys': keys,
+        }
+        # Write then rename, so a crash never leaves a half-written index
+        tmp_file = index_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_file, index_file)
+        return cls(fasta_file, records, keys)
+
+    def __len__(self):
+        return len(self.records)
+
+    def find(self, key):
+        """
+        Record number for an ID, accession, entry name or header; None if absent.
+        """
+        return self.keys.get(key)
+
+    def read(self, record_no):
+        """
+        Return (record_id, sequence) for a record number.
+        record_id is the first word of the header, as Bio.SeqIO reports it.
+        """
+        start, length = self.records[record_no]
+        raw = self._mm[start:start + length].decode('utf-8', errors='replace')
+        header, _, body = raw.partition('\n')
+        words = header[1:].split()
+        record_id = words[0] if words else ''
+        sequence = ''.join(body.split())
+        return record_id, sequence
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+        self._fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print("Usage: python3 fasta_index.py <input_fasta> [ID ...]")
+        sys.exit(1)
+
+    with FastaIndex.open(sys.argv[1]) as index:
+        print(f"{len(index)} records indexed")
+        for key in sys.argv[2:]:
+            record_no = index.find(key)
+            if record_no is None:
+                print(f"{key}: not found")
+            else:
+                record_id, sequence = index.read(record_no)
+                print(f">{record_id}\n{sequence}")
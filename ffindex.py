@@ -0,0 +1,75 @@
+import os
+import sys
+
+"""
+usage: python3 ffindex.py DB_PREFIX [NAME ...]
+
+Minimal reader/writer for the ffindex format used by HH-suite databases
+and by the *_omp batch binaries (<prefix>.ffdata + <prefix>.ffindex).
+
+.ffdata is the concatenation of all entries, each terminated by a NUL byte.
+.ffindex has one line per entry, "name\\toffset\\tlength", sorted by name
+(HH-suite looks entries up by binary search); length includes the NUL.
+"""
+
+def write_db(prefix, entries):
+    """
+    Write (name, text) entries as prefix.ffdata / prefix.ffindex.
+    """
+    index = []
+    offset = 0
+    with open(prefix + '.ffdata', 'wb') as f:
+        for name, text in entries:
+            if '\t' in name or '\n' in name:
+                raise ValueError(f"Invalid ffindex entry name: {name!r}")
+            data = text.encode('utf-8') + b'\0'
+            f.write(data)
+            index.append((name, offset, len(data)))
+            offset += len(data)
+    with open(prefix + '.ffindex', 'w') as f:
+        for name, start, length in sorted(index):
+            f.write(f"{name}\t{start}\t{length}\n")
+
+def read_index(prefix):
+    """
+    {name: (offset, length)} from prefix.ffindex.
+    """
+    index = {}
+    with open(prefix + '.ffindex') as f:
+        for line in f:
+            parts = line.rstrip('\n').split('\t')
+            if len(parts) == 3:
+                index[parts[0]] = (int(parts[1]), int(parts[2]))
+    return index
+
+def read_db(prefix):
+    """
+    {name: text} for every entry of the database (trailing NUL removed).
+    Entries whose range falls outside .ffdata (truncated output) are skipped.
+    """
+    entries = {}
+    index = read_index(prefix)
+    with open(prefix + '.ffdata', 'rb') as f:
+        data = f.read()
+    for name, (offset, length) in index.items():
+        if offset + length > len(data):
+            continue
+        entries[name] = data[offset:offset + length].rstrip(b'\0').decode('utf-8', errors='replace')
+    return entries
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print("Usage: python3 ffindex.py <db_prefix> [name ...]")
+        sys.exit(1)
+
+    prefix = sys.argv[1]
+    if not os.path.exists(prefix + '.ffindex'):
+        print(f"Error: {prefix}.ffindex not found")
+        sys.exit(1)
+    if len(sys.argv) == 2:
+        for name, (offset, length) in sorted(read_index(prefix).items()):
+            print(f"{name}\t{offset}\t{length}")
+    else:
+        entries = read_db(prefix)
+        for name in sys.argv[2:]:
+            print(entries.get(name, f"{name}: not found"))
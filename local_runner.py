@@ -0,0 +1,226 @@
+import os
+import sys
+import time
+import queue
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import pipeline_script
+import results_parser
+import calibrate
+import tracing
+from fasta_index import FastaIndex
+from result_store import ResultStore
+from scheduling import CostModel, COST_MODEL_FILE, plan_shards
+from create_final_report import (load_target_ids, TargetIndex, scan_results, ingest,
+                                 ID_FILE, OUTPUT_HITS, OUTPUT_PROFILE, MISSING_FILE)
+
+"""
+usage: python3 local_runner.py [--fasta FASTA] [--ids experiment_ids.txt] [--out-dir local_results]
+                               [--jobs N] [--threads T] [--shards S] [--plan]
+
+Single-node execution of the pipeline, without RabbitMQ, Ansible or a
+cluster: for small batches and for debugging.
+
+The IDs are looked up in the FASTA offset index (as in producer.py) and
+the sequences whose {id}_parse.out already exists in the output directory
+are skipped, so an interrupted run is resumed by running it again. The
+rest are split into shards of near-equal expected cost (cost model from
+scheduling.py) and the shards are run, heaviest first, in a process pool
+of N jobs x T threads (default: the host's calibration profile). Progress
+and an ETA (from the expected cost still to run) are printed as each
+sequence finishes.
+
+The report is built the same way as create_final_report.py, from the
+.out files in the output directory, and written there as well (so the
+cluster's report files are not overwritten): final_hits_output.csv,
+final_profile_output.csv and missing_ids.txt. --plan only prints the
+shard plan.
+"""
+
+# ==========================================
+# Configuration
+# ==========================================
+FASTA_FILE = 'UP000000589_10090.fasta'
+OUT_DIR = 'local_results'
+LOCAL_DB = 'local_results.db'       # Result store of local runs (not the cluster's results.db)
+SHARDS_PER_JOB = 4                  # More shards than jobs: the pool also balances at run time
+# ==========================================
+
+_progress = None
+_jobs = 1
+
+def init_job(threads, progress, jobs):
+    global _progress, _jobs
+    pipeline_script.THREADS = threads
+    _progress = progress
+    _jobs = jobs
+
+def result_file(out_dir, protein_id):
+    return os.path.join(out_dir, f'{protein_id}_parse.out')
+
+def run_shard(shard, out_dir):
+    """
+    Pool worker: run one shard's (protein_id, sequence) pairs in order,
+    reporting (protein_id, status, seconds) for each on the progress queue.
+    """
+    for protein_id, sequence in shard:
+        final_output = result_file(out_dir, protein_id)
+        if os.path.exists(final_output):
+            _progress.put((protein_id, 'skipped', 0.0))
+            continue
+        start = time.perf_counter()
+        with tracing.task(tracing.new_trace_id(), protein_id, slots=_jobs), tracing.span('task') as span:
+            try:
+                with pipeline_script.scratch_dir(prefix="local_") as work_dir:
+                    record = pipeline_script.analyse(protein_id, sequence, work_dir)
+                    with tracing.span('write_result'):
+                        parse_file = os.path.join(work_dir, "hhr_parse.out")
+                        results_parser.write_parse_output(record, parse_file)
+                        pipeline_script.publish_file(parse_file, final_output)
+                status = 'done'
+            except Exception as e:
+                print(f" [Error] {protein_id}: {e}")
+                status = 'failed'
+            span['status'] = status
+        _progress.put((protein_id, status, time.perf_counter() - start))
+
+def find_pending(fasta_file, target_ids, out_dir):
+    """
+    (protein_id, sequence) of the targets without a result yet, and the
+    number of targets done and not found.
+    """
+    pending = []
+    done = not_found = 0
+    with FastaIndex.open(fasta_file) as index:
+        record_nos = set()
+        for target_id in target_ids:
+            record_no = index.find(target_id)
+            if record_no is None:
+                not_found += 1
+            else:
+                record_nos.add(record_no)
+        for record_no in sorted(record_nos):
+            protein_id, sequence = index.read(record_no)
+            if os.path.exists(result_file(out_dir, protein_id)):
+                done += 1
+            else:
+                pending.append((protein_id, sequence))
+    return pending, done, not_found
+
+def format_seconds(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 3600:d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+def run(pending, shards, costs, out_dir, jobs, threads):
+    """
+    Run the shards and print progress. Returns {status: count}.
+    """
+    expected = {protein_id: cost for (protein_id, _), cost in zip(pending, costs)}
+    total_cost = sum(costs)
+    finished_cost = 0.0
+    counts = {'done': 0, 'failed': 0, 'skipped': 0}
+    width = len(str(len(pending)))
+    progress = multiprocessing.Queue()
+    start = time.time()
+
+    with ProcessPoolExecutor(max_workers=jobs, initializer=init_job, initargs=(threads, progress, jobs)) as pool:
+        futures = [pool.submit(run_shard, [pending[i] for i in shard], out_dir) for shard in shards]
+        finished = 0
+        while finished < len(pending):
+            try:
+                protein_id, status, seconds = progress.get(timeout=1.0)
+            except queue.Empty:
+                if all(f.done() for f in futures):
+                    break       # A shard died without reporting (see below)
+                continue
+            finished += 1
+            counts[status] += 1
+            finished_cost += expected[protein_id]
+            elapsed = time.time() - start
+            # Cost still to run at the rate seen so far (long proteins weigh more than short ones)
+            eta = elapsed * (total_cost - finished_cost) / finished_cost if finished_cost else 0
+            print(f" [{finished:{width}d}/{len(pending)}] {100 * finished_cost / total_cost:5.1f}% "
+                  f"{protein_id} {status} ({seconds:.1f}s) | failed {counts['failed']} | "
+                  f"elapsed {format_seconds(elapsed)} | ETA {format_seconds(eta)}", flush=True)
+        for future in futures:
+            if future.exception() is not None:
+                print(f" [Error] A shard stopped early: {future.exception()}")
+    return counts
+
+def report(out_dir, db_path, target_ids):
+    """
+    Ingest the .out files and export the CSVs, as create_final_report.py does.
+    """
+    store = ResultStore(db_path)
+    changed, removed = scan_results(store, out_dir)
+    if removed:
+        store.forget_sources(removed)
+    if changed:
+        ingest(store, changed, TargetIndex(target_ids), os.cpu_count() or 1, out_dir)
+    # Next to the .out files: the cluster's report files in the CWD are left alone
+    hits_file, profile_file, missing_file = (os.path.join(out_dir, name)
+                                             for name in (OUTPUT_HITS, OUTPUT_PROFILE, MISSING_FILE))
+    print(f"💾 Wrote {hits_file} ({store.export_hits(hits_file)} records)")
+    profile = store.export_profile(profile_file)
+    if profile is not None:
+        print(f"💾 Wrote {profile_file}: Ave STD = {profile[0]:.2f}, Ave GMean = {profile[1]:.2f}")
+    else:
+        print("❌ Error: All data is NaN or missing. Cannot calculate averages!")
+    missing_ids = store.export_missing(missing_file, target_ids)
+    store.close()
+    if missing_ids:
+        print(f"⚠️ There are {len(missing_ids)} tasks incomplete or NaN (see {missing_file})")
+    else:
+        print(" Perfect! All tasks completed!")
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the pipeline on this machine, without RabbitMQ")
+    parser.add_argument('--fasta', default=FASTA_FILE, help=f"Input FASTA (default: {FASTA_FILE})")
+    parser.add_argument('--ids', default=ID_FILE, help=f"IDs to run (default: {ID_FILE})")
+    parser.add_argument('--out-dir', default=OUT_DIR, help=f"Where the .out files and the report go (default: {OUT_DIR})")
+    parser.add_argument('--db', default=LOCAL_DB, help=f"Result store for the report (default: {LOCAL_DB})")
+    parser.add_argument('--jobs', type=int, help="Parallel pipelines (default: calibration profile, else CPUs)")
+    parser.add_argument('--threads', type=int, help="Threads per pipeline (default: calibration profile, else 1)")
+    parser.add_argument('--shards', type=int, help=f"Number of shards (default: {SHARDS_PER_JOB} x jobs)")
+    parser.add_argument('--cost-model', default=COST_MODEL_FILE, help="Cost model for the shard plan")
+    parser.add_argument('--plan', action='store_true', help="Print the shard plan and exit")
+    args = parser.parse_args()
+
+    for path in (args.fasta, args.ids):
+        if not os.path.exists(path):
+            print(f"❌ Error: File not found {path}")
+            sys.exit(1)
+
+    profile = calibrate.load_profile()
+    jobs = max(1, args.jobs or (profile['jobs'] if profile else os.cpu_count() or 1))
+    threads = max(1, args.threads or (profile['threads'] if profile else 1))
+
+    target_ids = load_target_ids(args.ids)
+    os.makedirs(args.out_dir, exist_ok=True)
+    pending, done, not_found = find_pending(args.fasta, target_ids, args.out_dir)
+    print(f"📄 {len(target_ids)} IDs: {done} already done, {len(pending)} to run"
+          + (f", {not_found} not in {args.fasta}" if not_found else ""))
+
+    model = CostModel.load(args.cost_model)
+    costs = [model.cost(len(sequence)) for _, sequence in pending]
+    shards = plan_shards(costs, args.shards or SHARDS_PER_JOB * jobs)
+    # Heaviest shards first, so the pool ends on light ones
+    shards.sort(key=lambda shard: -sum(costs[i] for i in shard))
+    loads = [sum(costs[i] for i in shard) for shard in shards]
+    if pending:
+        print(f"🧩 {len(shards)} shards on {jobs} jobs x {threads} threads, expected "
+              f"{min(loads):.0f}-{max(loads):.0f}s each ({sum(costs) / jobs / 3600:.2f}h of work per job)")
+    if args.plan:
+        for n, (shard, load) in enumerate(zip(shards, loads)):
+            print(f"   shard {n:3d}: {len(shard):5d} sequences, {load:9.0f}s expected")
+        return
+
+    if pending:
+        start = time.time()
+        counts = run(pending, shards, costs, args.out_dir, jobs, threads)
+        print(f"✅ {counts['done']} done, {counts['failed']} failed in {format_seconds(time.time() - start)}")
+    report(args.out_dir, args.db, target_ids)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+import os
+import bisect
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+"""
+Minimal in-process Prometheus metrics for consumer.py (no client library).
+
+Counters, gauges and histograms live in memory and are rendered in the
+Prometheus text format, either into a node_exporter textfile (written to a
+temp file and renamed, so node_exporter never reads a half-written file)
+or served on an embedded /metrics endpoint.
+"""
+
+# ==========================================
+# Bucket presets (upper bounds)
+# ==========================================
+SECONDS_BUCKETS = (0.1, 0.5, 1, 2, 5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600)
+WAIT_BUCKETS = (1, 5, 10, 30, 60, 300, 600, 1800, 3600, 7200, 21600, 86400)
+LENGTH_BUCKETS = (50, 100, 200, 300, 500, 750, 1000, 1500, 2000, 3000, 5000, 10000)
+# ==========================================
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in pairs) + '}'
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def render(self, const=()):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.extend(self.samples(key, value, list(const)))
+        return lines
+
+    def samples(self, key, value, const):
+        return [f"{self.name}{format_labels(self.labelnames, key, const)} {format_value(value)}"]
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self.key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=SECONDS_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            counts, total = self.values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.values[key] = (counts, total + value)
+
+    def samples(self, key, value, const):
+        counts, total = value
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else format_value(float(bound))
+            lines.append(f"{self.name}_bucket{format_labels(self.labelnames, key, const + [('le', le)])} {cumulative}")
+        lines.append(f"{self.name}_sum{format_labels(self.labelnames, key, const)} {format_value(total)}")
+        lines.append(f"{self.name}_count{format_labels(self.labelnames, key, const)} {cumulative}")
+        return lines
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        # Labels added to every sample, e.g. to tell apart several processes
+        # writing the same metrics into one textfile directory
+        self.const_labels = {}
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=SECONDS_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render(sorted(self.const_labels.items())))
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self, path):
+        """
+        Atomically replace path (node_exporter textfile collector). The temp
+        file must not end in .prom, or node_exporter could pick it up.
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp = tempfile.mkstemp(prefix='.' + os.path.basename(path) + '.', dir=directory)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(self.render())
+            os.chmod(tmp, 0o644)
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def serve(self, port, host='0.0.0.0'):
+        """
+        Serve /metrics from a daemon thread; returns the server.
+        """
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
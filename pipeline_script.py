@@ -1,36 +1,142 @@
 import sys
 import os
+import time
 import traceback
-from subprocess import Popen, PIPE
-from Bio import SeqIO
+from subprocess import Popen, PIPE, TimeoutExpired
 import shutil
+import tempfile
+import contextlib
+import s4pred_server
+import result_cache
+import results_parser
+import ffindex
+import tracing
 
 """
-usage: python pipeline_script.py INPUT.fasta  
+usage: python pipeline_script.py INPUT.fasta
+
+Also importable: analyse(protein_id, sequence) runs S4Pred -> HHsearch -> parse
+in the calling process and returns the result record. Only the external
+binaries (run_model.py fallback, hhsearch) are started as processes.
+analyse_bundle(items) does the same for several sequences with one batched
+hhsearch_omp run over an ffindex query database.
 """
 
 # ==========================================
 # Path Settings
 # ==========================================
-S4PRED_SCRIPT = '/opt/tools/s4pred/run_model.py'
-HHSEARCH_BIN = '/opt/tools/hh-suite/build/bin/hhsearch'
-HHDB_PATH = '/data/pdb70/pdb70'
+# Overridable with environment variables of the same name (used by bench_pipeline.py)
+S4PRED_SCRIPT = os.environ.get('S4PRED_SCRIPT', '/opt/tools/s4pred/run_model.py')
+HHSEARCH_BIN = os.environ.get('HHSEARCH_BIN', '/opt/tools/hh-suite/build/bin/hhsearch')
+HHSEARCH_OMP_BIN = os.environ.get('HHSEARCH_OMP_BIN', '/opt/tools/hh-suite/build/bin/hhsearch_omp')
+HHDB_PATH = os.environ.get('HHDB_PATH', '/data/pdb70/pdb70')
+# The node's S4Pred server; None always runs run_model.py (calibrate.py)
+S4PRED_SOCKET = s4pred_server.SOCKET_PATH
+
+# Result cache (content-addressed by sequence + tool/database version)
+CACHE_DB = result_cache.CACHE_DB
+S4PRED_WEIGHTS = [f'/opt/tools/s4pred/weights/weights_{i}.pt' for i in range(1, 6)]
+HHDB_FILES = [HHDB_PATH + suffix for suffix in ('_hhm.ffindex', '_a3m.ffindex', '_cs219.ffindex')]
+# Options that change HHsearch results; changing them invalidates only the HHsearch entries
+HHSEARCH_PARAMS = []
+
+# HHsearch output profile (HHSEARCH_PROFILE). 'full' is hhsearch's default
+# output. 'summary' leaves out what results_parser never reads: the consensus,
+# predicted and DSSP rows of each alignment and all but one line of the hit
+# table, and writes alignments unwrapped. Which hits are reported
+# (-b/-B/-p/-E) is unchanged, so the parsed rows are the same; check with
+# bench_hhsearch_profile.py before switching.
+HHSEARCH_PROFILES = {
+    'full': [],
+    'summary': ['-nocons', '-nopred', '-nodssp', '-seq', '1', '-aliw', '1000', '-z', '1', '-Z', '1'],
+}
+HHSEARCH_PROFILE = os.environ.get('HHSEARCH_PROFILE', 'full')
+if HHSEARCH_PROFILE not in HHSEARCH_PROFILES:
+    print(f"Warning: unknown HHSEARCH_PROFILE {HHSEARCH_PROFILE!r}, using 'full'.")
+    HHSEARCH_PROFILE = 'full'
+
+# Threads per job (hhsearch -cpu, run_model.py -T). consumer.py sets this from
+# the host's calibration profile (calibrate.py) together with the number of slots.
+THREADS = 1
+
+# Per-task scratch space for intermediates (tmp.fas, tmp.horiz, tmp.a3m, tmp.hhr).
+# tmpfs by default so intermediates never touch disk; override with PIPELINE_SCRATCH.
+SCRATCH_ROOT = os.environ.get('PIPELINE_SCRATCH', '/dev/shm')
 # ==========================================
 
-def run_parser(hhr_file):
-    cmd = ['python3', './results_parser.py', hhr_file]
-    p = Popen(cmd, stdin=PIPE,stdout=PIPE, stderr=PIPE)
-    out, err = p.communicate()
-    print(out.decode("utf-8", errors='ignore'))
-    if err:
-        print(f"Parser Error: {err.decode('utf-8', errors='ignore')}")
+class TaskTimeout(Exception):
+    """
+    The task ran past its deadline; the tool that was running has been killed.
+    """
 
-def run_hhsearch(a3m_file):
-    cmd = [HHSEARCH_BIN, '-i', a3m_file, '-cpu', '1', '-d', HHDB_PATH]
+def time_left(deadline):
+    """
+    Seconds until a time.monotonic() deadline (None = no limit); raises once it has passed.
+    """
+    if deadline is None:
+        return None
+    left = deadline - time.monotonic()
+    if left <= 0:
+        raise TaskTimeout("Task timeout reached")
+    return left
+
+def wait_tool(p, deadline, tool):
+    """
+    communicate() bounded by the task deadline: a hung tool is killed.
+    """
+    try:
+        return p.communicate(timeout=None if deadline is None else max(0.0, deadline - time.monotonic()))
+    except TimeoutExpired:
+        p.kill()
+        p.communicate()
+        raise TaskTimeout(f"{tool} killed: task timeout reached")
+
+@contextlib.contextmanager
+def scratch_dir(prefix='job_'):
+    """
+    Private directory for one task, removed on success or failure.
+    Falls back to the system temp dir if SCRATCH_ROOT does not exist.
+    """
+    root = SCRATCH_ROOT if os.path.isdir(SCRATCH_ROOT) else None
+    path = tempfile.mkdtemp(prefix=prefix, dir=root)
+    try:
+        yield path
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+def publish_file(src, dest):
+    """
+    Move a finished result into place atomically: readers (and the
+    idempotency check) see either no file or the complete file.
+    Works across filesystems (tmpfs -> home) by staging next to dest.
+    """
+    dest_dir = os.path.dirname(os.path.abspath(dest))
+    fd, staging = tempfile.mkstemp(prefix='.partial_', dir=dest_dir)
+    os.close(fd)
+    try:
+        shutil.copyfile(src, staging)
+        os.chmod(staging, 0o644)
+        os.replace(staging, dest)
+    except BaseException:
+        if os.path.exists(staging):
+            os.remove(staging)
+        raise
+    os.remove(src)
+
+def hhsearch_options(profile=None):
+    """
+    HHSEARCH_PARAMS plus the output options of a profile (default HHSEARCH_PROFILE).
+    """
+    return HHSEARCH_PARAMS + HHSEARCH_PROFILES[profile or HHSEARCH_PROFILE]
+
+def run_hhsearch(a3m_file, hhr_file=None, deadline=None, profile=None):
+    hhr_file = hhr_file or os.path.splitext(a3m_file)[0] + '.hhr'
+    cmd = [HHSEARCH_BIN, '-i', a3m_file, '-o', hhr_file, '-cpu', str(THREADS), '-d', HHDB_PATH] + hhsearch_options(profile)
     p = Popen(cmd, stdin=PIPE,stdout=PIPE, stderr=PIPE)
-    out, err = p.communicate()
+    out, err = wait_tool(p, deadline, "hhsearch")
     if p.returncode != 0:
         print(f"HHSearch Failed: {err.decode('utf-8', errors='ignore')}")
+    return p.returncode == 0
 
 def read_horiz(tmp_file, horiz_file, a3m_file):
     pred = ''
@@ -47,17 +153,307 @@ def read_horiz(tmp_file, horiz_file, a3m_file):
         fh_out.write(f">ss_pred\n{pred}\n>ss_conf\n{conf}\n")
         fh_out.write(contents)
 
-def run_s4pred(input_file, out_file):
-    cmd = ['python3', S4PRED_SCRIPT, '-t', 'horiz', '-T', '1', input_file]
+def run_s4pred(input_file, out_file, deadline=None):
+    # Prefer the persistent S4Pred server (weights already loaded);
+    # fall back to a one-off run_model.py launch if it is not running or hangs.
+    left = time_left(deadline)
+    timeout = s4pred_server.REQUEST_TIMEOUT if left is None else min(left, s4pred_server.REQUEST_TIMEOUT)
+    try:
+        if S4PRED_SOCKET:
+            horiz = s4pred_server.predict_horiz(s4pred_server.read_fasta_text(input_file),
+                                                S4PRED_SOCKET, timeout=timeout)
+            with open(out_file, "w") as fh_out:
+                fh_out.write(horiz)
+            return
+    except TimeoutError:
+        if timeout == left:
+            raise TaskTimeout("S4Pred server did not answer before the task timeout")
+        print(f"Warning: S4Pred server did not answer in {timeout}s, running run_model.py")
+    except OSError:
+        pass
+
+    cmd = ['python3', S4PRED_SCRIPT, '-t', 'horiz', '-T', str(THREADS), input_file]
     p = Popen(cmd, stdin=PIPE,stdout=PIPE, stderr=PIPE)
-    out, err = p.communicate()
+    out, err = wait_tool(p, deadline, "run_model.py")
     if p.returncode == 0:
         with open(out_file, "w") as fh_out:
             fh_out.write(out.decode("utf-8", errors='ignore'))
     else:
         raise Exception(f"S4Pred failed: {err.decode('utf-8', errors='ignore')}")
 
+def tool_version(binary):
+    """
+    The version line an HH-suite binary prints with -h ('HHsearch 3.3.0'),
+    else a fingerprint of the binary itself. Builds of the same release on
+    different nodes give the same version.
+    """
+    try:
+        p = Popen([binary, '-h'], stdin=PIPE, stdout=PIPE, stderr=PIPE)
+        try:
+            out, err = p.communicate(timeout=30)
+        except TimeoutExpired:
+            p.kill()
+            out, err = p.communicate()
+        for line in (out + err).decode('utf-8', errors='ignore').splitlines():
+            if line.startswith('HHsearch'):
+                return line.strip().rstrip(':')
+    except OSError:
+        pass
+    return result_cache.content_fingerprint(binary)
+
+def tool_versions():
+    """
+    Versions of the tools/database, used in the cache keys: file contents and
+    version strings only, so every worker computes the same keys.
+    """
+    return {
+        's4pred': result_cache.content_fingerprint(S4PRED_SCRIPT, *S4PRED_WEIGHTS),
+        # The search options and output profile too: cached raw .hhr files differ between profiles
+        'hhsearch': ';'.join([tool_version(HHSEARCH_BIN), result_cache.content_fingerprint(*HHDB_FILES),
+                              ' '.join(hhsearch_options())]),
+    }
+
+_cache = None       # False once found unavailable (or disabled)
+_versions = None
+
+def versions():
+    """
+    This process's tool versions, computed once (hashing the weights takes a moment).
+    """
+    global _versions
+    if _versions is None:
+        _versions = tool_versions()
+    return _versions
+
+def open_cache():
+    """
+    One cache connection per process. The cache is an optimisation only:
+    if it cannot be opened, run uncached.
+    """
+    global _cache
+    if _cache is None:
+        try:
+            _cache = result_cache.ResultCache(CACHE_DB)
+            _cache.set_versions(versions())
+        except Exception as e:
+            print(f"Warning: result cache unavailable ({e}), running without it.")
+            _cache = False
+    return _cache or None
+
+def disable_cache():
+    """
+    Run without the result cache in this process: calibrate.py and the
+    benchmarks time the tools, which a cache hit would skip.
+    """
+    global _cache
+    if _cache:
+        _cache.close()
+    _cache = False
+
+def cache_keys(sequence):
+    """
+    (s4pred_key, hhsearch_key) for a sequence under the current tool versions.
+    """
+    current = versions()
+    return (result_cache.sequence_key(sequence, current['s4pred']),
+            result_cache.sequence_key(sequence, current['s4pred'], current['hhsearch']))
+
+def cached_record(protein_id, sequence, cache):
+    """
+    The stored result if the same sequence was already solved (under any ID)
+    with the same tools, else None.
+    """
+    fields = cache.get('parse', cache_keys(sequence)[1]) if cache else None
+    if fields is None:
+        return None
+    print(f"Cache hit: reusing result for {protein_id}")
+    return results_parser.record_from_row(f"{protein_id},{fields}")
+
+def build_a3m(protein_id, sequence, work_dir, cache, name="tmp", deadline=None):
+    """
+    S4Pred secondary structure -> <name>.a3m in work_dir (the HHsearch query).
+    """
+    tmp_file = os.path.join(work_dir, f"{name}.fas")
+    horiz_file = os.path.join(work_dir, f"{name}.horiz")
+    a3m_file = os.path.join(work_dir, f"{name}.a3m")
+    s4pred_key = cache_keys(sequence)[0]
+
+    with tracing.span('write_input'):
+        with open(tmp_file, "w") as fh_out:
+            fh_out.write(f">{protein_id}\n")
+            fh_out.write(f"{sequence}\n")
+
+    with tracing.span('s4pred') as span:
+        horiz = cache.get('s4pred', s4pred_key) if cache else None
+        span['cached'] = horiz is not None
+        if horiz is not None:
+            with open(horiz_file, "w") as fh_out:
+                fh_out.write(horiz)
+        else:
+            run_s4pred(tmp_file, horiz_file, deadline)
+            if cache:
+                with open(horiz_file) as fh_in:
+                    cache.put('s4pred', s4pred_key, fh_in.read())
+
+    with tracing.span('a3m_build'):
+        read_horiz(tmp_file, horiz_file, a3m_file)
+    return a3m_file
+
+def parse_result(hhr_file, sequence, cache, timings):
+    start = time.perf_counter()
+    with tracing.span('parse'):
+        record = results_parser.parse_hhr(hhr_file)
+    timings['parse'] = time.perf_counter() - start
+    if cache:
+        # Store without the query ID so other IDs can reuse it
+        cache.put('parse', cache_keys(sequence)[1], results_parser.format_record(record).split(',', 1)[1])
+    return record
+
+def analyse(protein_id, sequence, work_dir='.', timings=None, deadline=None):
+    """
+    Run the full pipeline for one sequence and return its result record
+    (see results_parser.parse_hhr). Intermediates go to fixed names in work_dir.
+    If a dict is passed as timings, the seconds spent in each stage
+    ('s4pred', 'hhsearch', 'parse') are stored in it. Raises on failure, and
+    TaskTimeout if the time.monotonic() deadline passes.
+    """
+    if timings is None:
+        timings = {}
+    hhr_file = os.path.join(work_dir, "tmp.hhr")
+
+    cache = open_cache()
+    record = cached_record(protein_id, sequence, cache)
+    if record is not None:
+        return record
+
+    start = time.perf_counter()
+    a3m_file = build_a3m(protein_id, sequence, work_dir, cache, deadline=deadline)
+    timings['s4pred'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    hhsearch_key = cache_keys(sequence)[1]
+    with tracing.span('hhsearch') as span:
+        hhr = cache.get('hhr', hhsearch_key) if cache else None
+        span['cached'] = hhr is not None
+        if hhr is not None:
+            with open(hhr_file, "w") as fh_out:
+                fh_out.write(hhr)
+        else:
+            # Never let a stale .hhr from a previous sequence be parsed or cached
+            if os.path.exists(hhr_file):
+                os.remove(hhr_file)
+            if not run_hhsearch(a3m_file, hhr_file, deadline):
+                raise Exception(f"HHSearch failed for {protein_id}")
+            if cache:
+                with open(hhr_file) as fh_in:
+                    cache.put('hhr', hhsearch_key, fh_in.read())
+
+    timings['hhsearch'] = time.perf_counter() - start
+    return parse_result(hhr_file, sequence, cache, timings)
+
+def run_hhsearch_omp(query_db, result_db, cpu=None, deadline=None):
+    """
+    One batched search over an ffindex query database (hhsearch_omp):
+    the binary starts and opens pdb70 once for all queries. Results are
+    written to result_db.ffdata/.ffindex under the query entry names.
+    """
+    cmd = [HHSEARCH_OMP_BIN, '-i', query_db, '-o', result_db, '-cpu', str(cpu or THREADS),
+           '-d', HHDB_PATH] + hhsearch_options()
+    p = Popen(cmd, stdin=PIPE, stdout=PIPE, stderr=PIPE)
+    out, err = wait_tool(p, deadline, "hhsearch_omp")
+    if p.returncode != 0:
+        print(f"HHSearch (batch) Failed: {err.decode('utf-8', errors='ignore')}")
+    return p.returncode == 0
+
+def analyse_bundle(items, work_dir='.', cpu=None, deadline=None, trace_ids=None):
+    """
+    Run the pipeline for several (protein_id, sequence) pairs with a single
+    HHsearch invocation. S4Pred runs per sequence; the a3m queries are packed
+    into an ffindex database, searched with hhsearch_omp and the output is
+    split back into one .hhr per protein.
+
+    Returns a list of (protein_id, record, timings, error) in input order;
+    record is None and error is set for proteins that failed, so one bad
+    sequence never fails the rest of the bundle. Proteins missing from the
+    batch output are retried with a single hhsearch run. Once the deadline
+    passes, the remaining proteins fail with TaskTimeout. trace_ids (one per
+    item) attach the stage spans to each protein's trace.
+    """
+    cache = open_cache()
+    results = {}
+    queries = []    # (entry name, protein_id, sequence, a3m_file, timings)
+    trace_ids = trace_ids or [None] * len(items)
+
+    for n, (protein_id, sequence) in enumerate(items):
+        timings = {}
+        with tracing.task(trace_ids[n], protein_id):
+            try:
+                record = cached_record(protein_id, sequence, cache)
+                if record is not None:
+                    results[n] = (protein_id, record, timings, None)
+                    continue
+                start = time.perf_counter()
+                hhr = cache.get('hhr', cache_keys(sequence)[1]) if cache else None
+                a3m_file = build_a3m(protein_id, sequence, work_dir, cache, name=f"q{n:04d}", deadline=deadline)
+                timings['s4pred'] = time.perf_counter() - start
+                if hhr is not None:
+                    hhr_file = os.path.join(work_dir, f"q{n:04d}.hhr")
+                    with open(hhr_file, "w") as fh_out:
+                        fh_out.write(hhr)
+                    timings['hhsearch'] = 0.0
+                    results[n] = (protein_id, parse_result(hhr_file, sequence, cache, timings), timings, None)
+                    continue
+                queries.append((f"q{n:04d}", n, protein_id, sequence, a3m_file, timings))
+            except Exception as e:
+                results[n] = (protein_id, None, timings, e)
+
+    if queries:
+        query_db = os.path.join(work_dir, "query_a3m")
+        result_db = os.path.join(work_dir, "result_hhr")
+        entries = []
+        for name, n, protein_id, sequence, a3m_file, timings in queries:
+            with open(a3m_file) as fh_in:
+                entries.append((name, fh_in.read()))
+        ffindex.write_db(query_db, entries)
+
+        start = time.perf_counter()
+        members = [[trace_ids[n], protein_id] for _, n, protein_id, _, _, _ in queries]
+        try:
+            with tracing.span('hhsearch_batch', members=members, queries=len(queries)):
+                hits = ffindex.read_db(result_db) if run_hhsearch_omp(query_db, result_db, cpu, deadline) else {}
+        except TaskTimeout as e:
+            for name, n, protein_id, sequence, a3m_file, timings in queries:
+                results[n] = (protein_id, None, timings, e)
+            return [results[n] for n in range(len(items))]
+        # The batch time is shared evenly by the proteins it answered
+        share = (time.perf_counter() - start) / max(1, sum(1 for q in queries if q[0] in hits))
+
+        for name, n, protein_id, sequence, a3m_file, timings in queries:
+            hhr_file = os.path.join(work_dir, f"{name}.hhr")
+            with tracing.task(trace_ids[n], protein_id):
+                try:
+                    start = time.perf_counter()
+                    if name in hits and hits[name].strip():
+                        with open(hhr_file, "w") as fh_out:
+                            fh_out.write(hits[name])
+                        timings['hhsearch'] = share
+                    else:
+                        print(f"No batch result for {protein_id}, searching it on its own")
+                        with tracing.span('hhsearch'):
+                            if not run_hhsearch(a3m_file, hhr_file, deadline):
+                                raise Exception(f"HHSearch failed for {protein_id}")
+                        timings['hhsearch'] = time.perf_counter() - start
+                    if cache:
+                        with open(hhr_file) as fh_in:
+                            cache.put('hhr', cache_keys(sequence)[1], fh_in.read())
+                    results[n] = (protein_id, parse_result(hhr_file, sequence, cache, timings), timings, None)
+                except Exception as e:
+                    results[n] = (protein_id, None, timings, e)
+
+    return [results[n] for n in range(len(items))]
+
 def read_input(file):
+    from Bio import SeqIO
     print("READING FASTA FILES")
     sequences = {}
     for record in SeqIO.parse(file, "fasta"):
@@ -70,38 +466,26 @@ if __name__ == "__main__":
         sys.exit(1)
 
     sequences = read_input(sys.argv[1])
-    tmp_file = "tmp.fas"
-    horiz_file = "tmp.horiz"
-    a3m_file = "tmp.a3m"
-    hhr_file = "tmp.hhr"
-    
+
     for k, v in sequences.items():
         # Resume capability: Check if analysis is already done
         final_output = f'{k}_parse.out'
         if os.path.exists(final_output):
             # If the file exists, skip it. Don't print a message to avoid cluttering the log.
-            continue 
+            continue
 
         print(f'Now analysing input: {k}')
-        
+
         # Safety net (Error handling)
         try:
-            with open(tmp_file, "w") as fh_out:
-                fh_out.write(f">{k}\n")
-                fh_out.write(f"{v}\n")
-            
-            run_s4pred(tmp_file, horiz_file)
-            read_horiz(tmp_file, horiz_file, a3m_file)
-            run_hhsearch(a3m_file)
-            run_parser(hhr_file)
-            
-            if os.path.exists("hhr_parse.out"):
-                shutil.move("hhr_parse.out", final_output)
-            else:
-                print(f"Warning: Analysis for {k} did not generate output.")
+            with scratch_dir() as work_dir:
+                record = analyse(k, str(v), work_dir)
+                parse_file = os.path.join(work_dir, "hhr_parse.out")
+                results_parser.write_parse_output(record, parse_file)
+                publish_file(parse_file, final_output)
 
         except Exception as e:
             print(f"CRITICAL ERROR processing sequence {k}: {e}")
             traceback.print_exc()
             print(">>> SKIPPING THIS SEQUENCE <<<")
-            continue
\ No newline at end of file
+            continue
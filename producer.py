@@ -1,82 +1,213 @@
 import pika
 import json
 import sys
-from Bio import SeqIO
+import os
+import time
+import argparse
+from fasta_index import FastaIndex
+from publisher import ConfirmedPublisher, load_ledger, DEFAULT_WINDOW, LEDGER_FILE
+from result_cache import ResultCache
+from result_store import ResultStore, RESULT_DB
+from scheduling import CostModel, COST_MODEL_FILE, longest_first, priority
+import broker_config
+import tracing
 
 # ==========================================
 # Configuration Section
 # ==========================================
-QUEUE_NAME = 'task_queue'
+QUEUE_NAME = broker_config.TASK_QUEUE
+RESULT_QUEUE = broker_config.RESULT_QUEUE   # Cached results go straight to the aggregator
 ID_FILE = 'experiment_ids.txt'
 FASTA_FILE = 'UP000000589_10090.fasta'
 # ==========================================
 
+def find_records(index, target_ids):
+    """
+    Record numbers of the targets in the FASTA index, and how many were not found.
+    """
+    record_nos = set()
+    not_found = 0
+    for target_id in target_ids:
+        record_no = index.find(target_id)
+        if record_no is None:
+            not_found += 1
+        else:
+            record_nos.add(record_no)
+    return record_nos, not_found
+
+def read_pending(index, record_nos, already_sent=(), cost_model=None):
+    """
+    (record_id, sequence) for the records still to dispatch. In FASTA order,
+    or longest-expected-first when a cost model is given.
+    """
+    # Sorted offsets keep FASTA order (and sequential reads)
+    pending = [index.read(record_no) for record_no in sorted(record_nos)]
+    pending = [(record_id, sequence) for record_id, sequence in pending if record_id not in already_sent]
+    if cost_model is not None:
+        costs = [cost_model.cost(len(sequence)) for _, sequence in pending]
+        pending = [pending[i] for i in longest_first(costs)]
+    return pending
+
+def build_tasks(index, record_nos, already_sent=(), cache=None, cached_results=None, cost_model=None):
+    """
+    Yields (record_id, json message) for every record still to dispatch, or
+    (record_id, json message, priority) when a cost model is given.
+    Sequences already solved in the cache are appended to cached_results as
+    result messages instead.
+    """
+    for record_id, sequence in read_pending(index, record_nos, already_sent, cost_model):
+        # Already solved (possibly under another ID): send the result, skip the task queue
+        if cache is not None:
+            fields = cache.lookup_solved(sequence)
+            if fields is not None:
+                result = {'id': record_id, 'status': 'cached',
+                          'row': f"{record_id},{fields}", 'worker': 'producer'}
+                cached_results.append((record_id, json.dumps(result)))
+                continue
+
+        # Prepare message content
+        message = {
+            'id': record_id,
+            'sequence': sequence,
+            'enqueued_at': time.time(),    # Consumers report the queue wait from this
+            'trace_id': tracing.new_trace_id()
+        }
+        if cost_model is None:
+            yield record_id, json.dumps(message)
+        else:
+            # Workers scale the task timeout (and the coordinator its patience) by this
+            message['expected_seconds'] = cost_model.cost(len(sequence))
+            yield record_id, json.dumps(message), priority(message['expected_seconds'])
+
+def bundle_tasks(tasks, size):
+    """
+    Packs consecutive tasks into messages of up to size sequences,
+    {'bundle': [{'id', 'sequence', 'trace_id'}, ...], 'enqueued_at'}, searched by the
+    worker with one batched HHsearch. The ledger entry is the bundle's IDs,
+    one per line, so a resumed run skips exactly the confirmed proteins.
+    With priorities, a bundle takes the highest of its members.
+    """
+    bundle = []
+
+    def pack():
+        ids = [task['id'] for task, _ in bundle]
+        message = {'bundle': [{'id': task['id'], 'sequence': task['sequence'], 'trace_id': task['trace_id']}
+                              for task, _ in bundle],
+                   'enqueued_at': time.time()}
+        priorities = [p for _, p in bundle if p is not None]
+        if priorities:
+            return '\n'.join(ids), json.dumps(message), max(priorities)
+        return '\n'.join(ids), json.dumps(message)
+
+    for record_id, body, *priority in tasks:
+        bundle.append((json.loads(body), (priority or [None])[0]))
+        if len(bundle) == size:
+            yield pack()
+            bundle = []
+    if bundle:
+        yield pack()
+
 def main():
-    # 1. Establish RabbitMQ connection (localhost)
-    try:
-        connection = pika.BlockingConnection(pika.ConnectionParameters('localhost'))
-        channel = connection.channel()
-        channel.queue_declare(queue=QUEUE_NAME, durable=True) # Durable means the queue survives reboots
-    except Exception as e:
-        print(f"Cannot connect to RabbitMQ: {e}")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description="Dispatch target sequences to RabbitMQ")
+    parser.add_argument('--window', type=int, default=DEFAULT_WINDOW,
+                        help=f"Unconfirmed messages allowed in flight (default: {DEFAULT_WINDOW})")
+    parser.add_argument('--ledger', default=LEDGER_FILE,
+                        help=f"Checkpoint file of broker-confirmed IDs (default: {LEDGER_FILE})")
+    parser.add_argument('--fresh', action='store_true',
+                        help="Ignore and reset the ledger, dispatching every target again")
+    parser.add_argument('--reuse', nargs='?', const=RESULT_DB, metavar='RESULT_DB',
+                        help=f"Skip sequences any worker already solved, from the host result store "
+                             f"(default: {RESULT_DB})")
+    parser.add_argument('--cache', metavar='CACHE_DB',
+                        help="Result cache file to consult instead (e.g. copied from a worker)")
+    parser.add_argument('--ids', default=ID_FILE, help=f"Target ID list (default: {ID_FILE})")
+    parser.add_argument('--fasta', default=FASTA_FILE, help=f"FASTA dataset (default: {FASTA_FILE})")
+    parser.add_argument('--cost-model', default=COST_MODEL_FILE,
+                        help=f"Fitted cost model (default: {COST_MODEL_FILE}, built-in model if absent)")
+    parser.add_argument('--bundle', type=int, default=1, metavar='K',
+                        help="Sequences per message, searched with one batched HHsearch (default: 1)")
+    parser.add_argument('--fifo', action='store_true',
+                        help="Dispatch in FASTA order without priorities (old behaviour)")
+    args = parser.parse_args()
 
-    # 2. Read ID list to process
-    print(f"Reading {ID_FILE}...")
+    # 1. Read ID list to process
+    print(f"Reading {args.ids}...")
     target_ids = set()
     try:
-        with open(ID_FILE, 'r') as f:
+        with open(args.ids, 'r') as f:
             for line in f:
                 # Remove whitespace or newlines
                 clean_id = line.strip()
                 if clean_id:
                     target_ids.add(clean_id)
     except FileNotFoundError:
-        print(f"Error: {ID_FILE} not found")
+        print(f"Error: {args.ids} not found")
         sys.exit(1)
-    
+
     print(f"Total target IDs: {len(target_ids)}")
 
-    # 3. Scan FASTA file and send tasks
-    print(f"Scanning {FASTA_FILE} and sending tasks...")
-    count = 0
-    
-    # Read using Biopython
-    for record in SeqIO.parse(FASTA_FILE, "fasta"):
-        # Handle ID format 
-        match = False
-        if record.id in target_ids:
-            match = True
+    # 2. Load the checkpoint ledger: IDs the broker already confirmed last time
+    if args.fresh and os.path.exists(args.ledger):
+        os.remove(args.ledger)
+    already_sent = load_ledger(args.ledger)
+    if already_sent:
+        print(f"Resuming: {len(already_sent)} tasks already confirmed in {args.ledger}")
+
+    # 3. Look up the targets in the FASTA index and send tasks
+    # The index (built once, reused while the FASTA is unchanged) maps IDs,
+    # accessions and entry names to byte offsets, so only matching records are read.
+    print(f"Looking up targets in {args.fasta} and sending tasks...")
+
+    cache = None
+    if args.reuse:
+        if os.path.exists(args.reuse):
+            cache = ResultStore(args.reuse)
         else:
-            # Try splitting by pipe '|'
-            parts = record.id.split('|')
-            for part in parts:
-                if part in target_ids:
-                    match = True
-                    break
-        
-        if match:
-            # Prepare message content
-            message = {
-                'id': record.id,
-                'sequence': str(record.seq)
-            }
-            
-            # Send message
-            channel.basic_publish(
-                exchange='',
-                routing_key=QUEUE_NAME,
-                body=json.dumps(message),
-                properties=pika.BasicProperties(
-                    delivery_mode=2,  # Make message persistent
-                ))
-            count += 1
-            
-            if count % 100 == 0:
-                print(f"Sent {count} tasks...")
-
-    print(f"✅ Done! Total {count} tasks sent to Queue.")
-    connection.close()
+            print(f"Warning: {args.reuse} not found, nothing to reuse")
+    elif args.cache:
+        cache = ResultCache(args.cache)
+    cached_results = []
+
+    # Longest-expected-first: long proteins start early instead of finishing last
+    cost_model = None if args.fifo else CostModel.load(args.cost_model)
+    if cost_model is not None:
+        print(f"Dispatching longest-expected-first ({cost_model})")
+
+    with FastaIndex.open(args.fasta) as index:
+        record_nos, not_found = find_records(index, target_ids)
+        if not_found:
+            print(f"Warning: {not_found} target IDs not present in {args.fasta}")
+
+        tasks = build_tasks(index, record_nos, already_sent, cache, cached_results, cost_model)
+        if args.bundle > 1:
+            # Longest-first order puts proteins of similar cost in the same bundle
+            tasks = bundle_tasks(tasks, args.bundle)
+
+        # Confirmed, pipelined publishing to RabbitMQ (localhost)
+        publisher = ConfirmedPublisher(
+            pika.ConnectionParameters('localhost'), QUEUE_NAME, tasks,
+            window=args.window, ledger_file=args.ledger,
+            queue_arguments=broker_config.TASK_QUEUE_ARGUMENTS)
+        try:
+            stats = publisher.run()
+            cached = None
+            if cached_results:
+                cached = ConfirmedPublisher(
+                    pika.ConnectionParameters('localhost'), RESULT_QUEUE, cached_results,
+                    window=args.window, ledger_file=args.ledger).run()
+        except Exception as e:
+            print(f"Cannot connect to RabbitMQ: {e}")
+            print(f"Confirmed so far are recorded in {args.ledger}; rerun to send the rest.")
+            sys.exit(1)
+
+    unit = f"bundles of up to {args.bundle}" if args.bundle > 1 else "tasks"
+    print(f"✅ Done! Total {stats['confirmed']} {unit} confirmed by Queue "
+          f"in {stats['seconds']:.1f}s ({stats['rate']:.0f} msg/s, window={args.window}).")
+    if cached is not None:
+        print(f"♻️  {cached['confirmed']} tasks answered from earlier results into {RESULT_QUEUE}")
+    failed = len(stats['failed']) + (len(cached['failed']) if cached else 0)
+    if failed:
+        print(f"⚠️ {failed} tasks were rejected by the broker; rerun to retry them.")
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
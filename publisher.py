@@ -0,0 +1,199 @@
+import os
+import time
+import pika
+
+"""
+Pipelined, confirmed publishing for producer.py.
+
+Messages are published on an asynchronous (SelectConnection) channel in
+confirm mode. Up to `window` messages may be unconfirmed at once, so dispatch
+is no longer capped by one broker round trip per message. Every ID the broker
+confirms is appended to a ledger file; on restart those IDs are skipped and
+only the missing tasks are sent.
+"""
+
+# ==========================================
+# Configuration
+# ==========================================
+DEFAULT_WINDOW = 256            # Max unconfirmed messages in flight
+LEDGER_FILE = 'dispatched_ids.txt'
+MAX_ATTEMPTS = 3                # Publish attempts per message if the broker nacks
+# ==========================================
+
+
+def load_ledger(ledger_file=LEDGER_FILE):
+    """
+    IDs already confirmed by the broker in a previous run.
+    """
+    if not os.path.exists(ledger_file):
+        return set()
+    with open(ledger_file) as f:
+        return set(line.strip() for line in f if line.strip())
+
+class ConfirmedPublisher:
+    """
+    Publishes (task_id, body) or (task_id, body, priority) tuples with a
+    bounded window of publisher confirms.
+    """
+    def __init__(self, parameters, queue_name, messages, window=DEFAULT_WINDOW,
+                 ledger_file=LEDGER_FILE, properties=None, queue_arguments=None):
+        self.parameters = parameters
+        self.queue_name = queue_name
+        self.queue_arguments = queue_arguments
+        self.messages = iter(messages)
+        self.window = max(1, window)
+        self.ledger_file = ledger_file
+        self.properties = properties or pika.BasicProperties(delivery_mode=2)  # Make message persistent
+
+        self.connection = None
+        self.channel = None
+        self.ledger = None
+        self.inflight = {}      # delivery_tag -> (task_id, body, priority, attempt)
+        self.retry = []
+        self.next_tag = 0
+        self.exhausted = False
+        self.closing = False
+        self.error = None
+
+        self.published = 0
+        self.confirmed = 0
+        self.nacked = 0
+        self.failed = []
+        self.started = None
+        self.elapsed = 0.0
+
+    # ---------- Public API ----------
+    def run(self):
+        """
+        Publish everything, block until all confirms are in, return stats dict.
+        Raises the connection error if the broker could not be reached.
+        """
+        self.ledger = open(self.ledger_file, 'a')
+        try:
+            self.connection = pika.SelectConnection(
+                self.parameters,
+                on_open_callback=self.on_connection_open,
+                on_open_error_callback=self.on_connection_open_error,
+                on_close_callback=self.on_connection_closed)
+            self.connection.ioloop.start()
+        finally:
+            self.ledger.close()
+
+        if self.error is not None:
+            raise self.error
+        return self.stats()
+
+    def stats(self):
+        rate = self.confirmed / self.elapsed if self.elapsed > 0 else 0.0
+        return {
+            'published': self.published,
+            'confirmed': self.confirmed,
+            'nacked': self.nacked,
+            'failed': list(self.failed),
+            'seconds': self.elapsed,
+            'rate': rate,
+        }
+
+    # ---------- Connection / channel setup ----------
+    def on_connection_open(self, connection):
+        connection.channel(on_open_callback=self.on_channel_open)
+
+    def on_connection_open_error(self, connection, error):
+        self.error = error if isinstance(error, Exception) else Exception(str(error))
+        connection.ioloop.stop()
+
+    def on_connection_closed(self, connection, reason):
+        if not self.closing and self.error is None:
+            self.error = reason if isinstance(reason, Exception) else Exception(str(reason))
+        connection.ioloop.stop()
+
+    def on_channel_open(self, channel):
+        self.channel = channel
+        channel.add_on_close_callback(self.on_channel_closed)
+        # Durable means the queue survives reboots
+        channel.queue_declare(queue=self.queue_name, durable=True, arguments=self.queue_arguments,
+                              callback=self.on_queue_declared)
+
+    def on_channel_closed(self, channel, reason):
+        if not self.closing:
+            self.error = reason if isinstance(reason, Exception) else Exception(str(reason))
+            self.closing = True
+            self.connection.close()
+
+    def on_queue_declared(self, frame):
+        self.channel.confirm_delivery(self.on_delivery_confirmation, callback=self.on_confirm_mode)
+
+    def on_confirm_mode(self, frame):
+        self.started = time.time()
+        self.publish_more()
+
+    # ---------- Publishing ----------
+    def next_message(self):
+        if self.retry:
+            return self.retry.pop()
+        if self.exhausted:
+            return None
+        try:
+            task_id, body, *priority = next(self.messages)
+            return task_id, body, (priority or [None])[0], 1
+        except StopIteration:
+            self.exhausted = True
+            return None
+
+    def publish_more(self):
+        """
+        Top the window back up; close once everything is confirmed.
+        """
+        while len(self.inflight) < self.window:
+            item = self.next_message()
+            if item is None:
+                break
+            task_id, body, priority, attempt = item
+            properties = self.properties
+            if priority is not None:
+                properties = pika.BasicProperties(delivery_mode=properties.delivery_mode, priority=priority)
+            self.channel.basic_publish(
+                exchange='',
+                routing_key=self.queue_name,
+                body=body,
+                properties=properties)
+            self.next_tag += 1
+            self.inflight[self.next_tag] = item
+            self.published += 1
+
+        if self.exhausted and not self.retry and not self.inflight:
+            self.finish()
+
+    def on_delivery_confirmation(self, frame):
+        method = frame.method
+        acked = isinstance(method, pika.spec.Basic.Ack)
+
+        # multiple=True confirms every outstanding tag up to and including this one
+        if method.multiple:
+            tags = [tag for tag in self.inflight if tag <= method.delivery_tag]
+        else:
+            tags = [method.delivery_tag] if method.delivery_tag in self.inflight else []
+
+        for tag in tags:
+            task_id, body, priority, attempt = self.inflight.pop(tag)
+            if acked:
+                self.ledger.write(task_id + '\n')
+                self.confirmed += 1
+                if self.confirmed % 100 == 0:
+                    print(f"Confirmed {self.confirmed} tasks...")
+            else:
+                self.nacked += 1
+                if attempt < MAX_ATTEMPTS:
+                    self.retry.append((task_id, body, priority, attempt + 1))
+                else:
+                    self.failed.append(task_id)
+        self.ledger.flush()
+
+        self.publish_more()
+
+    def finish(self):
+        if self.closing:
+            return
+        self.closing = True
+        self.elapsed = time.time() - (self.started or time.time())
+        self.connection.close()
@@ -0,0 +1,158 @@
+import os
+import sys
+import json
+import time
+import argparse
+import collections
+import pika
+import broker_config
+import tracing
+from fasta_index import FastaIndex
+from producer import find_records, build_tasks, FASTA_FILE
+from publisher import ConfirmedPublisher, DEFAULT_WINDOW
+from scheduling import CostModel, COST_MODEL_FILE, priority
+from create_final_report import load_target_ids, MISSING_FILE
+
+"""
+usage: python3 replay.py dead [--list] [--limit N]
+       python3 replay.py missing [--file missing_ids.txt] [--fasta FASTA]
+
+Targeted recovery on the host, instead of rerunning the whole producer.
+
+dead     re-enqueues the tasks in the dead-letter queue (task_queue.dead):
+         those that failed MAX_ATTEMPTS times. The messages carry their
+         sequences, so no FASTA is read. They are removed from the
+         dead-letter queue only after task_queue has confirmed them.
+         --list prints the dead-lettered IDs by error class and leaves them.
+missing  re-enqueues the IDs in missing_ids.txt, looked up in the persisted
+         FASTA offset index (no rescan of the FASTA).
+
+Replayed tasks start again at attempt 1, in longest-expected-first order
+with priorities, like producer.py. Confirmed IDs are appended to
+replayed_ids.txt.
+"""
+
+# ==========================================
+# Configuration
+# ==========================================
+REPLAY_LEDGER = 'replayed_ids.txt'
+# ==========================================
+
+def publish_tasks(tasks, window):
+    publisher = ConfirmedPublisher(
+        pika.ConnectionParameters('localhost'), broker_config.TASK_QUEUE, tasks,
+        window=window, ledger_file=REPLAY_LEDGER,
+        queue_arguments=broker_config.TASK_QUEUE_ARGUMENTS)
+    return publisher.run()
+
+def fetch_dead(channel, limit=None):
+    """
+    [(delivery_tag, message)] from the dead-letter queue, unacked.
+    """
+    fetched = []
+    while limit is None or len(fetched) < limit:
+        method, properties, body = channel.basic_get(broker_config.DEAD_LETTER_QUEUE, auto_ack=False)
+        if method is None:
+            break
+        try:
+            fetched.append((method.delivery_tag, json.loads(body)))
+        except ValueError:
+            print(f" [!] Dropping malformed dead letter: {body[:80]!r}")
+            channel.basic_ack(delivery_tag=method.delivery_tag)
+    return fetched
+
+def list_dead(dead):
+    by_error = collections.defaultdict(list)
+    for _, message in dead:
+        error = message.get('error') or {}
+        by_error[error.get('class', 'Unknown')].append(message)
+    for error_class, messages in sorted(by_error.items(), key=lambda kv: -len(kv[1])):
+        print(f"{error_class}: {len(messages)}")
+        for message in messages[:10]:
+            print(f"   {message['id']} (attempt {message.get('attempt')}, {message.get('worker')}): "
+                  f"{(message.get('error') or {}).get('message', '')[:100]}")
+        if len(messages) > 10:
+            print(f"   ... {len(messages) - 10} more")
+
+def replay_dead(args):
+    connection = pika.BlockingConnection(pika.ConnectionParameters('localhost'))
+    channel = connection.channel()
+    broker_config.declare_dead_letter_queue(channel)
+    dead = fetch_dead(channel, args.limit)
+    print(f"📬 {len(dead)} tasks in {broker_config.DEAD_LETTER_QUEUE}")
+    if not dead or args.list:
+        if args.list:
+            list_dead(dead)
+        connection.close()      # Unacked messages go back to the dead-letter queue
+        return
+
+    model = CostModel.load(args.cost_model)
+    dead.sort(key=lambda item: -len(item[1]['sequence']))
+    tasks = []
+    for _, message in dead:
+        task = {'id': message['id'], 'sequence': message['sequence'], 'enqueued_at': time.time(),
+                'trace_id': message.get('trace_id') or tracing.new_trace_id()}
+        tasks.append((message['id'], json.dumps(task), priority(model.cost(len(message['sequence'])))))
+
+    try:
+        stats = publish_tasks(tasks, args.window)
+    except Exception as e:
+        print(f"Cannot publish to RabbitMQ: {e}")
+        connection.close()
+        sys.exit(1)
+
+    # Remove from the dead-letter queue only what task_queue has confirmed
+    failed = set(stats['failed'])
+    for tag, message in dead:
+        if message['id'] in failed:
+            channel.basic_nack(delivery_tag=tag, requeue=True)
+        else:
+            channel.basic_ack(delivery_tag=tag)
+    connection.close()
+    report(stats)
+
+def replay_missing(args):
+    if not os.path.exists(args.file):
+        print(f"❌ Error: File not found {args.file}")
+        sys.exit(1)
+    target_ids = load_target_ids(args.file)
+    print(f"📄 {len(target_ids)} IDs in {args.file}")
+    with FastaIndex.open(args.fasta) as index:
+        record_nos, not_found = find_records(index, target_ids)
+        if not_found:
+            print(f"Warning: {not_found} IDs not present in {args.fasta}")
+        tasks = build_tasks(index, record_nos, cost_model=CostModel.load(args.cost_model))
+        try:
+            stats = publish_tasks(tasks, args.window)
+        except Exception as e:
+            print(f"Cannot publish to RabbitMQ: {e}")
+            sys.exit(1)
+    report(stats)
+
+def report(stats):
+    print(f"✅ Replayed {stats['confirmed']} tasks into {broker_config.TASK_QUEUE} "
+          f"in {stats['seconds']:.1f}s ({stats['rate']:.0f} msg/s).")
+    if stats['failed']:
+        print(f"⚠️ {len(stats['failed'])} tasks were rejected by the broker; rerun to retry them.")
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-enqueue dead-lettered or missing tasks")
+    parser.add_argument('--window', type=int, default=DEFAULT_WINDOW,
+                        help=f"Unconfirmed messages allowed in flight (default: {DEFAULT_WINDOW})")
+    parser.add_argument('--cost-model', default=COST_MODEL_FILE, help="Cost model for the priorities")
+    sub = parser.add_subparsers(dest='command', required=True)
+    dead = sub.add_parser('dead', help=f"Replay {broker_config.DEAD_LETTER_QUEUE}")
+    dead.add_argument('--list', action='store_true', help="Only show what is dead-lettered")
+    dead.add_argument('--limit', type=int, help="Replay at most N tasks")
+    missing = sub.add_parser('missing', help=f"Replay the IDs in {MISSING_FILE}")
+    missing.add_argument('--file', default=MISSING_FILE)
+    missing.add_argument('--fasta', default=FASTA_FILE)
+    args = parser.parse_args()
+
+    if args.command == 'dead':
+        replay_dead(args)
+    else:
+        replay_missing(args)
+
+if __name__ == '__main__':
+    main()
@@ -6,12 +6,20 @@ echo "🛑 1. Killing all old consumer processes (Precision Kill)..."
 ansible -i inventory.ini workers -m shell -a "ps -ef | grep consumer.py | grep -v grep | grep -v ansible | awk '{print \$2}' | xargs -r kill -9"
 
 echo "🧹 2. Purging RabbitMQ Queue..."
-# Clear all pending tasks in RabbitMQ
-sudo rabbitmqctl purge_queue task_queue
+# Clear all pending tasks in RabbitMQ. task_queue is deleted rather than purged,
+# so it is re-declared with the current arguments (x-max-priority) by the next client
+sudo rabbitmqctl delete_queue task_queue
+sudo rabbitmqctl purge_queue result_queue
+sudo rabbitmqctl purge_queue task_queue.dead 2>/dev/null
+for q in task_queue.retry.1 task_queue.retry.2; do sudo rabbitmqctl purge_queue $q 2>/dev/null; done
+# The producer's checkpoint ledger describes the queue we just purged
+rm -f dispatched_ids.txt replayed_ids.txt
+# Start the host aggregator from an empty result store as well
+rm -f results.db results.db-wal results.db-shm
 
 echo "🗑️  3. Deleting old data & metrics..."
-# Remove old result files (.out) and Prometheus metric files (.prom)
-ansible -i inventory.ini workers -m shell -a "rm -f /home/almalinux/*.out /home/almalinux/node_exporter_metrics/*.prom"
+# Remove the result log (and old .out files) and Prometheus metric files (.prom)
+ansible -i inventory.ini workers -m shell -a "rm -rf /home/almalinux/result_log && rm -f /home/almalinux/*.out /home/almalinux/node_exporter_metrics/*.prom"
 
 echo "⏳ 4. Waiting 2 seconds for cleanup to settle..."
 sleep 2
@@ -23,8 +31,8 @@ ansible -i inventory.ini workers -m shell -a "nohup python3 -u /home/almalinux/c
 echo "---------------------------------------------------"
 echo "🔍 VERIFICATION (Target: 0 or 'No such file'):"
 # Double check if files are truly gone
-ansible -i inventory.ini workers -m shell -a "ls /home/almalinux/*.out 2>/dev/null | wc -l"
+ansible -i inventory.ini workers -m shell -a "ls /home/almalinux/*.out /home/almalinux/result_log 2>/dev/null | wc -l"
 echo "---------------------------------------------------"
 
 echo "✅ System Reset Complete! Workers are ready."
-echo "👉 Action: Switch to Grafana, then run 'python3 producer.py'"
\ No newline at end of file
+echo "👉 Action: Switch to Grafana, then run 'python3 result_aggregator.py' and 'python3 producer.py'"
\ No newline at end of file
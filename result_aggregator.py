@@ -0,0 +1,118 @@
+import os
+import sys
+import json
+import time
+import argparse
+import pika
+import broker_config
+from create_final_report import (get_clean_id, load_target_ids, resolve_target_id, TargetIndex,
+                                 ID_FILE, OUTPUT_HITS, OUTPUT_PROFILE, MISSING_FILE)
+from result_store import ResultStore, record_from_message
+
+"""
+usage: python3 result_aggregator.py [--batch N] [--flush-seconds S] [--export-seconds S] [--exit-when-idle S]
+
+Runs on the host and consumes the result_queue that the workers publish to,
+so results no longer have to be tarred up and fetched with Ansible.
+
+Messages are bulk-inserted into the result store (results.db) and acked in
+one batch only after the transaction has committed; a crash simply leads to
+redelivery, and re-inserting a result for the same ID is idempotent.
+final_hits_output.csv, final_profile_output.csv and missing_ids.txt are
+re-exported from the store's views every few seconds and on exit.
+"""
+
+# ==========================================
+# Configuration
+# ==========================================
+BATCH_SIZE = 200            # Commit + ack after this many messages...
+FLUSH_SECONDS = 2.0         # ...or this long after the first uncommitted one
+EXPORT_SECONDS = 30.0       # Minimum interval between CSV exports
+# ==========================================
+
+def export_report(store, target_ids):
+    n_hits = store.export_hits(OUTPUT_HITS)
+    store.export_profile(OUTPUT_PROFILE)
+    missing = store.export_missing(MISSING_FILE, target_ids)
+    print(f" [*] Exported {n_hits} hits, {len(missing)} targets missing")
+
+def main():
+    parser = argparse.ArgumentParser(description="Aggregate streamed worker results on the host")
+    parser.add_argument('--batch', type=int, default=BATCH_SIZE, help="Messages per commit/ack batch")
+    parser.add_argument('--flush-seconds', type=float, default=FLUSH_SECONDS,
+                        help="Max time a received message waits for its commit")
+    parser.add_argument('--export-seconds', type=float, default=EXPORT_SECONDS,
+                        help="Min time between CSV exports")
+    parser.add_argument('--exit-when-idle', type=float, metavar='SECONDS',
+                        help="Stop after this long without messages (default: run forever)")
+    args = parser.parse_args()
+
+    if not os.path.exists(ID_FILE):
+        print(f"❌ Error: File not found {ID_FILE}")
+        sys.exit(1)
+
+    target_ids = load_target_ids()
+    target_index = TargetIndex(target_ids)
+    store = ResultStore()
+    print(f"🚀 Aggregating results from {broker_config.RESULT_QUEUE} into {store.db_path} "
+          f"({sum(store.counts().values())} results so far)")
+
+    connection = pika.BlockingConnection(pika.ConnectionParameters('localhost'))
+    channel = connection.channel()
+    broker_config.declare_result_queue(channel)
+    channel.basic_qos(prefetch_count=args.batch)
+
+    last_tag = None
+    pending = []
+    first_pending = None
+    dirty = False
+    last_export = 0.0
+    idle_since = time.time()
+
+    def commit():
+        nonlocal pending, first_pending, dirty
+        store.add_results(pending)
+        channel.basic_ack(delivery_tag=last_tag, multiple=True)
+        dirty = dirty or bool(pending)
+        pending, first_pending = [], None
+
+    try:
+        for method, properties, body in channel.consume(broker_config.RESULT_QUEUE,
+                                                        inactivity_timeout=min(1.0, args.flush_seconds)):
+            now = time.time()
+            if method is not None:
+                idle_since = now
+                last_tag = method.delivery_tag
+                first_pending = first_pending or now
+                try:
+                    record = record_from_message(json.loads(body))
+                    record['target_id'] = resolve_target_id(record['query_id'], target_index)
+                    pending.append(record)
+                    print(f" [x] {get_clean_id(record['query_id'])} ({record.get('status') or 'ok'})")
+                except (ValueError, KeyError) as e:
+                    # Still acked with the batch: a malformed message would never succeed
+                    print(f" [!] Dropping malformed message ({e}): {body[:80]!r}")
+
+            if first_pending and (len(pending) >= args.batch or now - first_pending >= args.flush_seconds):
+                commit()
+
+            if dirty and now - last_export >= args.export_seconds:
+                export_report(store, target_ids)
+                dirty, last_export = False, now
+
+            if args.exit_when_idle and not first_pending and now - idle_since >= args.exit_when_idle:
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if first_pending and channel.is_open:
+            commit()
+        if connection.is_open:
+            connection.close()
+        if dirty:
+            export_report(store, target_ids)
+        print(f"✅ Results by status: {store.counts()}")
+        store.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,201 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import sqlite3
+
+"""
+usage: python3 result_cache.py [CACHE_DB]        (prints cache statistics)
+
+Content-addressed cache of per-stage pipeline results.
+
+Entries are keyed by a hash of the sequence plus the versions of the tools and
+database that produced them, so identical sequences under different IDs (or a
+re-run on a fresh worker) are served from the cache. Versions come from file
+contents and tool version strings, never mtimes, so every node with the same
+installation computes the same keys. Each stage is stored separately:
+    s4pred  - horiz text            key: sequence + S4Pred version
+    hhr     - raw .hhr text         key: sequence + S4Pred + HHsearch/db version
+    parse   - parsed result fields  key: same as hhr
+so a change in search parameters only invalidates the HHsearch stages.
+The cache is a single SQLite file bounded by size with LRU eviction.
+"""
+
+# ==========================================
+# Configuration
+# ==========================================
+CACHE_DB = os.environ.get('RESULT_CACHE_DB', '/home/almalinux/result_cache/cache.db')
+MAX_CACHE_BYTES = 2 * 1024 ** 3     # 2 GB
+# ==========================================
+
+
+def sequence_key(sequence, *versions):
+    """
+    Hash of the (normalised) sequence together with the tool versions.
+    """
+    h = hashlib.sha256(sequence.strip().upper().encode('utf-8'))
+    for version in versions:
+        h.update(b'\0' + str(version).encode('utf-8'))
+    return h.hexdigest()
+
+def content_fingerprint(*paths):
+    """
+    Version string for tools/databases: a hash of the name and content of
+    each file, the same on every node that installed the same files.
+    Missing files contribute 'missing', so the fingerprint still changes when
+    they appear.
+    """
+    h = hashlib.sha256()
+    for path in paths:
+        h.update(os.path.basename(path).encode('utf-8') + b'\0')
+        try:
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    h.update(chunk)
+        except OSError:
+            h.update(b'missing')
+        h.update(b'\0')
+    return h.hexdigest()[:16]
+
+class ResultCache:
+    """
+    Size-bounded LRU key/value store shared by all pipeline processes on a node.
+    """
+    def __init__(self, db_path=CACHE_DB, max_bytes=MAX_CACHE_BYTES):
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        # Several consumer slots share the file: WAL + busy timeout
+        self.conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                stage     TEXT NOT NULL,
+                key       TEXT NOT NULL,
+                value     BLOB NOT NULL,
+                size      INTEGER NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (stage, key))""")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS entries_lru ON entries (last_used)")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS meta (
+                name  TEXT PRIMARY KEY,
+                value TEXT NOT NULL)""")
+        # Running size of all entries, kept in step by put() and evict();
+        # summed once for a cache created before it existed
+        self.conn.execute("BEGIN IMMEDIATE")
+        if self.conn.execute("SELECT 1 FROM meta WHERE name = 'bytes'").fetchone() is None:
+            self.conn.execute("INSERT INTO meta (name, value) "
+                              "SELECT 'bytes', COALESCE(SUM(size), 0) FROM entries")
+        self.conn.execute("COMMIT")
+
+    def get(self, stage, key):
+        """
+        Cached text for (stage, key), or None. A hit refreshes its LRU position.
+        """
+        row = self.conn.execute(
+            "SELECT value FROM entries WHERE stage = ? AND key = ?", (stage, key)).fetchone()
+        if row is None:
+            return None
+        self.conn.execute(
+            "UPDATE entries SET last_used = ? WHERE stage = ? AND key = ?", (time.time(), stage, key))
+        return row[0].decode('utf-8') if isinstance(row[0], bytes) else row[0]
+
+    def has(self, stage, key):
+        return self.conn.execute(
+            "SELECT 1 FROM entries WHERE stage = ? AND key = ?", (stage, key)).fetchone() is not None
+
+    def put(self, stage, key, value):
+        data = value.encode('utf-8')
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            old = self.conn.execute(
+                "SELECT size FROM entries WHERE stage = ? AND key = ?", (stage, key)).fetchone()
+            self.conn.execute(
+                "INSERT OR REPLACE INTO entries (stage, key, value, size, last_used) VALUES (?, ?, ?, ?, ?)",
+                (stage, key, data, len(data), time.time()))
+            total = self.add_bytes(len(data) - (old[0] if old else 0))
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        if total > self.max_bytes:
+            self.evict()
+
+    def add_bytes(self, delta):
+        """
+        Adjust the running size (inside the caller's transaction); returns the new total.
+        """
+        self.conn.execute(
+            "UPDATE meta SET value = CAST(value AS INTEGER) + ? WHERE name = 'bytes'", (delta,))
+        return self.total_bytes()
+
+    def total_bytes(self):
+        row = self.conn.execute("SELECT value FROM meta WHERE name = 'bytes'").fetchone()
+        return int(row[0]) if row else 0
+
+    def evict(self, chunk=256):
+        """
+        Drop least recently used entries until the cache fits in max_bytes.
+        """
+        removed = 0
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Another process may have evicted in the meantime
+            excess = self.total_bytes() - self.max_bytes
+            while excess > 0:
+                victims = self.conn.execute(
+                    "SELECT stage, key, size FROM entries ORDER BY last_used ASC LIMIT ?", (chunk,)).fetchall()
+                if not victims:
+                    break
+                for stage, key, size in victims:
+                    if excess <= 0:
+                        break
+                    self.conn.execute("DELETE FROM entries WHERE stage = ? AND key = ?", (stage, key))
+                    self.add_bytes(-size)
+                    excess -= size
+                    removed += 1
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        return removed
+
+    # ---------- Tool versions (lets the host compute the same keys) ----------
+    def set_versions(self, versions):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO meta (name, value) VALUES ('versions', ?)", (json.dumps(versions),))
+
+    def get_versions(self):
+        row = self.conn.execute("SELECT value FROM meta WHERE name = 'versions'").fetchone()
+        return json.loads(row[0]) if row else None
+
+    def lookup_solved(self, sequence):
+        """
+        Cached parse fields (everything after query_id) for this sequence under
+        the tool versions the workers last recorded, or None.
+        Used by producer.py to skip already-solved sequences.
+        """
+        versions = self.get_versions()
+        if not versions:
+            return None
+        key = sequence_key(sequence, versions['s4pred'], versions['hhsearch'])
+        return self.get('parse', key)
+
+    def stats(self):
+        rows = self.conn.execute(
+            "SELECT stage, COUNT(*), COALESCE(SUM(size), 0) FROM entries GROUP BY stage").fetchall()
+        return {stage: {'entries': n, 'bytes': size} for stage, n, size in rows}
+
+    def close(self):
+        self.conn.close()
+
+
+if __name__ == '__main__':
+    cache = ResultCache(sys.argv[1] if len(sys.argv) > 1 else CACHE_DB)
+    print(f"Cache: {cache.db_path} ({cache.total_bytes() / 1024 ** 2:.1f} MB of {cache.max_bytes / 1024 ** 2:.0f} MB)")
+    for stage, info in sorted(cache.stats().items()):
+        print(f"  {stage:8s} {info['entries']:8d} entries {info['bytes'] / 1024 ** 2:10.1f} MB")
+    print(f"Versions: {cache.get_versions()}")
+    cache.close()
@@ -0,0 +1,351 @@
+import os
+import sys
+import json
+import time
+import zlib
+import glob
+import socket
+import argparse
+import results_parser
+
+"""
+usage: python3 result_log.py stats  [--log DIR]
+       python3 result_log.py verify [--log DIR]
+       python3 result_log.py export OUT_DIR [--log DIR]
+       python3 result_log.py import SRC_DIR [--log DIR]
+
+Append-only result log of a worker, instead of one <id>.out file per protein.
+
+Results are appended to segment files <node>-<n>.seg in RESULT_LOG_DIR.
+There is one record per protein, one line each:
+
+    <crc32 of payload, 8 hex digits> <payload JSON: id, row, worker, timings, at>
+
+A record is written with a single write() call. The file is fsync'd after
+every SYNC_EVERY records or SYNC_SECONDS, not after every record. A
+segment is sealed at SEGMENT_BYTES and then gets a <segment>.idx file
+({id: offset}). On startup only the active segment is scanned, and a torn
+last record (from a crash) is cut off.
+
+The in-memory ID index replaces the per-file existence check, so a task
+that is already done is answered from the log. Several consumers on one
+node (autoscaler.py) each write their own segments, under the node name
+<host>.<instance>; on startup they also index the segments of the others,
+read-only, so a redelivered task is found whichever of them ran it.
+Records whose checksum does not match are skipped by every reader.
+create_final_report.py reads .seg files directly, alongside .out files.
+
+export writes the old layout (<safe_id>.out, header plus row) for tools
+that expect it. import appends existing .out files to the log.
+"""
+
+# ==========================================
+# Configuration
+# ==========================================
+RESULT_LOG_DIR = os.environ.get('RESULT_LOG_DIR', '/home/almalinux/result_log')
+NODE = socket.gethostname()
+SEGMENT_SUFFIX = '.seg'
+SEGMENT_BYTES = 64 * 1024 * 1024    # Seal and start a new segment beyond this
+SYNC_EVERY = 64                     # fsync after this many records...
+SYNC_SECONDS = 5.0                  # ...or this long since the last fsync
+# ==========================================
+
+def encode(payload):
+    data = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    return b"%08x %s\n" % (zlib.crc32(data), data)
+
+def decode(line):
+    """
+    The payload of one record line, or None if it is torn or corrupt.
+    """
+    if not line.endswith(b"\n") or len(line) < 10 or line[8:9] != b" ":
+        return None
+    data = line[9:-1]
+    try:
+        if int(line[:8], 16) != zlib.crc32(data):
+            return None
+        return json.loads(data)
+    except ValueError:
+        return None
+
+def iter_segment(path):
+    """
+    Yields (offset, length, payload) for every record of a segment; payload
+    is None for a record that fails its checksum.
+    """
+    offset = 0
+    with open(path, 'rb') as f:
+        for line in f:
+            yield offset, len(line), decode(line)
+            offset += len(line)
+
+def read_segment(path):
+    """
+    Result records (results_parser.record_from_row plus worker and timings)
+    of a segment, in log order. Corrupt records are skipped.
+    """
+    records = []
+    for _, _, payload in iter_segment(path):
+        if payload is None or not payload.get('row'):
+            continue
+        try:
+            record = results_parser.record_from_row(payload['row'])
+        except ValueError:
+            continue
+        record['worker'] = payload.get('worker')
+        record['timings'] = payload.get('timings')
+        records.append(record)
+    return records
+
+def segment_paths(log_dir, node=None):
+    """
+    Segments in log order (all nodes unless node is given).
+    """
+    return sorted(glob.glob(os.path.join(log_dir, f"{node or '*'}-{'[0-9]' * 6}{SEGMENT_SUFFIX}")))
+
+def read_out_row(path):
+    """
+    The CSV data line of a .out file (None if it has none).
+    """
+    try:
+        with open(path) as f:
+            for line in f:
+                if "," in line and not line.startswith("query_id"):
+                    return line.strip()
+    except OSError:
+        pass
+    return None
+
+class ResultLog:
+    """
+    Writer for this node's segments, with the ID index (which also covers
+    the other writers' segments in log_dir, as of opening). Used from a
+    single thread (the consumer's connection thread).
+    """
+    def __init__(self, log_dir=RESULT_LOG_DIR, node=NODE, segment_bytes=SEGMENT_BYTES,
+                 sync_every=SYNC_EVERY, sync_seconds=SYNC_SECONDS):
+        self.log_dir = log_dir
+        self.node = node
+        self.segment_bytes = segment_bytes
+        self.sync_every = sync_every
+        self.sync_seconds = sync_seconds
+        self.index = {}         # protein_id -> (segment path, offset)
+        self.corrupt = 0
+        os.makedirs(log_dir, exist_ok=True)
+
+        # Other writers first, so this node's own records take precedence.
+        # Their active segments are not truncated: they may be mid-write.
+        for path in segment_paths(log_dir):
+            if not self._owns(path):
+                self._load_shared(path)
+        paths = segment_paths(log_dir, node)
+        for path in paths[:-1]:
+            self._load_sealed(path)
+        if paths:
+            self.path = paths[-1]
+            self.size = self._recover(self.path)
+        else:
+            self.path = self._segment_name(0)
+            self.size = 0
+        self.file = open(self.path, 'ab', buffering=0)
+        self.unsynced = 0
+        self.synced_at = time.monotonic()
+
+    def _segment_name(self, n):
+        return os.path.join(self.log_dir, f"{self.node}-{n:06d}{SEGMENT_SUFFIX}")
+
+    def _owns(self, path):
+        return os.path.basename(path)[:-len(SEGMENT_SUFFIX)].rsplit('-', 1)[0] == self.node
+
+    def _scan(self, path):
+        offsets = {}
+        end = 0     # End of the last valid record
+        for offset, length, payload in iter_segment(path):
+            if payload is None:
+                self.corrupt += 1
+                continue
+            offsets[payload['id']] = offset
+            end = offset + length
+        return offsets, end
+
+    def _load_sealed(self, path):
+        try:
+            with open(path + '.idx') as f:
+                offsets = json.load(f)
+        except (OSError, ValueError):
+            offsets, _ = self._scan(path)
+            self._write_index(path, offsets)
+        for protein_id, offset in offsets.items():
+            self.index[protein_id] = (path, offset)
+
+    def _load_shared(self, path):
+        try:
+            with open(path + '.idx') as f:
+                offsets = json.load(f)
+        except (OSError, ValueError):
+            offsets, _ = self._scan(path)
+        for protein_id, offset in offsets.items():
+            self.index[protein_id] = (path, offset)
+
+    def _recover(self, path):
+        """
+        Index the active segment and cut off a torn last record. Returns its size.
+        """
+        offsets, end = self._scan(path)
+        size = os.path.getsize(path)
+        if end < size:
+            print(f" [!] Truncating {size - end} bytes of incomplete records from {path}")
+            with open(path, 'r+b') as f:
+                f.truncate(end)
+                os.fsync(f.fileno())
+            size = end
+        for protein_id, offset in offsets.items():
+            self.index[protein_id] = (path, offset)
+        return size
+
+    def _write_index(self, path, offsets):
+        with open(path + '.idx.tmp', 'w') as f:
+            json.dump(offsets, f)
+        os.replace(path + '.idx.tmp', path + '.idx')
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, protein_id):
+        return protein_id in self.index
+
+    def count_own(self):
+        """
+        IDs whose indexed record is in this node's own segments.
+        """
+        return sum(1 for path, _ in self.index.values() if self._owns(path))
+
+    def lookup(self, protein_id):
+        """
+        The stored CSV row for an ID, or None if it has no result.
+        """
+        location = self.index.get(protein_id)
+        if location is None:
+            return None
+        path, offset = location
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            payload = decode(f.readline())
+        return payload['row'] if payload else None
+
+    def append(self, protein_id, row, worker=None, timings=None):
+        line = encode({'id': protein_id, 'row': row, 'worker': worker, 'timings': timings, 'at': time.time()})
+        if self.size and self.size + len(line) > self.segment_bytes:
+            self._rotate()
+        self.file.write(line)
+        self.index[protein_id] = (self.path, self.size)
+        self.size += len(line)
+        self.unsynced += 1
+        if self.unsynced >= self.sync_every or time.monotonic() - self.synced_at >= self.sync_seconds:
+            self.sync()
+
+    def _rotate(self):
+        self.sync()
+        self.file.close()
+        self._write_index(self.path, {protein_id: offset for protein_id, (path, offset)
+                                      in self.index.items() if path == self.path})
+        n = int(os.path.basename(self.path)[len(self.node) + 1:-len(SEGMENT_SUFFIX)])
+        self.path = self._segment_name(n + 1)
+        self.file = open(self.path, 'ab', buffering=0)
+        self.size = 0
+
+    def sync(self):
+        if self.unsynced:
+            os.fsync(self.file.fileno())
+            self.unsynced = 0
+        self.synced_at = time.monotonic()
+
+    def close(self):
+        self.sync()
+        self.file.close()
+
+def scan_log(log_dir):
+    """
+    (latest payload per ID, records, corrupt records) over all segments in log_dir.
+    """
+    latest = {}
+    records = corrupt = 0
+    for path in segment_paths(log_dir):
+        for _, _, payload in iter_segment(path):
+            if payload is None:
+                corrupt += 1
+                continue
+            records += 1
+            latest[payload['id']] = payload
+    return latest, records, corrupt
+
+def export_out_files(log_dir, out_dir):
+    """
+    Write one <safe_id>.out per ID (header plus row), as the consumer used to.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    latest, _, _ = scan_log(log_dir)
+    for protein_id, payload in latest.items():
+        safe_id = protein_id.replace('|', '_')
+        path = os.path.join(out_dir, f"{safe_id}.out")
+        results_parser.write_parse_output(results_parser.record_from_row(payload['row']), path + '.tmp')
+        os.replace(path + '.tmp', path)
+    return len(latest)
+
+def import_out_files(log, src_dir):
+    """
+    Append the rows of the .out files in src_dir whose IDs the log does not have yet.
+    """
+    imported = 0
+    for name in sorted(os.listdir(src_dir)):
+        if not name.endswith('.out'):
+            continue
+        row = read_out_row(os.path.join(src_dir, name))
+        if row is None:
+            continue
+        protein_id = row.split(',', 1)[0]
+        if protein_id not in log:
+            log.append(protein_id, row, worker=log.node)
+            imported += 1
+    return imported
+
+def main():
+    parser = argparse.ArgumentParser(description="Segmented, checksummed result log")
+    # --log goes after the command, as in the usage above
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--log', default=RESULT_LOG_DIR, help=f"Log directory (default: {RESULT_LOG_DIR})")
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('stats', parents=[common], help="Segments, records and unique IDs")
+    sub.add_parser('verify', parents=[common], help="Check every checksum (exit status 1 on corruption)")
+    export = sub.add_parser('export', parents=[common], help="Write one .out file per protein")
+    export.add_argument('out_dir')
+    imp = sub.add_parser('import', parents=[common], help="Append existing .out files to this node's log")
+    imp.add_argument('src_dir')
+    args = parser.parse_args()
+
+    if args.command == 'import':
+        log = ResultLog(args.log)
+        imported = import_out_files(log, args.src_dir)
+        log.close()
+        print(f"✅ Imported {imported} results from {args.src_dir} ({len(log)} IDs in the log)")
+        return
+    if not os.path.isdir(args.log):
+        print(f"❌ Error: File not found {args.log}")
+        sys.exit(1)
+    if args.command == 'export':
+        start = time.perf_counter()
+        n = export_out_files(args.log, args.out_dir)
+        print(f"✅ Exported {n} results to {args.out_dir} in {time.perf_counter() - start:.1f}s")
+        return
+
+    latest, records, corrupt = scan_log(args.log)
+    paths = segment_paths(args.log)
+    print(f"  segments   {len(paths):10d} ({sum(os.path.getsize(p) for p in paths) / 2**20:.1f} MiB)")
+    print(f"  records    {records:10d}")
+    print(f"  unique IDs {len(latest):10d}")
+    print(f"  corrupt    {corrupt:10d}")
+    if args.command == 'verify' and corrupt:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
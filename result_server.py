@@ -1,10 +1,23 @@
 import os
-from flask import Flask, send_from_directory, render_template_string
+import json
+import zlib
+import hashlib
+import tempfile
+from flask import (Flask, Response, request, send_file, render_template_string,
+                   jsonify, abort)
+from result_store import ResultStore, RESULT_DB
+
+# zstd is optional: without the zstandard package only gzip is offered
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 app = Flask(__name__)
 
-# Set the directory to serve files from (current directory of the script)
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# Set the directory to serve files from (current directory of the script,
+# overridable with RESULT_SERVER_DIR)
+BASE_DIR = os.environ.get('RESULT_SERVER_DIR', os.path.dirname(os.path.abspath(__file__)))
 
 # Whitelist of files allowed for download
 ALLOWED_FILES = [
@@ -12,6 +25,91 @@ ALLOWED_FILES = [
     'final_profile_output.csv'
 ]
 
+# Compressed copies of the downloads, rebuilt when the CSV changes
+COMPRESSED_DIR = os.path.join(BASE_DIR, '.compressed')
+
+# Indexed result store (written by create_final_report.py / result_aggregator.py)
+STORE_PATH = os.path.join(BASE_DIR, RESULT_DB)
+STATUSES = ('done', 'nan', 'failed')
+
+# /api/rows paging
+DEFAULT_PAGE = 1000
+MAX_PAGE = 10000
+STREAM_ROWS = 500       # Rows per streamed (and compressed) chunk
+ROW_COLUMNS = ('query_id', 'best_hit', 'evalue', 'score', 'mean', 'std', 'gmean', 'status')
+
+def open_store():
+    if not os.path.exists(STORE_PATH):
+        abort(404, description="No result store yet.")
+    return ResultStore(STORE_PATH, readonly=True)
+
+def negotiate_encoding():
+    """
+    'zstd' or 'gzip' if the client accepts it (zstd only if installed), else None.
+    """
+    accepted = request.accept_encodings
+    if zstandard is not None and accepted['zstd']:
+        return 'zstd'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+def compressed_copy(path, encoding):
+    """
+    Path of a compressed copy of path, (re)built only when the source has
+    changed. The copy carries the source's mtime, so Last-Modified matches.
+    """
+    os.makedirs(COMPRESSED_DIR, exist_ok=True)
+    target = os.path.join(COMPRESSED_DIR, os.path.basename(path) + ('.zst' if encoding == 'zstd' else '.gz'))
+    st = os.stat(path)
+    if os.path.exists(target) and os.stat(target).st_mtime_ns == st.st_mtime_ns:
+        return target
+
+    fd, tmp = tempfile.mkstemp(prefix='.partial_', dir=COMPRESSED_DIR)
+    with open(path, 'rb') as src, os.fdopen(fd, 'wb') as dst:
+        if encoding == 'zstd':
+            zstandard.ZstdCompressor().copy_stream(src, dst)
+        else:
+            compressor = zlib.compressobj(6, zlib.DEFLATED, 31)    # 31: gzip container
+            for block in iter(lambda: src.read(1024 * 1024), b''):
+                dst.write(compressor.compress(block))
+            dst.write(compressor.flush())
+    os.utime(tmp, ns=(st.st_atime_ns, st.st_mtime_ns))
+    os.replace(tmp, target)
+    return target
+
+def compress_stream(chunks, encoding):
+    """
+    Compress a generator of text chunks on the fly, flushing after each chunk
+    so the client receives rows as they are produced.
+    """
+    if encoding == 'zstd':
+        compressor = zstandard.ZstdCompressor().compressobj()
+        for chunk in chunks:
+            yield compressor.compress(chunk.encode('utf-8')) + compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+        yield compressor.flush()
+    else:
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        for chunk in chunks:
+            yield compressor.compress(chunk.encode('utf-8')) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        yield compressor.flush()
+
+def store_version():
+    """
+    (validator, mtime) of the result store: changes whenever the database
+    or its write-ahead log is written.
+    """
+    parts = []
+    mtime = 0
+    for path in (STORE_PATH, STORE_PATH + '-wal'):
+        if os.path.exists(path):
+            st = os.stat(path)
+            if st.st_size == 0:
+                continue    # Empty WAL (created by the first reader): no data change
+            parts.append(f"{st.st_mtime_ns}-{st.st_size}")
+            mtime = max(mtime, st.st_mtime)
+    return ':'.join(parts), mtime
+
 @app.route('/')
 def index():
     """
@@ -67,10 +165,144 @@ def download_file(filename):
     """
     Serve the file if it is in the allowed list.
     """
-    if filename in ALLOWED_FILES:
-        return send_from_directory(BASE_DIR, filename, as_attachment=True)
-    else:
+    if filename not in ALLOWED_FILES:
         return "Access Denied: File not allowed.", 403
+    path = os.path.join(BASE_DIR, filename)
+    if not os.path.exists(path):
+        abort(404)
+
+    # ETag / Last-Modified / If-None-Match / If-Modified-Since / Range are
+    # handled by send_file(conditional=True) for the plain and compressed copies
+    encoding = negotiate_encoding()
+    if encoding:
+        response = send_file(compressed_copy(path, encoding), mimetype='text/csv',
+                             as_attachment=True, download_name=filename, conditional=True)
+        response.headers['Content-Encoding'] = encoding
+    else:
+        response = send_file(path, mimetype='text/csv', as_attachment=True,
+                             download_name=filename, conditional=True)
+    response.vary.add('Accept-Encoding')
+    # Pollers may keep a copy but must revalidate (cheap 304 while unchanged)
+    response.cache_control.no_cache = True
+    return response
+
+@app.route('/api/rows')
+def api_rows():
+    """
+    Streamed, filtered page of results from the store, as JSON (default) or CSV.
+    Query parameters:
+        prefix=sp|Q9D      query_id prefix
+        best_hit=7RRO_2    exact best hit
+        max_evalue=1e-10   best hit e-value threshold
+        status=done        done (default) | nan | failed
+        after=<query_id>   page cursor: rows after this ID (JSON gives it as "next")
+        limit=1000         rows per page (max 10000)
+        format=json|csv
+    """
+    args = request.args
+    fmt = args.get('format', 'json')
+    status = args.get('status', 'done')
+    try:
+        limit = min(max(int(args.get('limit', DEFAULT_PAGE)), 1), MAX_PAGE)
+        max_evalue = float(args['max_evalue']) if 'max_evalue' in args else None
+    except ValueError:
+        abort(400, description="limit must be an integer and max_evalue a number")
+    if fmt not in ('json', 'csv') or status not in STATUSES:
+        abort(400, description="format must be json|csv, status done|nan|failed")
+    filters = {
+        'status': status,
+        'prefix': args.get('prefix'),
+        'best_hit': args.get('best_hit'),
+        'max_evalue': max_evalue,
+        'after': args.get('after'),
+    }
+
+    # Same store contents + same query -> same representation
+    if not os.path.exists(STORE_PATH):
+        abort(404, description="No result store yet.")
+    encoding = negotiate_encoding()
+    version, mtime = store_version()
+    etag = hashlib.sha1(f"{version}|{encoding}|{request.full_path}".encode('utf-8')).hexdigest()
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+
+    def generate():
+        store = ResultStore(STORE_PATH, readonly=True)
+        try:
+            # One extra row tells whether there is a next page
+            rows = store.iter_results(ROW_COLUMNS, limit=limit + 1, **filters)
+            last_id = None
+            n = 0
+            buffer = ["{\"rows\": [" if fmt == 'json' else ",".join(ROW_COLUMNS) + "\n"]
+            for row in rows:
+                if n == limit:
+                    break
+                if fmt == 'json':
+                    buffer.append(("," if n else "") + json.dumps(dict(zip(ROW_COLUMNS, row))))
+                else:
+                    buffer.append(",".join("" if v is None else str(v) for v in row) + "\n")
+                last_id = row[0]
+                n += 1
+                if len(buffer) >= STREAM_ROWS:
+                    yield "".join(buffer)
+                    buffer = []
+            else:
+                last_id = None     # Fewer rows than the limit: this was the last page
+            if fmt == 'json':
+                buffer.append(f"], \"count\": {n}, \"next\": {json.dumps(last_id)}}}")
+            yield "".join(buffer)
+        finally:
+            store.close()
+
+    body = compress_stream(generate(), encoding) if encoding else generate()
+    response = Response(body, mimetype='application/json' if fmt == 'json' else 'text/csv')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.set_etag(etag)
+    response.last_modified = mtime
+    response.vary.add('Accept-Encoding')
+    response.cache_control.no_cache = True
+    return response
+
+@app.route('/api/result/<path:query_id>')
+def api_result(query_id):
+    """
+    Stored result(s) for a full query ID or an experiment ID.
+    """
+    store = open_store()
+    try:
+        rows = store.get(query_id)
+    finally:
+        store.close()
+    if not rows:
+        abort(404)
+    return jsonify(rows)
+
+@app.route('/api/hits/<best_hit>')
+def api_hits(best_hit):
+    """
+    All proteins whose best hit is best_hit (index lookup).
+    """
+    store = open_store()
+    try:
+        return jsonify(store.by_best_hit(best_hit))
+    finally:
+        store.close()
+
+@app.route('/api/status/<status>')
+def api_status(status):
+    """
+    IDs with the given status, e.g. /api/status/failed.
+    """
+    if status not in STATUSES:
+        abort(404)
+    store = open_store()
+    try:
+        return jsonify(store.by_status(status))
+    finally:
+        store.close()
 
 if __name__ == '__main__':
     # Run on all interfaces, port 5000
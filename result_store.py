@@ -0,0 +1,313 @@
+import os
+import sys
+import json
+import math
+import time
+import sqlite3
+import argparse
+import results_parser
+import result_cache
+
+"""
+usage: python3 result_store.py [--db RESULT_DB] COMMAND
+    stats                 row counts per status
+    show QUERY_OR_TARGET  one result (full query ID or experiment ID)
+    hit BEST_HIT          all proteins whose best hit is BEST_HIT (e.g. 7RRO_2)
+    status STATUS         IDs with a status: done | nan | failed
+    export                write the report CSVs from the views
+
+Indexed store of per-protein results on the host (one SQLite file).
+Rows have typed columns (query_id, best_hit, evalue, score, mean, std,
+gmean, status, stage timings) and are indexed by query_id, best_hit, status
+and experiment ID, so lookups no longer need a rescan of the .out files.
+status is 'done' for a usable row, 'nan' when the statistics are NaN
+(excluded from the report, as before) and 'failed' when the pipeline failed.
+final_hits_output.csv and final_profile_output.csv are exports of the
+hits_view / profile_view views.
+
+The solved table maps the result cache key of each solved sequence
+(sequence + tool versions, see result_cache.py) to its row, so producer.py
+--reuse can skip sequences any worker has solved, under any ID.
+"""
+
+# ==========================================
+# Configuration
+# ==========================================
+RESULT_DB = 'results.db'
+STAGES = ('s4pred', 'hhsearch', 'parse', 'total')    # Timing columns: <stage>_seconds
+# ==========================================
+
+COLUMNS = ('query_id', 'target_id', 'best_hit', 'evalue', 'score', 'mean', 'std', 'gmean',
+           'status', 'worker') + tuple(f'{stage}_seconds' for stage in STAGES) + ('source', 'updated')
+
+def result_status(record):
+    if math.isnan(record['score_std']) or math.isnan(record['score_gmean']):
+        return 'nan'
+    return 'done'
+
+class ResultStore:
+    """
+    SQLite-backed result table plus the manifest of ingested .out files.
+    """
+    def __init__(self, db_path=RESULT_DB, readonly=False):
+        self.db_path = db_path
+        if readonly:
+            # Query-only connection (result_server): no schema setup, no write locks
+            self.conn = sqlite3.connect(f"file:{os.path.abspath(db_path)}?mode=ro", uri=True,
+                                        timeout=30, check_same_thread=False)
+            return
+        self.conn = sqlite3.connect(db_path, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        timing_columns = ''.join(f"\n                {stage}_seconds REAL," for stage in STAGES)
+        self.conn.executescript(f"""
+            CREATE TABLE IF NOT EXISTS results (
+                query_id  TEXT PRIMARY KEY,
+                target_id TEXT,
+                best_hit  TEXT,
+                evalue    REAL,
+                score     REAL,
+                mean      REAL,
+                std       REAL,
+                gmean     REAL,
+                status    TEXT NOT NULL,
+                worker    TEXT,{timing_columns}
+                source    TEXT,
+                updated   REAL NOT NULL);
+            CREATE INDEX IF NOT EXISTS results_best_hit ON results (best_hit);
+            CREATE INDEX IF NOT EXISTS results_status ON results (status);
+            CREATE INDEX IF NOT EXISTS results_target ON results (target_id);
+            CREATE INDEX IF NOT EXISTS results_source ON results (source);
+
+            CREATE TABLE IF NOT EXISTS files (
+                name     TEXT PRIMARY KEY,
+                size     INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL);
+
+            CREATE TABLE IF NOT EXISTS solved (
+                key    TEXT PRIMARY KEY,
+                fields TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS meta (
+                name  TEXT PRIMARY KEY,
+                value TEXT NOT NULL);
+
+            -- The report CSVs (NaN rows are excluded, as before)
+            CREATE VIEW IF NOT EXISTS hits_view AS
+                SELECT query_id AS fasta_id, best_hit AS best_hit_id
+                FROM results WHERE status = 'done' ORDER BY query_id;
+            CREATE VIEW IF NOT EXISTS profile_view AS
+                SELECT AVG(std) AS ave_std, AVG(gmean) AS ave_gmean, COUNT(*) AS n_valid
+                FROM results WHERE status = 'done';
+        """)
+
+    # ---------- Ingestion ----------
+    def add_results(self, results):
+        """
+        Bulk upsert of result dicts (results_parser FIELDS plus optional
+        status, target_id, worker, timings, source, key, versions), in one
+        transaction. A 'failed' result never replaces a successful one.
+        """
+        now = time.time()
+        rows = []
+        solved = []         # Solved sequences by cache key
+        versions = None     # The tool versions those keys were made with
+        for r in results:
+            timings = r.get('timings') or {}
+            status = r.get('status') or result_status(r)
+            rows.append((
+                r['query_id'], r.get('target_id'), r.get('best_hit'),
+                r.get('best_evalue'), r.get('best_score'),
+                r.get('score_mean'), r.get('score_std'), r.get('score_gmean'),
+                status, r.get('worker'),
+                *(timings.get(stage) for stage in STAGES),
+                r.get('source'), now))
+            if r.get('key') and status != 'failed':
+                solved.append((r['key'], results_parser.format_record(r).split(',', 1)[1]))
+                versions = r.get('versions') or versions
+        placeholders = ', '.join('?' * len(COLUMNS))
+        updates = ', '.join(f"{c} = excluded.{c}" for c in COLUMNS[1:])
+        with self.conn:
+            self.conn.executemany(
+                f"INSERT INTO results ({', '.join(COLUMNS)}) VALUES ({placeholders}) "
+                f"ON CONFLICT (query_id) DO UPDATE SET {updates} "
+                f"WHERE excluded.status != 'failed' OR results.status = 'failed'", rows)
+            self.conn.executemany("INSERT OR REPLACE INTO solved (key, fields) VALUES (?, ?)", solved)
+            if versions:
+                self.conn.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('versions', ?)",
+                                  (json.dumps(versions),))
+        return len(rows)
+
+    def forget_sources(self, names):
+        """
+        Remove the rows read from these .out files, and the files from the manifest.
+        """
+        with self.conn:
+            self.conn.executemany("DELETE FROM results WHERE source = ?", ((n,) for n in names))
+            self.conn.executemany("DELETE FROM files WHERE name = ?", ((n,) for n in names))
+
+    def known_files(self):
+        return {name: (size, mtime_ns) for name, size, mtime_ns in
+                self.conn.execute("SELECT name, size, mtime_ns FROM files")}
+
+    def record_files(self, files):
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?)", files)
+
+    # ---------- Queries ----------
+    def get(self, query_or_target_id):
+        cur = self.conn.execute(
+            "SELECT * FROM results WHERE query_id = ? OR target_id = ?", (query_or_target_id,) * 2)
+        names = [d[0] for d in cur.description]
+        return [dict(zip(names, row)) for row in cur]
+
+    def by_best_hit(self, best_hit):
+        return [row[0] for row in self.conn.execute(
+            "SELECT query_id FROM results WHERE best_hit = ? ORDER BY query_id", (best_hit,))]
+
+    def by_status(self, status):
+        return [row[0] for row in self.conn.execute(
+            "SELECT query_id FROM results WHERE status = ? ORDER BY query_id", (status,))]
+
+    def iter_results(self, columns=('query_id', 'best_hit', 'evalue', 'score'), status='done',
+                     prefix=None, best_hit=None, max_evalue=None, after=None, limit=None):
+        """
+        Rows in query_id order, filtered through the indexes. Pages are keyed
+        by the last query_id seen (after=...), not by OFFSET, so every page
+        costs the same. Yields tuples; nothing is loaded into memory.
+        """
+        where, params = [], []
+        if status is not None:
+            where.append("status = ?")
+            params.append(status)
+        if prefix:
+            # Range scan on the primary key
+            where.append("query_id >= ? AND query_id < ?")
+            params += [prefix, prefix + '\U0010ffff']
+        if best_hit is not None:
+            where.append("best_hit = ?")
+            params.append(best_hit)
+        if max_evalue is not None:
+            where.append("evalue <= ?")
+            params.append(max_evalue)
+        if after is not None:
+            where.append("query_id > ?")
+            params.append(after)
+        sql = f"SELECT {', '.join(columns)} FROM results"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY query_id"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        return self.conn.execute(sql, params)
+
+    def found_targets(self):
+        return set(row[0] for row in self.conn.execute(
+            "SELECT DISTINCT target_id FROM results WHERE status = 'done' AND target_id IS NOT NULL"))
+
+    def lookup_solved(self, sequence):
+        """
+        Result fields (everything after query_id) of this sequence under the
+        tool versions the workers last reported, or None. Same interface as
+        ResultCache.lookup_solved, for producer.py.
+        """
+        row = self.conn.execute("SELECT value FROM meta WHERE name = 'versions'").fetchone()
+        if row is None:
+            return None
+        versions = json.loads(row[0])
+        key = result_cache.sequence_key(sequence, versions['s4pred'], versions['hhsearch'])
+        row = self.conn.execute("SELECT fields FROM solved WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def counts(self):
+        return dict(self.conn.execute("SELECT status, COUNT(*) FROM results GROUP BY status"))
+
+    # ---------- Views -> report files ----------
+    def export_hits(self, path):
+        n = 0
+        with open(path + '.tmp', 'w') as f:
+            f.write("fasta_id,best_hit_id\n")
+            for fasta_id, best_hit_id in self.conn.execute("SELECT fasta_id, best_hit_id FROM hits_view"):
+                f.write(f"{fasta_id},{best_hit_id}\n")
+                n += 1
+        os.replace(path + '.tmp', path)
+        return n
+
+    def export_profile(self, path):
+        """
+        Writes the profile CSV; returns (ave_std, ave_gmean, n_valid), or None
+        (and writes nothing) when there is no valid row.
+        """
+        ave_std, ave_gmean, n_valid = self.conn.execute(
+            "SELECT ave_std, ave_gmean, n_valid FROM profile_view").fetchone()
+        if not n_valid:
+            return None
+        with open(path + '.tmp', 'w') as f:
+            f.write("ave_std,ave_gmean\n")
+            f.write(f"{ave_std:.2f},{ave_gmean:.2f}\n")
+        os.replace(path + '.tmp', path)
+        return ave_std, ave_gmean, n_valid
+
+    def export_missing(self, path, target_ids):
+        missing = sorted(target_ids - self.found_targets())
+        with open(path + '.tmp', 'w') as f:
+            for mid in missing:
+                f.write(mid + "\n")
+        os.replace(path + '.tmp', path)
+        return missing
+
+    def close(self):
+        self.conn.close()
+
+def record_from_message(message):
+    """
+    Store row for a result_queue message ({'id', 'status', 'row', 'worker',
+    'timings'}, plus 'key' and 'versions' for a row a worker computed).
+    """
+    if message.get('status') == 'failed' or not message.get('row'):
+        record = {'query_id': message['id'], 'status': 'failed'}
+    else:
+        record = results_parser.record_from_row(message['row'])
+    record['worker'] = message.get('worker')
+    record['timings'] = message.get('timings')
+    record['source'] = 'result_queue'
+    record['key'] = message.get('key')
+    record['versions'] = message.get('versions')
+    return record
+
+def main():
+    parser = argparse.ArgumentParser(description="Indexed store of per-protein results")
+    parser.add_argument('--db', default=RESULT_DB, help=f"SQLite file (default: {RESULT_DB})")
+    sub = parser.add_subparsers(dest='command')
+    sub.add_parser('stats', help="Row counts per status (the default)")
+    show = sub.add_parser('show', help="One result (full query ID or experiment ID)")
+    show.add_argument('query')
+    hit = sub.add_parser('hit', help="All proteins whose best hit is BEST_HIT (e.g. 7RRO_2)")
+    hit.add_argument('best_hit')
+    status = sub.add_parser('status', help="IDs with a status")
+    status.add_argument('status', choices=('done', 'nan', 'failed'))
+    sub.add_parser('export', help="Write the report CSVs from the views")
+    args = parser.parse_args()
+
+    store = ResultStore(args.db)
+    start = time.perf_counter()
+    if args.command == 'show':
+        for row in store.get(args.query):
+            for key, value in row.items():
+                print(f"  {key:18s} {value}")
+    elif args.command == 'hit':
+        print('\n'.join(store.by_best_hit(args.best_hit)))
+    elif args.command == 'status':
+        print('\n'.join(store.by_status(args.status)))
+    elif args.command == 'export':
+        from create_final_report import load_target_ids, OUTPUT_HITS, OUTPUT_PROFILE, MISSING_FILE
+        print(f"{OUTPUT_HITS}: {store.export_hits(OUTPUT_HITS)} rows")
+        print(f"{OUTPUT_PROFILE}: {store.export_profile(OUTPUT_PROFILE)}")
+        print(f"{MISSING_FILE}: {len(store.export_missing(MISSING_FILE, load_target_ids()))} IDs")
+    else:
+        for status, n in sorted(store.counts().items()):
+            print(f"  {status:8s} {n:10d}")
+    print(f"({(time.perf_counter() - start) * 1000:.1f} ms)", file=sys.stderr)
+    store.close()
+
+if __name__ == '__main__':
+    main()
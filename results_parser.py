@@ -1,25 +1,157 @@
-from Bio import SearchIO
-import numpy as np
-from scipy.stats import gmean
-
-best_hit = []
-best_score = 0
-good_hit_scores  = []
-id = ''
-for result in SearchIO.parse('tmp.hhr', 'hhsuite3-text'):
-    id=result.id
-    for hit in result.hits:
-        if hit.score >= best_score:
-            best_score = hit.score
-            best_hit = [hit.id, hit.evalue, hit.score]
-        if hit.evalue < 1.e-5:
-            good_hit_scores.append(hit.score)
-
-fhOut = open("hhr_parse.out", "w")
-fhOut.write("query_id,best_hit,best_evalue,best_score,score_mean,score_std,score_gmean\n")
-mean=format(np.mean(good_hit_scores), ".2f")
-std=format(np.std(good_hit_scores), ".2f")
-g_mean=format(gmean(good_hit_scores), ".2f")
-
-fhOut.write(f"{id},{best_hit[0]},{best_hit[1]},{best_hit[2]},{mean},{std},{g_mean}\n")
-fhOut.close()
\ No newline at end of file
+import re
+import sys
+import math
+
+"""
+usage: python3 results_parser.py [HHR_FILE]      (default: tmp.hhr, writes hhr_parse.out)
+
+Also importable: parse_hhr(path) returns the summary record for one .hhr file.
+
+Single-pass streaming parser: it reads the query name and, for every hit, only
+the '>id' and 'Probab=... E-value=... Score=...' lines of its alignment block
+(the summary table rounds scores to one decimal, so it cannot be used).
+Alignment rows are skipped without building any objects, and best hit /
+mean / variance / log-sum are kept as running values. The output is identical
+to the previous Bio.SearchIO + numpy/scipy implementation, including hits
+listed twice (first block wins) and the 'nan' statistics when no hit has
+evalue < 1e-5.
+"""
+
+HEADER = "query_id,best_hit,best_evalue,best_score,score_mean,score_std,score_gmean"
+FIELDS = HEADER.split(',')
+
+GOOD_EVALUE = 1.e-5
+_RE_QUERY = re.compile(r"^Query\s+(.+)\s?$")
+_RE_HIT_BLOCK_START = re.compile(r"^No +(\d+)\s+$")
+
+def parse_hhr(hhr_file):
+    """
+    Best hit plus mean/std/geometric mean of the scores of hits with evalue < 1e-5.
+    Returns a dict keyed by FIELDS; raises if the file has no usable hit.
+    """
+    query_id = ''
+    best_hit = None
+    best_score = 0
+    seen = set()
+
+    # Running statistics over good hits
+    n = 0
+    total = 0.0
+    m2 = 0.0            # Welford sum of squared deviations
+    running_mean = 0.0
+    log_sum = 0.0
+    has_zero = False
+    has_negative = False
+
+    with open(hhr_file) as fh:
+        # Preamble: from the first non-blank line to the next blank line
+        started = False
+        for line in fh:
+            line = line.strip()
+            if not line:
+                if started:
+                    break
+                continue
+            started = True
+            match = _RE_QUERY.search(line)
+            if match:
+                query_id = match.group(1)
+
+        expect_desc = False
+        expect_scores = False
+        hit_id = None
+        for line in fh:
+            if expect_scores:
+                expect_scores = False
+                evalue = score = None
+                for pair in line.split():
+                    key, _, value = pair.partition('=')
+                    if key == 'E-value':
+                        evalue = float(value)
+                    elif key == 'Score':
+                        score = float(value)
+                if hit_id in seen:
+                    continue    # Repeated template: only its first block counts
+                seen.add(hit_id)
+
+                if score >= best_score:
+                    best_score = score
+                    best_hit = [hit_id, evalue, score]
+                if evalue < GOOD_EVALUE:
+                    n += 1
+                    total += score
+                    delta = score - running_mean
+                    running_mean += delta / n
+                    m2 += delta * (score - running_mean)
+                    if score > 0:
+                        log_sum += math.log(score)
+                    elif score == 0:
+                        has_zero = True
+                    else:
+                        has_negative = True
+            elif expect_desc:
+                if line.strip():
+                    expect_desc = False
+                    if not line.startswith('>'):
+                        raise ValueError(f"Unexpected hit description line in {hhr_file}: {line!r}")
+                    hit_id = line[1:].split()[0]
+                    expect_scores = True
+            elif line.startswith('Done!'):
+                break
+            elif _RE_HIT_BLOCK_START.match(line):
+                expect_desc = True
+
+    if not seen:
+        raise ValueError(f"No hits found in {hhr_file}")
+    if best_hit is None:
+        raise ValueError(f"No hit with a non-negative score in {hhr_file}")
+
+    nan = float('nan')
+    if n:
+        mean = total / n
+        std = math.sqrt(m2 / n)
+        if has_negative:
+            g_mean = nan
+        elif has_zero:
+            g_mean = 0.0
+        else:
+            g_mean = math.exp(log_sum / n)
+    else:
+        mean = std = g_mean = nan
+
+    return {
+        'query_id': query_id,
+        'best_hit': best_hit[0],
+        'best_evalue': best_hit[1],
+        'best_score': best_hit[2],
+        'score_mean': mean,
+        'score_std': std,
+        'score_gmean': g_mean,
+    }
+
+def format_record(record):
+    """
+    One CSV row, formatted exactly as hhr_parse.out has always been written.
+    """
+    mean=format(record['score_mean'], ".2f")
+    std=format(record['score_std'], ".2f")
+    g_mean=format(record['score_gmean'], ".2f")
+    return f"{record['query_id']},{record['best_hit']},{record['best_evalue']},{record['best_score']},{mean},{std},{g_mean}"
+
+def record_from_row(row):
+    """
+    Inverse of format_record (used for cached rows).
+    """
+    parts = row.strip().split(',')
+    record = dict(zip(FIELDS, parts))
+    for field in FIELDS[2:]:
+        record[field] = float(record[field])
+    return record
+
+def write_parse_output(record, out_file="hhr_parse.out"):
+    with open(out_file, "w") as fhOut:
+        fhOut.write(HEADER + "\n")
+        fhOut.write(format_record(record) + "\n")
+
+if __name__ == "__main__":
+    write_parse_output(parse_hhr(sys.argv[1] if len(sys.argv) > 1 else 'tmp.hhr'))
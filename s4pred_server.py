@@ -0,0 +1,282 @@
+import os
+import sys
+import json
+import time
+import queue
+import socket
+import argparse
+import tempfile
+import threading
+import socketserver
+from concurrent.futures import Future, ThreadPoolExecutor
+
+"""
+usage: python3 s4pred_server.py [--socket PATH] [--predictors N] [--threads T] [--window SECONDS]
+
+Long-lived S4Pred service for a worker node.
+The ensemble weights are loaded once, sequences arrive over a local Unix socket,
+and whatever is queued within a short window is predicted as one batch.
+Each group of equal-length sequences is one forward pass, and N predictor
+threads run passes side by side (torch releases the GIL), each with T torch
+threads. By default N x T is the node's calibration profile (consumer slots x
+threads per job, see calibrate.py), else one single-threaded predictor per
+core: the same parallelism as one run_model.py -T 1 per slot.
+Replies are plain horiz text, the same format run_model.py -t horiz prints.
+"""
+
+# ==========================================
+# Configuration
+# ==========================================
+S4PRED_DIR = '/opt/tools/s4pred'
+SOCKET_PATH = os.environ.get('S4PRED_SOCKET', '/tmp/s4pred.sock')
+BATCH_WINDOW = 0.05     # Seconds to wait for more sequences before predicting
+MAX_BATCH = 32          # Upper bound on sequences predicted together
+REQUEST_TIMEOUT = 600   # Seconds a client waits for a reply before giving up on the server
+# ==========================================
+
+
+# ==========================================
+# Client side (used by pipeline_script.py)
+# ==========================================
+def read_fasta_text(fasta_file):
+    """
+    Minimal FASTA reader returning [(name, sequence), ...].
+    Kept Biopython-free so the client stays cheap to import.
+    """
+    records = []
+    name, chunks = None, []
+    with open(fasta_file) as fh_in:
+        for line in fh_in:
+            line = line.strip()
+            if line.startswith('>'):
+                if name is not None:
+                    records.append((name, ''.join(chunks)))
+                header = line[1:].split()
+                name = header[0] if header else ''
+                chunks = []
+            elif line:
+                chunks.append(line)
+    if name is not None:
+        records.append((name, ''.join(chunks)))
+    return records
+
+def predict_horiz(records, socket_path=None, timeout=REQUEST_TIMEOUT):
+    """
+    Send [(name, sequence), ...] to the running server and return horiz text.
+    Raises OSError (e.g. FileNotFoundError / ConnectionRefusedError) when no
+    server is listening, and TimeoutError when it does not answer within
+    timeout seconds, so callers can fall back to run_model.py.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(socket_path or SOCKET_PATH)
+        request = {'sequences': [[name, seq] for name, seq in records]}
+        sock.sendall((json.dumps(request) + '\n').encode('utf-8'))
+        with sock.makefile('r', encoding='utf-8') as fh:
+            reply = json.loads(fh.readline() or '{}')
+
+    if 'error' in reply or 'horiz' not in reply:
+        raise Exception(f"S4Pred failed: {reply.get('error', 'empty reply from server')}")
+    return ''.join(reply['horiz'])
+
+
+# ==========================================
+# Server side
+# ==========================================
+def load_model(threads, device_name='cpu'):
+    """
+    Build the S4PRED ensemble and load the five weight files, exactly once.
+    """
+    sys.path.insert(0, S4PRED_DIR)
+    import torch
+    from network import S4PRED
+
+    if threads > 0:
+        torch.set_num_threads(threads)
+    device = torch.device('cuda:0' if device_name == 'gpu' and torch.cuda.is_available() else 'cpu:0')
+
+    model = S4PRED().to(device)
+    model.eval()
+    model.requires_grad = False
+
+    weight_files = [f'weights/weights_{i}.pt' for i in range(1, 6)]
+    submodels = [model.model_1, model.model_2, model.model_3, model.model_4, model.model_5]
+    for submodel, weight_file in zip(submodels, weight_files):
+        path = os.path.join(S4PRED_DIR, weight_file)
+        submodel.load_state_dict(torch.load(path, map_location=lambda storage, loc: storage))
+
+    return model, device
+
+class BatchPredictor:
+    """
+    Collects sequences from all connections and predicts them in batches.
+    Sequences of equal length share one forward pass (no padding, so results
+    match single-sequence prediction); passes of different lengths run on
+    up to `predictors` threads at once.
+    """
+    def __init__(self, model, device, window=BATCH_WINDOW, max_batch=MAX_BATCH, predictors=1):
+        self.model = model
+        self.device = device
+        self.window = window
+        self.max_batch = max_batch
+        self.pending = queue.Queue()
+        self.predictors = ThreadPoolExecutor(max_workers=max(1, predictors), thread_name_prefix='predictor')
+
+    def submit(self, name, sequence):
+        future = Future()
+        self.pending.put((name, sequence, future))
+        return future
+
+    def serve_forever(self):
+        while True:
+            batch = [self.pending.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.pending.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self.predict_batch(batch)
+
+    def predict_batch(self, batch):
+        """
+        Encode [(name, sequence, future), ...] and hand each group of equal
+        length to a predictor thread. Every future is resolved with its horiz
+        text, or with the exception that stopped it.
+        """
+        try:
+            encoded = self.encode([sequence for _, sequence, _ in batch])
+            by_length = {}
+            for i, item in enumerate(encoded):
+                by_length.setdefault(len(item[2]), []).append(i)
+        except Exception as e:
+            for _, _, future in batch:
+                future.set_exception(e)
+            return
+
+        for indices in by_length.values():
+            self.predictors.submit(self.predict_group, [batch[i] for i in indices],
+                                   [encoded[i] for i in indices])
+
+    def predict_group(self, items, encoded):
+        futures = [future for _, _, future in items]
+        try:
+            horiz = self.predict([name for name, _, _ in items], encoded)
+            for future, text in zip(futures, horiz):
+                future.set_result(text)
+        except Exception as e:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+
+    def encode(self, sequences):
+        """
+        S4Pred's own FASTA loader, so encoding matches run_model.py.
+        Returns one [header, sequence, tokens] item per sequence, in order.
+        """
+        from utilities import loadfasta
+
+        with tempfile.NamedTemporaryFile('w', suffix='.fas', delete=False) as fh:
+            for i, sequence in enumerate(sequences):
+                fh.write(f">{i}\n{sequence}\n")
+        try:
+            data = loadfasta(fh.name)
+        finally:
+            os.remove(fh.name)
+        # Headers carry the batch position, so results map back to callers
+        encoded = [None] * len(sequences)
+        for item in data:
+            encoded[int(item[0].split()[0])] = item
+        if any(item is None for item in encoded):
+            raise ValueError("S4Pred could not read every sequence of the batch")
+        return encoded
+
+    def predict(self, names, encoded):
+        """
+        One forward pass over equal-length encoded sequences; horiz text per sequence.
+        """
+        import torch
+        from utilities import format_horiz
+
+        with torch.no_grad():
+            tokens = torch.tensor([item[2] for item in encoded]).to(self.device)
+            ss = self.model(tokens)
+            ss_conf = torch.exp(ss)
+            ss_conf = ss_conf / ss_conf.sum(dim=2, keepdim=True)
+            ss = ss.argmax(dim=2).cpu().numpy()
+            ss_conf = ss_conf.cpu().numpy()
+        return ['\n'.join(format_horiz([name, item[1], item[2]], ss[row], ss_conf[row])) + '\n'
+                for row, (name, item) in enumerate(zip(names, encoded))]
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    """
+    One JSON line in ({"sequences": [[name, seq], ...]}), one JSON line out.
+    """
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+            futures = [self.server.predictor.submit(name, seq) for name, seq in request['sequences']]
+            reply = {'horiz': [f.result() for f in futures]}
+        except Exception as e:
+            reply = {'error': f"{type(e).__name__}: {e}"}
+        self.wfile.write((json.dumps(reply) + '\n').encode('utf-8'))
+
+class S4PredServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+def node_size():
+    """
+    (predictors, threads) for this node: the calibration profile's jobs x
+    threads, else one single-threaded predictor per core.
+    """
+    import calibrate
+    profile = calibrate.load_profile()
+    if profile is not None:
+        return profile['jobs'], profile['threads']
+    return os.cpu_count() or 1, 1
+
+def main():
+    parser = argparse.ArgumentParser(description="Persistent S4Pred inference server")
+    parser.add_argument('--socket', default=SOCKET_PATH, help="Unix socket to listen on")
+    parser.add_argument('--predictors', type=int,
+                        help="Forward passes run in parallel (default: calibration profile jobs, else CPUs)")
+    parser.add_argument('--threads', type=int,
+                        help="torch CPU threads per pass (default: calibration profile, else 1; 0 = all)")
+    parser.add_argument('--device', default='cpu', choices=['cpu', 'gpu'])
+    parser.add_argument('--window', type=float, default=BATCH_WINDOW, help="Batching window in seconds")
+    parser.add_argument('--max-batch', type=int, default=MAX_BATCH)
+    args = parser.parse_args()
+
+    predictors, threads = node_size()
+    predictors = max(1, args.predictors or predictors)
+    threads = threads if args.threads is None else args.threads
+
+    print(f" [*] Loading S4Pred weights ({predictors} predictors x {threads} threads)...")
+    start = time.time()
+    model, device = load_model(threads, args.device)
+    print(f" [*] Weights loaded in {time.time() - start:.1f}s")
+
+    # Remove a stale socket left behind by a previous run
+    if os.path.exists(args.socket):
+        os.remove(args.socket)
+
+    predictor = BatchPredictor(model, device, args.window, args.max_batch, predictors)
+    threading.Thread(target=predictor.serve_forever, daemon=True).start()
+
+    with S4PredServer(args.socket, RequestHandler) as server:
+        server.predictor = predictor
+        os.chmod(args.socket, 0o666)
+        print(f" [*] S4Pred server listening on {args.socket}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if os.path.exists(args.socket):
+                os.remove(args.socket)
+
+if __name__ == '__main__':
+    main()
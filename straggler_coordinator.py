@@ -0,0 +1,172 @@
+import sys
+import json
+import time
+import argparse
+import pika
+import broker_config
+
+"""
+usage: python3 straggler_coordinator.py [--factor F] [--min-seconds S] [--check-seconds S]
+                                        [--worker-timeout S]
+
+Runs on the host next to the producer and watches the task start/finish
+events the consumers publish to task_events. Near the end of a run, when
+task_queue is empty but a task has been running for more than F times its
+expected time (and at least S seconds) while some worker has a free slot,
+a speculative duplicate of it is sent to task_queue at the highest priority.
+
+Whichever copy finishes first wins: a consumer whose result log
+(result_log.py) already holds the ID acks the copy without running it,
+a copy finished on another node only appends a duplicate record to that
+node's log, the result store keeps one row per ID (a later identical row
+is a no-op, a failure never replaces a success) and a failed speculative
+copy is dropped instead of retried. Each task is duplicated at most once.
+
+Consumers also send an 'alive' event every EVENT_ALIVE_SECONDS, and every
+event says whether the consumer is draining (autoscaler.py scale-down).
+A draining consumer has no free slots. A consumer with no event for
+--worker-timeout seconds (stopped, killed or crashed) is forgotten with its
+running tasks: RabbitMQ redelivers those, so they are not speculated.
+"""
+
+# ==========================================
+# Configuration
+# ==========================================
+SPECULATE_FACTOR = 3.0      # Running longer than this x expected -> straggler
+MIN_SPECULATE_SECONDS = 300 # Never duplicate tasks younger than this
+CHECK_SECONDS = 10.0        # How often the stragglers are looked for
+WORKER_TIMEOUT = 3 * broker_config.EVENT_ALIVE_SECONDS  # Silent this long -> worker gone
+# ==========================================
+
+class RunState:
+    """
+    Running tasks and free slots per worker, built from task events.
+    Times are the coordinator's own receive times, so worker clocks do not matter.
+    """
+    def __init__(self):
+        self.running = {}       # (worker, task key) -> {'id', 'sequence', 'expected', 'since', ...}
+        self.slots = {}         # worker -> slots
+        self.last_seen = {}     # worker -> receive time of its last event
+        self.draining = set()   # Workers taking no new tasks
+        self.finished = set()   # IDs that completed successfully somewhere
+        self.speculated = set() # IDs already duplicated
+
+    def apply(self, event, now):
+        worker = event.get('worker')
+        self.slots[worker] = event.get('slots') or self.slots.get(worker, 1)
+        self.last_seen[worker] = now
+        if event.get('draining'):
+            self.draining.add(worker)
+        else:
+            self.draining.discard(worker)
+        key = event.get('id') or tuple(event.get('ids') or ())
+        if event.get('event') == 'start':
+            self.running[(worker, key)] = dict(event, since=now)
+        elif event.get('event') == 'finish':
+            self.running.pop((worker, key), None)
+            if event.get('status') in ('done', 'skipped'):
+                self.finished.add(event.get('id'))
+
+    def free_slots(self):
+        busy = {}
+        for worker, _ in self.running:
+            busy[worker] = busy.get(worker, 0) + 1
+        return sum(max(0, slots - busy.get(worker, 0)) for worker, slots in self.slots.items()
+                   if worker not in self.draining)
+
+    def expire(self, now, timeout):
+        """
+        Forget the workers with no event for timeout seconds, and their
+        running tasks. Returns the workers dropped.
+        """
+        gone = [worker for worker, seen in self.last_seen.items() if now - seen > timeout]
+        for worker in gone:
+            del self.last_seen[worker]
+            self.slots.pop(worker, None)
+            self.draining.discard(worker)
+        self.running = {(worker, key): task for (worker, key), task in self.running.items()
+                        if worker not in gone}
+        return gone
+
+    def stragglers(self, now, factor, min_seconds):
+        """
+        Single tasks overdue and not yet duplicated or finished, most overdue first.
+        """
+        overdue = []
+        for (worker, key), task in self.running.items():
+            if not isinstance(key, str) or key in self.speculated or key in self.finished:
+                continue
+            if task.get('speculative'):
+                continue
+            elapsed = now - task['since']
+            if elapsed >= min_seconds and elapsed >= factor * (task.get('expected') or 0):
+                overdue.append((elapsed / max(task.get('expected') or 1, 1), worker, task))
+        overdue.sort(key=lambda item: -item[0])
+        return overdue
+
+def queue_depth(channel):
+    return channel.queue_declare(queue=broker_config.TASK_QUEUE, passive=True).method.message_count
+
+def speculate(channel, task):
+    message = {'id': task['id'], 'sequence': task['sequence'], 'enqueued_at': time.time(),
+               'expected_seconds': task.get('expected'), 'trace_id': task.get('trace_id'),
+               'speculative': True}
+    channel.basic_publish(
+        exchange='', routing_key=broker_config.TASK_QUEUE, body=json.dumps(message),
+        properties=pika.BasicProperties(delivery_mode=2, priority=broker_config.MAX_PRIORITY))
+
+def main():
+    parser = argparse.ArgumentParser(description="Speculative re-execution of straggling tasks")
+    parser.add_argument('--factor', type=float, default=SPECULATE_FACTOR,
+                        help=f"Straggler threshold as a multiple of the expected time (default: {SPECULATE_FACTOR})")
+    parser.add_argument('--min-seconds', type=float, default=MIN_SPECULATE_SECONDS,
+                        help=f"Minimum running time before duplicating (default: {MIN_SPECULATE_SECONDS})")
+    parser.add_argument('--check-seconds', type=float, default=CHECK_SECONDS)
+    parser.add_argument('--worker-timeout', type=float, default=WORKER_TIMEOUT,
+                        help=f"Forget a worker after this long without events (default: {WORKER_TIMEOUT})")
+    args = parser.parse_args()
+
+    connection = pika.BlockingConnection(pika.ConnectionParameters('localhost'))
+    channel = connection.channel()
+    broker_config.declare_event_queue(channel)
+    broker_config.declare_task_queue(channel)
+    channel.confirm_delivery()
+    print(f"🚀 Watching {broker_config.EVENT_QUEUE} for stragglers "
+          f"(> {args.factor:g} x expected and > {args.min_seconds:g}s)")
+
+    state = RunState()
+    last_check = 0.0
+    try:
+        for method, properties, body in channel.consume(broker_config.EVENT_QUEUE, auto_ack=True,
+                                                        inactivity_timeout=1.0):
+            now = time.time()
+            if method is not None:
+                try:
+                    state.apply(json.loads(body), now)
+                except ValueError:
+                    print(f" [!] Dropping malformed event: {body[:80]!r}")
+
+            if now - last_check < args.check_seconds:
+                continue
+            last_check = now
+            for worker in state.expire(now, args.worker_timeout):
+                print(f" [Gone] {worker}: no events for {args.worker_timeout:g}s, forgotten with its tasks")
+            # Only near the end: queued work would use the free slots anyway
+            free = state.free_slots()
+            if free == 0 or queue_depth(channel) > 0:
+                continue
+            for ratio, worker, task in state.stragglers(now, args.factor, args.min_seconds)[:free]:
+                speculate(channel, task)
+                state.speculated.add(task['id'])
+                print(f" [Speculate] {task['id']} on {worker}: {now - task['since']:.0f}s "
+                      f"({ratio:.1f} x expected), duplicate queued")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if connection.is_open:
+            connection.close()
+        print(f"✅ {len(state.speculated)} speculative duplicates sent")
+    sys.exit(0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+from pika.frame import Method
+from pika.spec import Basic
+import publisher
+from publisher import ConfirmedPublisher, load_ledger, MAX_ATTEMPTS
+
+"""
+ConfirmedPublisher against an in-process stand-in for the broker: the
+channel records what is published and the test sends the Ack/Nack frames.
+"""
+
+class FakeBroker:
+    """
+    Channel and connection in one; delivery tags count publishes from 1,
+    as on a channel in confirm mode.
+    """
+    def __init__(self):
+        self.published = []     # (delivery_tag, body)
+        self.properties = []
+        self.closed = False
+
+    def basic_publish(self, exchange, routing_key, body, properties):
+        self.published.append((len(self.published) + 1, body))
+        self.properties.append(properties)
+
+    def close(self):
+        self.closed = True
+
+    def tags(self, body):
+        return [tag for tag, published in self.published if published == body]
+
+def start(tmp_path, messages, window=publisher.DEFAULT_WINDOW):
+    broker = FakeBroker()
+    pub = ConfirmedPublisher(None, 'task_queue', messages, window=window,
+                             ledger_file=str(tmp_path / 'ledger.txt'))
+    pub.connection = pub.channel = broker
+    pub.ledger = open(pub.ledger_file, 'a')
+    pub.on_confirm_mode(None)
+    return pub, broker
+
+def confirm(pub, tag, ack=True, multiple=False):
+    method = Basic.Ack if ack else Basic.Nack
+    pub.on_delivery_confirmation(Method(1, method(delivery_tag=tag, multiple=multiple)))
+
+def messages(n):
+    return [(f"P{i}", f"body{i}".encode()) for i in range(n)]
+
+def test_window_and_multiple_ack(tmp_path):
+    pub, broker = start(tmp_path, messages(6), window=4)
+    assert len(broker.published) == 4
+
+    confirm(pub, 3, multiple=True)
+    assert load_ledger(pub.ledger_file) == {'P0', 'P1', 'P2'}
+    assert len(broker.published) == 6       # The window was topped up
+    assert not broker.closed
+
+    confirm(pub, 5)
+    confirm(pub, 6, multiple=True)          # Covers 4 and 6
+    assert load_ledger(pub.ledger_file) == {f"P{i}" for i in range(6)}
+    assert pub.stats()['confirmed'] == 6
+    assert broker.closed
+
+def test_nack_retries_until_max_attempts(tmp_path):
+    pub, broker = start(tmp_path, messages(2))
+    confirm(pub, broker.tags(b'body1')[-1])
+    for attempt in range(MAX_ATTEMPTS):
+        assert len(broker.tags(b'body0')) == attempt + 1
+        confirm(pub, broker.tags(b'body0')[-1], ack=False)
+
+    assert len(broker.tags(b'body0')) == MAX_ATTEMPTS
+    assert load_ledger(pub.ledger_file) == {'P1'}
+    stats = pub.stats()
+    assert stats['failed'] == ['P0']
+    assert stats['nacked'] == MAX_ATTEMPTS
+    assert stats['published'] == MAX_ATTEMPTS + 1
+    assert broker.closed
+
+def test_multiple_nack_then_ack(tmp_path):
+    pub, broker = start(tmp_path, messages(3))
+    confirm(pub, 2, ack=False, multiple=True)
+    assert pub.nacked == 2
+    assert sorted(body for _, body in broker.published[3:]) == [b'body0', b'body1']
+
+    confirm(pub, 5, multiple=True)
+    assert load_ledger(pub.ledger_file) == {'P0', 'P1', 'P2'}
+    assert pub.failed == []
+    assert broker.closed
+
+def test_unknown_tag_is_ignored(tmp_path):
+    pub, broker = start(tmp_path, messages(1))
+    confirm(pub, 7)
+    assert pub.inflight and load_ledger(pub.ledger_file) == set()
+
+def test_priority_is_set_per_message(tmp_path):
+    pub, broker = start(tmp_path, [('P0', b'body0', 5), ('P1', b'body1')])
+    assert [p.priority for p in broker.properties] == [5, None]
+    assert all(p.delivery_mode == 2 for p in broker.properties)
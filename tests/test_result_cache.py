@@ -0,0 +1,52 @@
+import os
+from result_cache import ResultCache, content_fingerprint
+
+"""
+The size-bounded LRU cache and the content fingerprints in its keys.
+"""
+
+def test_fingerprint_ignores_mtime_and_location(tmp_path):
+    for node in ('node1', 'node2'):
+        os.makedirs(tmp_path / node)
+        (tmp_path / node / 'weights_1.pt').write_bytes(b'weights')
+    os.utime(tmp_path / 'node2' / 'weights_1.pt', (1, 1))
+    assert (content_fingerprint(str(tmp_path / 'node1' / 'weights_1.pt'))
+            == content_fingerprint(str(tmp_path / 'node2' / 'weights_1.pt')))
+
+def test_fingerprint_changes_with_content(tmp_path):
+    path = tmp_path / 'pdb70_hhm.ffindex'
+    missing = content_fingerprint(str(path))
+    path.write_text("1ABC_A\t0\t100\n")
+    first = content_fingerprint(str(path))
+    path.write_text("1ABC_A\t0\t101\n")
+    assert len({missing, first, content_fingerprint(str(path))}) == 3
+
+def entries_bytes(cache):
+    return cache.conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+def test_running_total_tracks_puts_and_replacements(tmp_path):
+    cache = ResultCache(str(tmp_path / 'cache.db'), max_bytes=10 ** 6)
+    cache.put('s4pred', 'k1', 'x' * 100)
+    cache.put('hhr', 'k1', 'y' * 50)
+    cache.put('s4pred', 'k1', 'z' * 30)        # Replaces the first entry
+    assert cache.total_bytes() == entries_bytes(cache) == 80
+    cache.close()
+    # Reopened (and by a second process) the total is the same
+    assert ResultCache(str(tmp_path / 'cache.db')).total_bytes() == 80
+
+def test_eviction_drops_least_recently_used(tmp_path):
+    cache = ResultCache(str(tmp_path / 'cache.db'), max_bytes=250)
+    for n in range(3):
+        cache.put('hhr', f'k{n}', 'x' * 100)
+        if n == 1:
+            cache.get('hhr', 'k0')              # k1 is now the oldest
+    assert not cache.has('hhr', 'k1')
+    assert cache.has('hhr', 'k0') and cache.has('hhr', 'k2')
+    assert cache.total_bytes() == entries_bytes(cache) == 200
+
+def test_total_is_summed_once_for_an_older_cache(tmp_path):
+    cache = ResultCache(str(tmp_path / 'cache.db'))
+    cache.put('parse', 'k', 'x' * 40)
+    cache.conn.execute("DELETE FROM meta WHERE name = 'bytes'")
+    cache.close()
+    assert ResultCache(str(tmp_path / 'cache.db')).total_bytes() == 40
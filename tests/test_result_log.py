@@ -0,0 +1,79 @@
+import os
+import time
+from result_log import ResultLog, encode, read_segment, scan_log, segment_paths
+
+"""
+ResultLog on a temporary directory: crash recovery, rotation and sharing
+segments between the writers of one node.
+"""
+
+def row(protein_id, score=160.42):
+    return f"{protein_id},2DN2_B,1.1e-27,{score},120.00,10.00,119.50"
+
+def test_torn_tail_is_truncated_on_reopen(tmp_path):
+    log = ResultLog(str(tmp_path), node='n1')
+    log.append('P1', row('P1'))
+    log.append('P2', row('P2'))
+    log.close()
+    path = log.path
+    good = os.path.getsize(path)
+    # A crash in the middle of the third write
+    with open(path, 'ab') as f:
+        f.write(encode({'id': 'P3', 'row': row('P3')})[:20])
+
+    log = ResultLog(str(tmp_path), node='n1')
+    assert os.path.getsize(path) == good
+    assert 'P2' in log and 'P3' not in log
+    log.append('P3', row('P3'))
+    log.close()
+    assert [record['query_id'] for record in read_segment(path)] == ['P1', 'P2', 'P3']
+
+def test_segments_rotate_and_sealed_indexes_are_reloaded(tmp_path):
+    record_bytes = len(encode({'id': 'P0', 'row': row('P0'), 'worker': None, 'timings': None, 'at': time.time()}))
+    log = ResultLog(str(tmp_path), node='n1', segment_bytes=3 * record_bytes + 8)
+    for i in range(7):
+        log.append(f"P{i}", row(f"P{i}"))
+    log.close()
+    paths = segment_paths(str(tmp_path), 'n1')
+    assert len(paths) == 3
+    assert all(os.path.exists(path + '.idx') for path in paths[:-1])
+    assert not os.path.exists(paths[-1] + '.idx')
+
+    # The sealed segments are indexed from .idx, not rescanned
+    with open(paths[0], 'r+b') as f:
+        f.write(b'x')
+    log = ResultLog(str(tmp_path), node='n1', segment_bytes=3 * record_bytes + 8)
+    assert len(log) == 7 and log.corrupt == 0
+    assert log.lookup('P5') == row('P5')
+    log.close()
+
+def test_other_writers_segments_are_read(tmp_path):
+    first = ResultLog(str(tmp_path), node='host.1')
+    first.append('P1', row('P1'))
+    first.sync()
+    second = ResultLog(str(tmp_path), node='host.2')
+    assert 'P1' in second and second.count_own() == 0
+    assert second.lookup('P1') == row('P1')
+    second.append('P1', row('P1', score=99.0))
+    assert second.count_own() == 1
+    second.close()
+    first.close()
+    # Only its own segments are written to
+    assert len(segment_paths(str(tmp_path), 'host.1')) == 1
+    assert len(segment_paths(str(tmp_path), 'host.2')) == 1
+
+def test_corrupt_records_are_skipped(tmp_path):
+    log = ResultLog(str(tmp_path), node='n1')
+    log.append('P1', row('P1'))
+    log.append('P2', row('P2'))
+    log.close()
+    with open(log.path, 'r+b') as f:
+        f.seek(20)
+        f.write(b'#')
+
+    latest, records, corrupt = scan_log(str(tmp_path))
+    assert (set(latest), records, corrupt) == ({'P2'}, 1, 1)
+    assert [record['query_id'] for record in read_segment(log.path)] == ['P2']
+    log = ResultLog(str(tmp_path), node='n1')
+    assert 'P1' not in log and 'P2' in log and log.corrupt == 1
+    log.close()
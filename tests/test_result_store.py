@@ -0,0 +1,45 @@
+import json
+from result_store import ResultStore, record_from_message
+from result_cache import sequence_key
+
+"""
+ResultStore on a temporary database.
+"""
+
+VERSIONS = {'s4pred': 'aaaa', 'hhsearch': 'HHsearch 3.3.0;bbbb;'}
+ROW = "sp|Q9D0L4|ADCK1_MOUSE,2DN2_B,1.1e-27,160.42,120.00,10.00,119.50"
+
+def row_for(protein_id):
+    return protein_id + ROW[ROW.index(','):]
+
+def message(protein_id, sequence, row=ROW, status='done'):
+    key = sequence_key(sequence, VERSIONS['s4pred'], VERSIONS['hhsearch'])
+    return json.loads(json.dumps({'id': protein_id, 'status': status, 'row': row, 'worker': 'w1',
+                                  'timings': {}, 'key': key, 'versions': VERSIONS}))
+
+def test_solved_sequences_are_found_under_any_id(tmp_path):
+    store = ResultStore(str(tmp_path / 'results.db'))
+    assert store.lookup_solved('MKV') is None
+    store.add_results([record_from_message(message('sp|Q9D0L4|ADCK1_MOUSE', 'MKV'))])
+    assert store.lookup_solved('mkv\n') == ROW.split(',', 1)[1]
+    assert store.lookup_solved('MKVL') is None
+    store.close()
+
+def test_failed_results_are_not_reused(tmp_path):
+    store = ResultStore(str(tmp_path / 'results.db'))
+    store.add_results([record_from_message(message('P1', 'MKV', row=None, status='failed'))])
+    assert store.lookup_solved('MKV') is None
+    store.close()
+
+def test_a_failed_row_never_replaces_a_success(tmp_path):
+    store = ResultStore(str(tmp_path / 'results.db'))
+    store.add_results([record_from_message(message('P1', 'MKV', row=row_for('P1')))])
+    # A late failure from a speculative copy or a redelivery
+    store.add_results([record_from_message(message('P1', 'MKV', row=None, status='failed'))])
+    assert [r['status'] for r in store.get('P1')] == ['done']
+    assert store.by_status('failed') == []
+
+    store.add_results([record_from_message(message('P2', 'MKV', row=None, status='failed'))])
+    store.add_results([record_from_message(message('P2', 'MKV', row=row_for('P2')))])
+    assert [(r['status'], r['best_hit']) for r in store.get('P2')] == [('done', '2DN2_B')]
+    store.close()
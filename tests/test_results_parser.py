@@ -0,0 +1,45 @@
+import os
+import sys
+import importlib
+import pytest
+
+"""
+Golden files for results_parser: hhsearch .hhr outputs and the
+hhr_parse.out written for them by the original Bio.SearchIO + numpy/scipy
+implementation (bench_hhr_parser.biopython_row).
+
+    hit.hhr     several hits below 1e-5
+    nan.hhr     no hit below 1e-5 -> nan statistics
+    repeat.hhr  a template listed twice (only its first block counts)
+"""
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+CASES = ('hit', 'nan', 'repeat')
+
+@pytest.fixture
+def parser(monkeypatch):
+    # None in sys.modules makes any import of these fail
+    for name in ('Bio', 'numpy', 'scipy'):
+        monkeypatch.setitem(sys.modules, name, None)
+    monkeypatch.delitem(sys.modules, 'results_parser', raising=False)
+    return importlib.import_module('results_parser')
+
+@pytest.mark.parametrize('case', CASES)
+def test_golden_output(parser, case, tmp_path):
+    out_file = tmp_path / 'hhr_parse.out'
+    parser.write_parse_output(parser.parse_hhr(os.path.join(DATA_DIR, f'{case}.hhr')), str(out_file))
+    with open(os.path.join(DATA_DIR, f'{case}_parse.out')) as f:
+        assert out_file.read_text() == f.read()
+
+def test_row_round_trip(parser):
+    with open(os.path.join(DATA_DIR, 'hit_parse.out')) as f:
+        row = f.read().splitlines()[1]
+    assert parser.format_record(parser.record_from_row(row)) == row
+
+def test_no_hits(parser, tmp_path):
+    hhr_file = tmp_path / 'empty.hhr'
+    with open(os.path.join(DATA_DIR, 'hit.hhr')) as f:
+        preamble = f.read().split('\n\n')[0]
+    hhr_file.write_text(preamble + '\n\n No Hit                             Prob E-value P-value  Score\n\nDone!\n')
+    with pytest.raises(ValueError):
+        parser.parse_hhr(str(hhr_file))
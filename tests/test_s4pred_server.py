@@ -0,0 +1,150 @@
+import os
+import sys
+import types
+import time
+import random
+import threading
+from concurrent.futures import Future
+import pytest
+from s4pred_server import BatchPredictor, S4PredServer, RequestHandler, predict_horiz
+
+"""
+BatchPredictor with a fake model in place of S4Pred: predict() is replaced,
+and S4Pred's utilities.loadfasta by a reader that returns the records out of
+order and rejects non-letters, so encode() runs as on a worker.
+"""
+
+@pytest.fixture
+def loaded(monkeypatch):
+    paths = []
+
+    def loadfasta(path):
+        paths.append(path)
+        with open(path) as f:
+            lines = f.read().split()
+        items = [[header[1:], sequence, [ord(c) for c in sequence]]
+                 for header, sequence in zip(lines[::2], lines[1::2])]
+        if any(not sequence.isalpha() for _, sequence, _ in items):
+            raise ValueError("bad residue")
+        random.Random(len(items)).shuffle(items)
+        return items
+
+    monkeypatch.setitem(sys.modules, 'utilities', types.SimpleNamespace(loadfasta=loadfasta))
+    return paths
+
+class FakePredictor(BatchPredictor):
+    def __init__(self, fail_length=None, seconds=0.0, **kwargs):
+        super().__init__(model=None, device=None, **kwargs)
+        self.fail_length = fail_length
+        self.seconds = seconds  # Per pass; sleeping releases the GIL, as torch does
+        self.calls = []     # names per forward pass
+
+    def predict(self, names, encoded):
+        lengths = {len(item[2]) for item in encoded}
+        assert len(lengths) == 1, "a forward pass mixes lengths"
+        self.calls.append(list(names))
+        if self.fail_length in lengths:
+            raise RuntimeError("model failed")
+        time.sleep(self.seconds)
+        return [f"{name} {item[1]}\n" for name, item in zip(names, encoded)]
+
+def batch_of(*records):
+    return [(name, sequence, Future()) for name, sequence in records]
+
+def test_equal_lengths_share_a_forward_pass(loaded):
+    predictor = FakePredictor()
+    batch = batch_of(('a', 'MKV'), ('b', 'MKVLA'), ('c', 'GGG'), ('d', 'AAAAA'), ('e', 'W'))
+    predictor.predict_batch(batch)
+    for _, _, future in batch:
+        future.result(timeout=5)
+    assert sorted(map(sorted, predictor.calls)) == [['a', 'c'], ['b', 'd'], ['e']]
+
+def test_results_map_back_to_callers(loaded):
+    predictor = FakePredictor()
+    records = [(f"p{i}", 'ACDEFGHIK'[:i % 4 + 1] * 2) for i in range(12)]
+    batch = batch_of(*records)
+    predictor.predict_batch(batch)
+    for (name, sequence), (_, _, future) in zip(records, batch):
+        assert future.result(timeout=5) == f"{name} {sequence}\n"
+    assert not any(os.path.exists(path) for path in loaded)
+
+def test_failed_pass_fails_only_its_callers(loaded):
+    predictor = FakePredictor(fail_length=3)
+    batch = batch_of(('a', 'MKV'), ('b', 'MKVL'), ('c', 'GGG'))
+    predictor.predict_batch(batch)
+    for _, _, future in (batch[0], batch[2]):
+        with pytest.raises(RuntimeError):
+            future.result(timeout=5)
+    assert batch[1][2].result(timeout=5) == "b MKVL\n"
+
+def test_encode_error_fails_the_whole_batch(loaded):
+    predictor = FakePredictor()
+    batch = batch_of(('a', 'MKV'), ('b', 'MK1'))
+    predictor.predict_batch(batch)
+    for _, _, future in batch:
+        with pytest.raises(ValueError):
+            future.result(timeout=5)
+    assert predictor.calls == []
+    # The batch FASTA is removed when loadfasta raises
+    assert loaded and not any(os.path.exists(path) for path in loaded)
+
+def requests_per_second(socket_path, clients):
+    """
+    Throughput of `clients` concurrent single-sequence requests, all of different lengths.
+    """
+    errors = []
+
+    def client(n):
+        try:
+            predict_horiz([(f"p{n}", 'A' * (n + 1))], socket_path, timeout=10)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=client, args=(n,)) for n in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    return clients / (time.perf_counter() - start)
+
+def test_concurrent_clients_are_predicted_in_parallel(loaded, tmp_path):
+    predictors = 4
+    socket_path = str(tmp_path / 's4pred.sock')
+    predictor = FakePredictor(seconds=0.2, window=0.01, predictors=predictors)
+    threading.Thread(target=predictor.serve_forever, daemon=True).start()
+    with S4PredServer(socket_path, RequestHandler) as server:
+        server.predictor = predictor
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            one = requests_per_second(socket_path, 1)
+            many = requests_per_second(socket_path, predictors)
+        finally:
+            server.shutdown()
+    # A single predictor thread would keep this near 1x
+    assert many > 2 * one
+
+def test_hung_server_falls_back_to_run_model(tmp_path, monkeypatch):
+    import socket
+    import pipeline_script
+    import s4pred_server
+
+    # Accepts connections and never answers
+    hung = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    hung.bind(str(tmp_path / 'hung.sock'))
+    hung.listen()
+    run_model = tmp_path / 'run_model.py'
+    run_model.write_text("print('# PSIPRED HFORMAT (S4PRED)')\n")
+    monkeypatch.setattr(pipeline_script, 'S4PRED_SOCKET', str(tmp_path / 'hung.sock'))
+    monkeypatch.setattr(s4pred_server, 'REQUEST_TIMEOUT', 0.2)
+    monkeypatch.setattr(pipeline_script, 'S4PRED_SCRIPT', str(run_model))
+
+    with pytest.raises(TimeoutError):
+        predict_horiz([('p', 'MKV')], str(tmp_path / 'hung.sock'), timeout=0.2)
+    (tmp_path / 'in.fas').write_text(">p\nMKV\n")
+    start = time.perf_counter()
+    pipeline_script.run_s4pred(str(tmp_path / 'in.fas'), str(tmp_path / 'out.horiz'))
+    assert 0.2 <= time.perf_counter() - start < 5
+    assert (tmp_path / 'out.horiz').read_text().startswith('# PSIPRED')
+    hung.close()
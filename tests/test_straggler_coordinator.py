@@ -0,0 +1,42 @@
+from straggler_coordinator import RunState
+
+"""
+RunState built from consumer events, with explicit receive times.
+"""
+
+def start(state, worker, task_id, now, slots=2, expected=10):
+    state.apply({'event': 'start', 'worker': worker, 'slots': slots, 'id': task_id,
+                 'sequence': 'MKV', 'expected': expected}, now)
+
+def test_free_slots_and_stragglers():
+    state = RunState()
+    start(state, 'w1', 'P1', 0)
+    state.apply({'event': 'alive', 'worker': 'w2', 'slots': 2}, 0)
+    assert state.free_slots() == 3
+    assert [task['id'] for _, _, task in state.stragglers(100, 3.0, 30)] == ['P1']
+    state.apply({'event': 'finish', 'worker': 'w1', 'slots': 2, 'id': 'P1', 'status': 'done'}, 101)
+    assert state.free_slots() == 4
+    assert state.stragglers(200, 3.0, 30) == []
+
+def test_draining_worker_has_no_free_slots():
+    state = RunState()
+    start(state, 'w1', 'P1', 0)
+    state.apply({'event': 'stop', 'worker': 'w1', 'slots': 2, 'draining': True}, 1)
+    assert state.free_slots() == 0
+    # Its running task is still tracked until it finishes
+    assert state.stragglers(100, 3.0, 30)
+    # The same instance name started again
+    state.apply({'event': 'alive', 'worker': 'w1', 'slots': 2, 'draining': False}, 200)
+    assert state.free_slots() == 1
+
+def test_silent_workers_are_forgotten_with_their_tasks():
+    state = RunState()
+    start(state, 'w1', 'P1', 0)
+    start(state, 'w2', 'P2', 0)
+    for now in (60, 120, 180, 240):
+        state.apply({'event': 'alive', 'worker': 'w2', 'slots': 2}, now)
+    assert state.expire(250, 180) == ['w1']
+    assert state.free_slots() == 1
+    # P1 is redelivered by RabbitMQ, not speculated
+    assert [task['id'] for _, _, task in state.stragglers(250, 3.0, 30)] == ['P2']
+    assert state.expire(250, 180) == []
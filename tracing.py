@@ -0,0 +1,260 @@
+import os
+import sys
+import json
+import math
+import time
+import uuid
+import socket
+import argparse
+import contextlib
+import collections
+
+"""
+usage: python3 tracing.py report [PATH ...] [--slowest N] [--bucket SECONDS] [--width COLS]
+
+Per-task tracing. The producer gives every task a trace ID that travels
+with its message (also through retries, bundles and speculative copies).
+The worker process that runs the task appends one JSON line per span to
+TRACE_DIR/<node>-<pid>.jsonl:
+
+    {"trace", "task", "span", "start", "seconds", "node", "pid", ...}
+
+Spans: queue_wait (producer enqueue -> delivery to the worker: the broker),
+pool_wait (delivery -> a free process slot), write_input, s4pred,
+a3m_build, hhsearch (or hhsearch_batch for a bundle), parse, write_result,
+result_publish and one 'task' span around the whole run. start is wall
+clock time, so queue_wait across machines relies on synchronised clocks.
+
+`report` merges the logs of all nodes (files or directories, searched
+recursively; default TRACE_DIR) into the critical-path breakdown per stage
+and per category (broker / local queue / I/O / compute), a utilisation
+timeline per node and the slowest N tasks.
+"""
+
+# ==========================================
+# Configuration
+# ==========================================
+TRACE_DIR = os.environ.get('TRACE_DIR', os.path.expanduser('~/traces'))   # Empty: tracing off
+NODE = socket.gethostname()
+CATEGORIES = {
+    'queue_wait': 'broker', 'result_publish': 'broker',
+    'pool_wait': 'local queue',
+    'write_input': 'I/O', 'a3m_build': 'I/O', 'write_result': 'I/O',
+    's4pred': 'compute', 'hhsearch': 'compute', 'hhsearch_batch': 'compute', 'parse': 'compute',
+}
+STAGE_ORDER = ('queue_wait', 'pool_wait', 'write_input', 's4pred', 'a3m_build', 'hhsearch',
+               'hhsearch_batch', 'parse', 'write_result', 'result_publish')
+BARS = ' ▁▂▃▄▅▆▇█'
+# ==========================================
+
+_log = None
+_log_pid = None
+_context = {}       # Current task of this process: {'trace', 'task', ...}
+
+def new_trace_id():
+    return uuid.uuid4().hex[:16]
+
+def _write(record):
+    """
+    Append one span. One file per process, so lines never interleave;
+    reopened after a fork. Tracing never fails a task.
+    """
+    global _log, _log_pid
+    if not TRACE_DIR:
+        return
+    try:
+        if _log is None or _log_pid != os.getpid():
+            os.makedirs(TRACE_DIR, exist_ok=True)
+            _log = open(os.path.join(TRACE_DIR, f"{NODE}-{os.getpid()}.jsonl"), 'a', buffering=1)
+            _log_pid = os.getpid()
+        _log.write(json.dumps(record) + "\n")
+    except (OSError, ValueError) as e:
+        print(f" [Warning] Could not write trace span: {e}")
+
+def emit(name, start, seconds, trace=None, task=None, **attrs):
+    """
+    Record a span that has already finished; trace/task default to the current task.
+    """
+    record = {'trace': trace or _context.get('trace'), 'task': task or _context.get('task'),
+              'span': name, 'start': start, 'seconds': seconds, 'node': NODE, 'pid': os.getpid()}
+    for key, value in _context.items():
+        record.setdefault(key, value)
+    record.update(attrs)
+    _write(record)
+
+@contextlib.contextmanager
+def span(name, **attrs):
+    """
+    Time the enclosed block as a span of the current task; an exception is
+    recorded as the span's error and re-raised.
+    """
+    start = time.time()
+    t0 = time.perf_counter()
+    try:
+        yield attrs
+    except BaseException as e:
+        attrs['error'] = type(e).__name__
+        raise
+    finally:
+        emit(name, start, time.perf_counter() - t0, **attrs)
+
+@contextlib.contextmanager
+def task(trace_id, protein_id, **attrs):
+    """
+    Make (trace_id, protein_id) the current task of this process; extra
+    attrs (attempt, slots, ...) are added to every span it emits. Messages
+    from before tracing have no trace ID: their spans share trace None.
+    """
+    global _context
+    previous = _context
+    _context = dict(attrs, trace=trace_id, task=protein_id)
+    try:
+        yield _context
+    finally:
+        _context = previous
+
+# ---------- Report ----------
+
+def read_spans(paths):
+    spans = []
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                files.extend(os.path.join(root, n) for n in names if n.endswith('.jsonl'))
+        else:
+            files.append(path)
+    for path in files:
+        with open(path) as f:
+            for line in f:
+                try:
+                    spans.append(json.loads(line))
+                except ValueError:
+                    continue    # Line cut short by a crash
+    return spans, len(files)
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(math.ceil(q * len(values))) - 1)]
+
+def group_tasks(spans):
+    """
+    {(trace, task): {'stages': {stage: seconds}, 'start', 'end', 'node', 'status'}}.
+    A batch hhsearch span counts in full for every task of its bundle: each
+    of them waited for all of it.
+    """
+    tasks = {}
+    for s in spans:
+        members = [(s['trace'], s['task'])] if s.get('task') else [tuple(m) for m in s.get('members', ())]
+        for key in members:
+            t = tasks.setdefault(key, {'stages': collections.Counter(), 'start': math.inf, 'end': 0.0,
+                                       'node': s['node'], 'status': None})
+            t['start'] = min(t['start'], s['start'])
+            t['end'] = max(t['end'], s['start'] + s['seconds'])
+            if s['span'] == 'task':
+                t['node'] = s['node']
+                t['status'] = s.get('status')
+            else:
+                t['stages'][s['span']] += s['seconds']
+    return tasks
+
+def critical_path(tasks):
+    """
+    Per stage: [total, mean, p50, p95, share of all end-to-end time], plus
+    'other' (gaps, e.g. retry back-off), and the totals per category.
+    """
+    end_to_end = sum(t['end'] - t['start'] for t in tasks.values())
+    by_stage = collections.defaultdict(list)
+    for t in tasks.values():
+        for stage, seconds in t['stages'].items():
+            by_stage[stage].append(seconds)
+    rows = {}
+    categories = collections.Counter()
+    for stage in sorted(by_stage, key=lambda s: STAGE_ORDER.index(s) if s in STAGE_ORDER else len(STAGE_ORDER)):
+        values = by_stage[stage]
+        rows[stage] = (sum(values), sum(values) / len(tasks), percentile(values, 0.5),
+                       percentile(values, 0.95), sum(values) / end_to_end if end_to_end else 0.0)
+        categories[CATEGORIES.get(stage, 'other')] += sum(values)
+    other = max(0.0, end_to_end - sum(categories.values()))
+    categories['other'] += other
+    return rows, categories, end_to_end
+
+def utilisation(spans, bucket):
+    """
+    {node: (slots, [busy fraction per bucket])} from the 'task' spans, on a
+    common time axis starting at the first task.
+    """
+    runs = [s for s in spans if s['span'] == 'task']
+    if not runs:
+        return 0.0, {}
+    origin = min(s['start'] for s in runs)
+    n_buckets = int((max(s['start'] + s['seconds'] for s in runs) - origin) // bucket) + 1
+    busy = collections.defaultdict(lambda: [0.0] * n_buckets)
+    slots = collections.Counter()
+    for s in runs:
+        slots[s['node']] = max(slots[s['node']], s.get('slots') or 1)
+        start, end = s['start'] - origin, s['start'] - origin + s['seconds']
+        for b in range(int(start // bucket), int(end // bucket) + 1):
+            overlap = min(end, (b + 1) * bucket) - max(start, b * bucket)
+            if overlap > 0:
+                # A bundle is one job: each of its K tasks holds 1/K of the slot
+                busy[s['node']][b] += overlap * s.get('share', 1)
+    return origin, {node: (slots[node], [min(1.0, v / (slots[node] * bucket)) for v in values])
+                    for node, values in busy.items()}
+
+def report(paths, slowest=10, bucket=60.0, width=60):
+    spans, n_files = read_spans(paths)
+    tasks = group_tasks(spans)
+    if not tasks:
+        print(f"No spans found in {', '.join(paths)}")
+        return
+    nodes = sorted({s['node'] for s in spans})
+    print(f"📄 {len(spans)} spans from {n_files} logs, {len(tasks)} tasks on {len(nodes)} nodes")
+
+    rows, categories, end_to_end = critical_path(tasks)
+    print(f"\nCritical path (end-to-end {end_to_end:.0f}s over all tasks, mean {end_to_end / len(tasks):.1f}s)")
+    print(f"  {'stage':16s} {'total s':>10s} {'mean s':>9s} {'p50 s':>9s} {'p95 s':>9s} {'share':>7s}")
+    for stage, (total, mean, p50, p95, share) in rows.items():
+        print(f"  {stage:16s} {total:10.1f} {mean:9.2f} {p50:9.2f} {p95:9.2f} {share:7.1%}")
+    print("  by category: " + ", ".join(
+        f"{name} {seconds / end_to_end:.1%}" for name, seconds in categories.most_common() if end_to_end))
+
+    origin, timeline = utilisation(spans, bucket)
+    if timeline:
+        print(f"\nUtilisation per node ({bucket:g}s per column from "
+              f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(origin))}, busy slots / slots)")
+        for node in sorted(timeline):
+            slots, values = timeline[node]
+            # Squeeze long runs into width columns (mean of the merged buckets)
+            step = max(1, math.ceil(len(values) / width))
+            merged = [sum(values[i:i + step]) / len(values[i:i + step]) for i in range(0, len(values), step)]
+            bar = ''.join(BARS[round(v * (len(BARS) - 1))] for v in merged)
+            print(f"  {node:20s} {slots:2d} slots {sum(values) / len(values):6.1%} |{bar}|")
+
+    print(f"\nSlowest {min(slowest, len(tasks))} tasks")
+    ranked = sorted(tasks.items(), key=lambda kv: -(kv[1]['end'] - kv[1]['start']))
+    for (trace, protein_id), t in ranked[:slowest]:
+        top = ', '.join(f"{stage} {seconds:.1f}s" for stage, seconds in t['stages'].most_common(3))
+        print(f"  {t['end'] - t['start']:9.1f}s {protein_id} [{t['node']}, {t['status'] or '?'}] {top}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Task trace logs")
+    sub = parser.add_subparsers(dest='command', required=True)
+    rep = sub.add_parser('report', help="Critical path, node utilisation and slowest tasks")
+    rep.add_argument('paths', nargs='*', help=f"Trace files or directories (default: {TRACE_DIR})")
+    rep.add_argument('--slowest', type=int, default=10, help="Slowest tasks to list (default: 10)")
+    rep.add_argument('--bucket', type=float, default=60.0, help="Seconds per timeline column (default: 60)")
+    rep.add_argument('--width', type=int, default=60, help="Maximum timeline columns (default: 60)")
+    args = parser.parse_args()
+
+    paths = args.paths or [TRACE_DIR]
+    for path in paths:
+        if not os.path.exists(path):
+            print(f"❌ Error: File not found {path}")
+            sys.exit(1)
+    report(paths, args.slowest, args.bucket, args.width)
+
+if __name__ == '__main__':
+    main()